@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+benchmark of finding the report and timestamp tokens in a noisy browser log:
+a pair of utils.findall scans per token pair (utils.tokenize) versus the
+single pass of BrowserLogResults.scan; and parsing the log file versus
+loading its sidecar (BrowserLogResults with a cache_dir)
+"""
+
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import talos.utils
+from talos.results import BrowserLogResults
+
+def browser_log(lines, pages=100, runs=25):
+    """a synthetic tpformat browser log with `lines` lines of noise"""
+    noise = []
+    for i in range(lines):
+        if i % 20 == 0:
+            noise.append('RSS: Main: %d' % random.randint(10**7, 10**8))
+        elif i % 20 == 1:
+            noise.append('MOZ_EVENT_TRACE sample %d %d' % (i, random.randint(10, 100)))
+        else:
+            noise.append('[JavaScript Warning: "__noisy_%d %s" {file: "http://localhost/tp5n/page.html" line: 0}]' % (i, 'x' * random.randint(0, 80)))
+    report = ['__start_tp_report_x_x_mozilla_page_load',
+              '_x_x_mozilla_page_load_details',
+              '|i|pagename|runs|']
+    for index in range(pages):
+        values = ';'.join(['%d' % random.randint(100, 1000) for i in range(runs)])
+        report.append('|%d;page%d.html;%s' % (index, index, values))
+    report.append('__end_tp_report')
+    timestamps = ['__startTimestamp1333663595953__endTimestamp',
+                  '__startBeforeLaunchTimestamp1333663595557__endBeforeLaunchTimestamp',
+                  '__startAfterTerminationTimestamp1333663596551__endAfterTerminationTimestamp']
+    middle = len(noise) / 2
+    return '\n'.join(noise[:middle] + report + noise[middle:] + timestamps) + '\n'
+
+def tokenize(log):
+    """BrowserLogResults.parse before the single-pass scan"""
+    talos.utils.findall(log, BrowserLogResults.fail_token)
+    for attr, tokens in BrowserLogResults.report_tokens + BrowserLogResults.time_tokens:
+        talos.utils.tokenize(log, *tokens)
+
+def main(args=sys.argv[1:]):
+    parser = optparse.OptionParser(usage='%prog [options]', description=__doc__)
+    parser.add_option('--lines', dest='lines', type='int', default=100000,
+                      help="lines of noise in the log [DEFAULT: %default]")
+    parser.add_option('--repeat', dest='repeat', type='int', default=5,
+                      help="timings to take the best of [DEFAULT: %default]")
+    options, args = parser.parse_args(args)
+
+    random.seed(0)
+    log = browser_log(options.lines)
+    print 'browser log: %d lines, %.1f MB' % (options.lines, len(log) / 1e6)
+
+    before = min(timeit.repeat(lambda: tokenize(log), repeat=options.repeat, number=1))
+    after = min(timeit.repeat(lambda: BrowserLogResults(results_raw=log), repeat=options.repeat, number=1))
+    print '%-45s %10.3f s' % ('utils.tokenize per token pair', before)
+    print '%-45s %10.3f s' % ('BrowserLogResults (scan and parse)', after)
+    print '%-45s %10.2fx' % ('speedup', before / after)
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, 'browser.log')
+        with open(filename, 'w') as f:
+            f.write(log)
+        counters = lambda: {'Main_RSS': []}
+        parsed = min(timeit.repeat(lambda: BrowserLogResults(filename, counter_results=counters()),
+                                   repeat=options.repeat, number=1))
+        cache_dir = os.path.join(tempdir, 'cache')
+        os.mkdir(cache_dir)
+        BrowserLogResults(filename, counter_results=counters(), cache_dir=cache_dir)
+        loaded = min(timeit.repeat(lambda: BrowserLogResults(filename, counter_results=counters(), cache_dir=cache_dir),
+                                   repeat=options.repeat, number=1))
+    finally:
+        shutil.rmtree(tempdir)
+    print '%-45s %10.3f s' % ('BrowserLogResults (parse the file)', parsed)
+    print '%-45s %10.3f s' % ('BrowserLogResults (load the sidecar)', loaded)
+    print '%-45s %10.2fx' % ('speedup', parsed / loaded)
+
+if __name__ == '__main__':
+    main()
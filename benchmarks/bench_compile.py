@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+micro-benchmark of per-result filter chain overhead when generating
+graphserver values: re-validating the chain for every cycle's results
+(filter.filters_args) versus the cached filter.compile
+"""
+
+import optparse
+import os
+import random
+import sys
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import talos.filter
+import talos.results
+
+def pageloader_results(pages, runs):
+    """a synthetic tpformat report"""
+    lines = ['_x_x_mozilla_page_load', '_x_x_mozilla_page_load_details', '|i|pagename|runs|']
+    for index in range(pages):
+        values = ';'.join(['%d' % random.randint(100, 1000) for i in range(runs)])
+        lines.append('|%d;page%d.html;%s' % (index, index, values))
+    return talos.results.PageloaderResults('\n'.join(lines))
+
+def revalidated(results, spec):
+    """GraphserverOutput's loop before chains were compiled"""
+    vals = []
+    for result in results:
+        vals.extend(result.values(talos.filter.filters_args(spec)))
+    return vals
+
+def compiled(results, spec):
+    """GraphserverOutput's loop now: the chain is looked up once per test"""
+    _filters = talos.filter.compile(spec)
+    vals = []
+    for result in results:
+        vals.extend(result.values(_filters))
+    return vals
+
+def bench(label, function, repeat, number):
+    best = min(timeit.repeat(function, repeat=repeat, number=number))
+    print '%-45s %10.2f us' % (label, 1e6 * best / number)
+    return best
+
+def main(args=sys.argv[1:]):
+    parser = optparse.OptionParser(usage='%prog [options]', description=__doc__)
+    parser.add_option('--cycles', dest='cycles', type='int', default=25,
+                      help="results (cycles) per test [DEFAULT: %default]")
+    parser.add_option('--pages', dest='pages', type='int', default=1,
+                      help="pages per result [DEFAULT: %default]")
+    parser.add_option('--runs', dest='runs', type='int', default=5,
+                      help="runs per page [DEFAULT: %default]")
+    parser.add_option('--number', dest='number', type='int', default=2000,
+                      help="loops per timing [DEFAULT: %default]")
+    options, args = parser.parse_args(args)
+
+    random.seed(0)
+    spec = [['ignore_first', [1]], ['median', []]]
+    results = [pageloader_results(options.pages, options.runs)
+               for i in range(options.cycles)]
+    assert revalidated(results, spec) == compiled(results, spec)
+
+    print 'chain lookup, per result:'
+    before = bench('  filter.filters_args', lambda: talos.filter.filters_args(spec), 3, options.number)
+    after = bench('  filter.compile (cached)', lambda: talos.filter.compile(spec), 3, options.number)
+    print '  %-45s %10.2fx' % ('speedup', before / after)
+
+    print 'values for %d results of %d page(s) x %d runs:' % (options.cycles, options.pages, options.runs)
+    before = bench('  re-validated per result', lambda: revalidated(results, spec), 3, options.number / 10)
+    after = bench('  compiled once', lambda: compiled(results, spec), 3, options.number / 10)
+    print '  %-45s %10.2fx' % ('speedup', before / after)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+benchmark the selection-based order statistic filters in talos.filter
+against the sort-based implementations they replace
+"""
+
+import optparse
+import os
+import random
+import sys
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+import talos.filter
+
+### sort-based reference implementations
+
+def sorted_median(series):
+    """talos.filter.median before selection"""
+    series = sorted(series)
+    if len(series) % 2:
+        return series[len(series)/2]
+    middle = len(series)/2
+    return 0.5*(series[middle-1] + series[middle])
+
+def sorted_percentile(series, p):
+    series = sorted(series)
+    rank = (len(series) - 1) * (p / 100.)
+    lower = int(rank)
+    upper = min(lower + 1, len(series) - 1)
+    return series[lower] + (series[upper] - series[lower])*(rank - lower)
+
+def sorted_trimmed_mean(series, number):
+    series = sorted(series)[number:len(series)-number]
+    return sum(series)/float(len(series))
+
+def sorted_chain(data):
+    """ignore_max, ignore_min, median as computed before selection"""
+    for f in (talos.filter.ignore_max, talos.filter.ignore_min, sorted_median):
+        data = f(data)
+    return data
+
+def bench(label, function, repeat, number):
+    best = min(timeit.repeat(function, repeat=repeat, number=number))
+    print '%-40s %10.1f us' % (label, 1e6 * best / number)
+    return best
+
+def main(args=sys.argv[1:]):
+    parser = optparse.OptionParser(usage='%prog [options]', description=__doc__)
+    parser.add_option('--sizes', dest='sizes', default='25,250,2500,25000,250000',
+                      help="comma-separated series lengths [DEFAULT: %default]")
+    parser.add_option('--repeat', dest='repeat', type='int', default=3,
+                      help="timing repetitions [DEFAULT: %default]")
+    parser.add_option('--no-numpy', dest='numpy',
+                      action='store_false', default=True,
+                      help="benchmark the pure python selection")
+    options, args = parser.parse_args(args)
+    if not options.numpy:
+        talos.filter.numpy = None
+
+    random.seed(0)
+    for size in [int(i) for i in options.sizes.split(',')]:
+        series = [random.uniform(100, 1000) for i in range(size)]
+        number = max(1, 250000 / size)
+        print 'series of %d values (%d loops)' % (size, number)
+        for name, old, new in [('median', lambda: sorted_median(series),
+                                lambda: talos.filter.median(series)),
+                               ('percentile:90', lambda: sorted_percentile(series, 90),
+                                lambda: talos.filter.percentile(series, 90)),
+                               ('trimmed_mean:5', lambda: sorted_trimmed_mean(series, 5),
+                                lambda: talos.filter.trimmed_mean(series, 5))]:
+            before = bench('  %s (sort)' % name, old, options.repeat, number)
+            after = bench('  %s (select)' % name, new, options.repeat, number)
+            print '  %-40s %10.2fx' % ('speedup', before / after)
+
+        chain = talos.filter.filters_args([['ignore_max', []], ['ignore_min', []], ['median', []]])
+        before = bench('  ignore_max,ignore_min,median (sort)',
+                       lambda: sorted_chain(series), options.repeat, number)
+        after = bench('  ignore_max,ignore_min,median (select)',
+                      lambda: talos.filter.apply(series, chain), options.repeat, number)
+        print '  %-40s %10.2fx' % ('speedup', before / after)
+
+if __name__ == '__main__':
+    main()
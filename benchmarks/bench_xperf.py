@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+benchmark of accumulating xperf counters over the cycles of a test from
+synthetic etlparser csv files: parsing the files every cycle, as
+BrowserLogResults.xperf did, versus the cached, indexed XperfCSV readers
+"""
+
+import csv
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+from talos.results import BrowserLogResults
+
+mainthread_counters = ['mainthread_readcount', 'mainthread_readbytes',
+                       'mainthread_writecount', 'mainthread_writebytes']
+
+def write_csvs(rows):
+    """write etl_output_thread_stats.csv and etl_output.csv to the current directory"""
+    threads = ['main', 'nonmain']
+    stages = ['startup', 'normal', 'shutdown']
+    counters = ['file_io_bytes', 'net_io_bytes']
+    with open('etl_output_thread_stats.csv', 'w') as f:
+        f.write('thread, stage, counter, value\n')
+        for i in xrange(rows):
+            f.write('%s, %s, %s, %d\n' % (random.choice(threads), random.choice(stages),
+                                          random.choice(counters), random.randint(0, 10**6)))
+    with open('etl_output.csv', 'w') as f:
+        f.write('filename, tid, stage, readcount, readbytes, writecount, writebytes\n')
+        for i in xrange(rows):
+            f.write('c:\\profile\\file%d.dat, 1234 (main), startup, %d, %d, %d, %d\n' %
+                    (i, random.randint(0, 3), random.randint(0, 8192),
+                     random.randint(0, 3), random.randint(0, 8192)))
+
+def reparse(counter_results):
+    """BrowserLogResults.xperf before the csv files were cached"""
+    reader = csv.reader(file('etl_output_thread_stats.csv').read().splitlines())
+    header = None
+    for row in reader:
+        row = [i.strip() for i in row]
+        if not header:
+            header = row
+            continue
+        values = dict(zip(header, row))
+        counter = values['counter'].rsplit('_io_bytes', 1)[0]
+        counter_name = '%s_%s_%sio' % (values['thread'], values['stage'], counter)
+        if counter_name in counter_results:
+            counter_results[counter_name].append(float(values['value']))
+
+    reader = csv.reader(file('etl_output.csv').read().splitlines())
+    header = None
+    for row in reader:
+        row = [i.strip() for i in row]
+        if not header:
+            header = row
+            continue
+        values = dict(zip(header, row))
+        for counter in mainthread_counters:
+            key = counter.split('_', 1)[-1]
+            if int(values[key]) > 0:
+                counter_results[counter].append([int(values[key]), values['filename']])
+
+def counters():
+    names = ['main_startup_fileio', 'main_normal_netio', 'nonmain_normal_fileio']
+    return dict([(name, []) for name in names + mainthread_counters])
+
+def main(args=sys.argv[1:]):
+    parser = optparse.OptionParser(usage='%prog [options]', description=__doc__)
+    parser.add_option('--rows', dest='rows', type='int', default=1000000,
+                      help="rows in each csv file [DEFAULT: %default]")
+    parser.add_option('--cycles', dest='cycles', type='int', default=5,
+                      help="cycles to accumulate counters for [DEFAULT: %default]")
+    options, args = parser.parse_args(args)
+
+    random.seed(0)
+    cwd = os.getcwd()
+    tempdir = tempfile.mkdtemp()
+    try:
+        os.chdir(tempdir)
+        write_csvs(options.rows)
+        print 'csv files: %d rows each' % options.rows
+
+        before = counters()
+        start = time.time()
+        for cycle in range(options.cycles):
+            reparse(before)
+        before_time = time.time() - start
+
+        after = counters()
+        browser_log = BrowserLogResults.__new__(BrowserLogResults)
+        start = time.time()
+        for cycle in range(options.cycles):
+            browser_log.xperf(after)
+        after_time = time.time() - start
+        assert before == after
+
+        print '%-45s %10.3f s' % ('parsed every cycle (%d cycles)' % options.cycles, before_time)
+        print '%-45s %10.3f s' % ('cached and indexed', after_time)
+        print '%-45s %10.2fx' % ('speedup', before_time / after_time)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    main()
@@ -66,6 +66,7 @@ setup(name='talos',
       PerfConfigurator = talos.PerfConfigurator:main
       talos = talos.run_tests:main
       talos-results = talos.results:main
+      talos-spool = talos.spool:main
       """,
       test_suite = "runtests.runtests"
       )
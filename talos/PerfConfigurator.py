@@ -51,17 +51,52 @@ class PerfConfigurator(Configuration):
         ('results_urls', {'help': 'URL of graphserver or file:// url for local output',
                          'flags': ['--results_url'],
                          'type': list}),
+        ('graphserver_batch', {'help': 'number of results to post to the graph server in each request, if it takes several; by default each is posted on its own',
+                               'type': int,
+                               'flags': ['--graphserverBatch']}),
+        ('graphserver_gzip', {'help': 'post gzip-encoded results to the graph server, if it takes them, and gzip file:// results_urls, appending .gz',
+                              'type': bool,
+                              'flags': ['--graphserverGzip']}),
+        ('profile_cache_dir', {'help': 'directory to cache the profiles built for tests in, to clone them rather than build them again',
+                               'flags': ['--profileCacheDir']}),
+        ('profile_cache_size', {'help': 'megabytes of profiles to keep in the profile cache, evicting the least recently used',
+                                'type': int,
+                                'default': 1024,
+                                'flags': ['--profileCacheSize']}),
+        ('spool_dir', {'help': 'directory to write results to before they are sent to http:// and https:// URLs; those not sent in time are left there for talos-spool drain',
+                       'flags': ['--spoolDir']}),
+        ('spool_timeout', {'help': 'seconds to wait for results in the spool to be sent',
+                           'type': int,
+                           'default': 300,
+                           'flags': ['--spoolTimeout']}),
+        ('incremental_output', {'help': 'output the results of each test to http:// and https:// URLs in the background as soon as it finishes, while the next test runs',
+                                'type': bool,
+                                'flags': ['--incrementalOutput']}),
+        ('workers', {'help': 'number of workers to run the --parallelTests on concurrently, each with its own CPUs, display and logs; Linux only',
+                     'type': int,
+                     'default': 0,
+                     'flags': ['--workers']}),
         ('datazilla_urls', {'help': 'URL of datazilla server of file:// url for local output',
                             'flags': ['--datazilla-url'],
                             'type': list}),
         ('authfile', {'help': """File of the form
 http://hg.mozilla.org/build/buildbot-configs/file/default/mozilla/passwords.py.template
 for datazilla auth.  Should have keys 'oauthSecret' and 'oauthKey'"""}),
+        ('datazilla_gzip', {'help': 'post gzip-encoded datasets to datazilla, if it takes them, and gzip file:// datazilla_urls, appending .gz',
+                            'type': bool,
+                            'flags': ['--datazillaGzip']}),
+        ('sqlite_urls', {'help': 'file:// url of a SQLite database to add the results to',
+                         'flags': ['--sqlite-url'],
+                         'type': list}),
 
         # XXX activeTests should really use a list-thingy but can't because of
         # the one-off ':' separation :/
         ('activeTests', {'help': "List of tests to run, separated by ':' (ex. ts:tp4:tsvg)",
                          'flags': ['-a', '--activeTests']}),
+        ('parallelTests', {'help': "List of tests to run concurrently on --workers, separated by ':'; "
+                                   "they compete for memory bandwidth, GPU, disk and caches, so their numbers "
+                                   "are not comparable with those of tests run one at a time",
+                           'flags': ['--parallelTests']}),
 
         ('noChrome',  {'help': 'do not run tests as chrome',
                        'type': bool}),
@@ -103,6 +138,12 @@ for datazilla auth.  Should have keys 'oauthSecret' and 'oauthKey'"""}),
                      'default': False}),
         ('responsiveness', {'help': 'turn on responsiveness collection',
                             'type': bool}),
+        ('cc_time', {'help': 'record the time pageloader tests spend in cycle collection between page loads',
+                     'type': bool,
+                     'flags': ['--ccTime']}),
+        ('turnaround', {'help': 'record the milliseconds from the browser quitting to being ready for the next cycle, for each cycle',
+                        'type': bool,
+                        'flags': ['--turnaround']}),
         ('ignore_first', {'help': """Alternative median calculation from pageloader data.
 Use the raw values and discard the first page load instead of
 the highest value.
@@ -143,6 +184,8 @@ the highest value.
                       'default': {'cycles': 1,
                                   'profile_path': '${talos}/base_profile',
                                   'responsiveness': False,
+                                  'cc_time': False,
+                                  'turnaround': False,
                                   'resolution': 1,
                                   'rss': False,
                                   'shutdown': False,
@@ -285,6 +328,8 @@ the highest value.
     # keys to generated self.config that are global overrides to tests
     global_overrides = ['cycles',
                         'responsiveness',
+                        'cc_time',
+                        'turnaround',
                         'rss',
                         'shutdown',
                         'tpcycles',
@@ -507,6 +552,15 @@ the highest value.
             activeTests = activeTests.strip()
             activeTests = activeTests.split(':')
 
+        # tests to run on workers, only if asked: their numbers are skewed
+        parallelTests = self.config.pop('parallelTests', None) or []
+        if isinstance(parallelTests, basestring):
+            parallelTests = parallelTests.strip().split(':')
+        for test_name in parallelTests:
+            if test_name not in activeTests:
+                raise ConfigurationError("Parallel test %s is not an active test" % test_name)
+            overrides.setdefault(test_name, {})['parallel_safe'] = True
+
         # add the tests to the configuration
         # XXX extending vs over-writing?
         self.config.setdefault('tests', []).extend(self.tests(activeTests, overrides, global_overrides, counters))
@@ -771,11 +825,12 @@ the highest value.
         - a dictionary of options for each format
         """
 
-        outputs = ['results_urls', 'datazilla_urls']
+        outputs = ['results_urls', 'datazilla_urls', 'sqlite_urls']
         results_urls = dict([(key, self.config[key]) for key in outputs
                              if key in self.config])
         results_options = {}
-        options = {'datazilla_urls': ['authfile']}
+        options = {'datazilla_urls': ['authfile', 'datazilla_gzip'],
+                   'results_urls': ['graphserver_batch', 'graphserver_gzip']}
         for key, values in options.items():
             for item in values:
                 value = self.config.get(item)
@@ -801,14 +856,20 @@ the highest value.
                     'host': self.config.get('deviceip', ''), # XXX names should match!
                     'port': self.config.get('deviceport', ''), # XXX names should match!
                     'process': '',
+                    'profile_cache_dir': None,
+                    'profile_cache_size': 1024,
                     'remote': False,
                     'fennecIDs': '',
+                    'incremental_output': False,
                     'repository': 'NULL',
                     'sourcestamp': 'NULL',
+                    'spool_dir': None,
+                    'spool_timeout': 300,
                     'symbols_path': None,
                     'test_name_extension': '',
                     'test_timeout': 1200,
                     'webserver': '',
+                    'workers': 0,
                     'xperf_path': None,
                     'error_filename': None
                     }
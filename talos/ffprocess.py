@@ -15,6 +15,29 @@ from mozprocess import pid as mozpid
 class FFProcess(object):
     testAgent = None
     extra_prog=["crashreporter"] #list of extra programs to be killed
+    session = None # if set, only processes of this session are seen; see isolate
+
+    def isolate(self):
+        """
+        only see and terminate processes of this process's session, so that
+        workers running tests concurrently, each in its own session, leave
+        the others' browsers alone
+        """
+        self.session = os.getsid(0)
+
+    def get_pids(self, process_name):
+        """pids of the processes with a name, of this session if isolated"""
+        pids = mozpid.get_pids(process_name)
+        if self.session is None:
+            return pids
+        session_pids = []
+        for pid in pids:
+            try:
+                if os.getsid(pid) == self.session:
+                    session_pids.append(pid)
+            except OSError:
+                pass # it has exited
+        return session_pids
 
     def ProcessesWithNames(self, *process_names):
         """Returns a list of processes running with the given name(s):
@@ -29,7 +52,7 @@ class FFProcess(object):
         """
         processes_with_names = []
         for process_name in process_names:
-            pids = mozpid.get_pids(process_name)
+            pids = self.get_pids(process_name)
             processes_with_names.extend([(pid, process_name) for pid in pids])
 
         return processes_with_names
@@ -42,7 +65,7 @@ class FFProcess(object):
         """
         results = []
         for process_name in process_names:
-            for pid in mozpid.get_pids(process_name):
+            for pid in self.get_pids(process_name):
                 ret = self._TerminateProcess(pid, timeout)
                 if ret:
                     results.append("%s (%s): %s" % (process_name, pid, ret))
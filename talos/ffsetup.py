@@ -48,7 +48,6 @@ import os.path
 import re
 import shutil
 import tempfile
-import time
 import glob
 import zipfile
 from xml.dom import minidom
@@ -74,6 +73,7 @@ class FFSetup(object):
         if options is not None:
             self.intializeRemoteDevice(options)
         self.extensions = None
+        self.profile_key = None # key of the profile in the profile cache, if any
 
     def initializeRemoteDevice(self, options, hostproc=None):
         self._remoteWebServer = options['webserver']
@@ -196,7 +196,7 @@ class FFSetup(object):
 
         return addon_id
 
-    def CreateTempProfileDir(self, source_profile, prefs, extensions, webserver):
+    def CreateTempProfileDir(self, source_profile, prefs, extensions, webserver, profile_cache=None):
         """Creates a temporary profile directory from the source profile directory
             and adds the given prefs and links to extensions.
 
@@ -206,15 +206,39 @@ class FFSetup(object):
             prefs: Preferences to set in the prefs.js file of the new profile.  Format:
                     {"PrefName1" : "PrefValue1", "PrefName2" : "PrefValue2"}
             extensions: list of paths to .xpi files to be installed
+            profile_cache: profilecache.ProfileCache to clone the profile from, if it
+                           was built before, or else to add it to
 
         Returns:
             String containing the absolute path of the profile directory.
         """
 
-        # Create a temporary directory for the profile, and copy the
-        # source profile to it.
+        # Create a temporary directory for the profile
         temp_dir = tempfile.mkdtemp()
         profile_dir = os.path.join(temp_dir, 'profile')
+
+        self.profile_key = None
+        info = None
+        if profile_cache is not None:
+            self.profile_key = profile_cache.key(source_profile, prefs, extensions, webserver)
+            info = profile_cache.clone(self.profile_key, profile_dir)
+        if info is not None:
+            self.extensions = [str(extension) for extension in info['extensions']]
+        else:
+            self.BuildProfile(profile_dir, source_profile, prefs, extensions, webserver)
+            if profile_cache is not None:
+                profile_cache.add(self.profile_key, profile_dir, self.extensions)
+
+        if webserver != 'localhost' and self._host != '':
+            remote_dir = self.ffprocess.copyDirToDevice(profile_dir)
+            profile_dir = remote_dir
+        return temp_dir, profile_dir
+
+    def BuildProfile(self, profile_dir, source_profile, prefs, extensions, webserver):
+        """Copies the source profile to profile_dir and adds the given prefs
+            and extensions; see CreateTempProfileDir"""
+
+        # copy the source profile
         shutil.copytree(source_profile, profile_dir)
         MakeDirectoryContentsWritable(profile_dir)
 
@@ -237,11 +261,6 @@ class FFSetup(object):
         for addon in extensions:
             self.extensions.append(self.install_addon(profile_dir, addon))
 
-        if webserver != 'localhost' and self._host != '':
-            remote_dir = self.ffprocess.copyDirToDevice(profile_dir)
-            profile_dir = remote_dir
-        return temp_dir, profile_dir
-
     def InstallInBrowser(self, browser_path, dir_path):
         """
             Take the given directory and copies it to appropriate location in the given
@@ -265,8 +284,9 @@ class FFSetup(object):
             browser_config: object containing all the browser_config options
             profile_dir: The full path to the profile directory to load
         """
-        INFO_REGEX = re.compile('__browserInfo(.*)__browserInfo', re.DOTALL|re.MULTILINE)
-        PROFILE_REGEX = re.compile('__metrics(.*)__metrics', re.DOTALL|re.MULTILINE)
+        INFO_TOKEN = '__browserInfo'
+        PROFILE_TOKEN = '__metrics'
+        TOKEN_REGEX = re.compile('|'.join([INFO_TOKEN, PROFILE_TOKEN]))
 
         command_args = utils.GenerateBrowserCommandLine(browser_config["browser_path"], 
                                                         browser_config["extra_args"], 
@@ -278,29 +298,38 @@ class FFSetup(object):
             browser = talosProcess.talosProcess(command_args, env=os.environ.copy(), logfile=browser_config['browser_log'])
             browser.run()
             browser.wait()
+            # rather than sleep, wait for the log to be closed and the browser to be gone
+            browser.waitForReady(lambda: self.ffprocess.checkAllProcesses(browser_config['process'],
+                                                                           browser_config['child_process']))
             browser = None
-            time.sleep(5)
         else:
             self.ffprocess.runProgram(browser_config, command_args, timeout=1200)
 
         res = 0
         if not os.path.isfile(browser_config['browser_log']):
             raise talosError("initalization has no output from browser")
-        results_file = open(browser_config['browser_log'], "r")
-        results_raw = results_file.read()
-        results_file.close()
-        match = PROFILE_REGEX.search(results_raw)
-        if match:
-            res = 1
-        else:
-            utils.info("Could not find %s in browser_log: %s", PROFILE_REGEX.pattern, browser_config['browser_log'])
-            utils.info("Raw results:%s", results_raw)
-            utils.info("Initialization of new profile failed")
-        match = INFO_REGEX.search(results_raw)
-        if match:
-            binfo = match.group(1)
+
+        # find the tokens in a map of the log; the text between the first
+        # and last of each token is its section of the output
+        positions = {}
+        def token(position, match):
+            positions.setdefault(match.group(), []).append(position)
+        with utils.MappedFile(browser_config['browser_log']) as results_raw:
+            utils.scan(results_raw, (TOKEN_REGEX, token))
+            sections = {}
+            for name, found in positions.items():
+                if len(found) > 1:
+                    sections[name] = results_raw[found[0] + len(name):found[-1]]
+            if PROFILE_TOKEN in sections:
+                res = 1
+            else:
+                utils.info("Could not find %s in browser_log: %s", PROFILE_TOKEN, browser_config['browser_log'])
+                utils.info("Raw results:%s", results_raw[:])
+                utils.info("Initialization of new profile failed")
+        if INFO_TOKEN in sections:
+            binfo = sections[INFO_TOKEN]
             print binfo
-            for line in binfo.split('\n'):
+            for line in binfo.splitlines():
                 if line.strip().startswith('browser_name'):
                     browser_config['browser_name'] = line.split(':')[1]
                 if line.strip().startswith('browser_version'):
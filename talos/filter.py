@@ -1,10 +1,97 @@
+import itertools
 import math
+import random
 
 """
 data filters:
 takes a series of run data and applies statistical transforms to it
 """
 
+try:
+    import numpy
+except ImportError:
+    # numpy is optional; apply_batch falls back to pure python
+    numpy = None
+
+### order statistics
+
+# series this short are simply sorted; below this size sorted() beats
+# numpy.partition once the list -> array conversion is paid for
+SORT_CUTOFF = 128
+
+# without numpy, partitions this short are sorted; a python-level
+# partition only beats sorted() on long series
+PYTHON_SORT_CUTOFF = 8192
+
+def select(series, *ranks):
+    """
+    return the values of the given (0-based) ranks of the series, i.e.
+    [sorted(series)[rank] for rank in ranks], without sorting all of it.
+    Long series are partitioned with numpy.partition (introselect) when
+    numpy is available and with _introselect otherwise.
+    """
+    if len(series) <= SORT_CUTOFF:
+        return _select_sorted(sorted(series), *ranks)
+    if numpy is not None:
+        return numpy.partition(numpy.asarray(series), ranks)[list(ranks)].tolist()
+    return _introselect(series, ranks)
+
+def _introselect(series, ranks):
+    """
+    quickselect with a median-of-three pivot, sorting any partition that
+    is short or that has been split too many times (which bounds the
+    worst case at O(n log n))
+    """
+    values = {}
+    limit = 2 * int(math.log(len(series), 2)) + 1
+    stack = [(series, sorted(set(ranks)), 0, 0)]
+    while stack:
+        part, wanted, offset, depth = stack.pop()
+        if len(part) <= PYTHON_SORT_CUTOFF or depth > limit:
+            part = sorted(part)
+            for rank in wanted:
+                values[rank] = part[rank - offset]
+            continue
+        pivot = sorted([part[0], part[len(part)/2], part[-1]])[1]
+        lower = [i for i in part if i < pivot]
+        upper = [i for i in part if i > pivot]
+        equal = len(part) - len(lower) - len(upper)
+        for rank in wanted:
+            if len(lower) <= rank - offset < len(lower) + equal:
+                values[rank] = pivot
+        below = [rank for rank in wanted if rank - offset < len(lower)]
+        if below:
+            stack.append((lower, below, offset, depth + 1))
+        above = [rank for rank in wanted if rank - offset >= len(lower) + equal]
+        if above:
+            stack.append((upper, above, offset + len(lower) + equal, depth + 1))
+    return [values[rank] for rank in ranks]
+
+def ranked(series, lower, upper):
+    """
+    the values of the series ranked lower through upper inclusive,
+    in no particular order
+    """
+    if len(series) <= SORT_CUTOFF:
+        return _ranked_sorted(sorted(series), lower, upper)
+    if numpy is not None:
+        return numpy.partition(numpy.asarray(series), [lower, upper])[lower:upper+1].tolist()
+    low, high = _introselect(series, [lower, upper])
+    if low == high:
+        return [low] * (upper - lower + 1)
+    inside = [i for i in series if low < i < high]
+    at_low = len([i for i in series if i <= low]) - lower
+    at_high = upper - lower + 1 - len(inside) - at_low
+    return inside + [low]*at_low + [high]*at_high
+
+def _select_sorted(series, *ranks):
+    """select() for a series that is already sorted"""
+    return [series[rank] for rank in ranks]
+
+def _ranked_sorted(series, lower, upper):
+    """ranked() for a series that is already sorted"""
+    return series[lower:upper+1]
+
 ### filters that return a scalar
 
 def mean(series):
@@ -17,14 +104,104 @@ def median(series):
     """
     median of data; needs at least one data point
     """
-    series = sorted(series)
+    return _median(series, select)
+
+def _median(series, select):
     if len(series) % 2:
         # odd
-        return series[len(series)/2]
+        return select(series, len(series)/2)[0]
     else:
         # even
         middle = len(series)/2 # the higher of the middle 2, actually
-        return 0.5*(series[middle-1] + series[middle])
+        lower, upper = select(series, middle-1, middle)
+        return 0.5*(lower + upper)
+
+def percentile(series, p):
+    """
+    p-th percentile of data (0 <= p <= 100), linearly interpolating
+    between the closest ranks; needs at least one data point
+    """
+    return _percentile(series, p, select)
+
+def _percentile(series, p, select):
+    assert 0 <= p <= 100, "percentile must be between 0 and 100: %s" % p
+    rank = (len(series) - 1) * (p / 100.)
+    lower = int(math.floor(rank))
+    upper = min(lower + 1, len(series) - 1)
+    low, high = select(series, lower, upper)
+    return low + (high - low)*(rank - lower)
+
+def trimmed_mean(series, number=1):
+    """
+    mean of data after discarding the `number` lowest and highest points;
+    short series are not trimmed
+    """
+    return _trimmed_mean(series, number, ranked)
+
+def _trimmed_mean(series, number, ranked):
+    if len(series) > 2*number:
+        series = ranked(series, number, len(series) - number - 1)
+    return math.fsum(series)/float(len(series))
+
+def winsorized_mean(series, number=1):
+    """
+    mean of data after clamping the `number` lowest and highest points to
+    the nearest remaining values; short series are not clamped
+    http://en.wikipedia.org/wiki/Winsorized_mean
+    """
+    return _winsorized_mean(series, number, ranked)
+
+def _winsorized_mean(series, number, ranked):
+    if len(series) <= 2*number:
+        return math.fsum(series)/float(len(series))
+    kept = ranked(series, number, len(series) - number - 1)
+    clamped = [min(kept)]*number + [max(kept)]*number
+    return math.fsum(kept + clamped)/float(len(series))
+
+# bootstrap resampling parameters; the fixed seed makes the intervals
+# reproducible for the same data
+BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_SEED = 0
+
+def bootstrap_medians(series, resamples=BOOTSTRAP_RESAMPLES, seed=BOOTSTRAP_SEED):
+    """
+    medians of `resamples` bootstrap resamples of the series:
+    http://en.wikipedia.org/wiki/Bootstrapping_(statistics)
+    with numpy all resamples are drawn in one array; without it they are
+    drawn one at a time with the random module, so the resamples differ
+    (but are just as deterministic)
+    """
+    if numpy is not None:
+        random_state = numpy.random.RandomState(seed)
+        indices = random_state.randint(0, len(series), size=(resamples, len(series)))
+        return numpy.median(numpy.asarray(series, dtype=numpy.float64)[indices], axis=1).tolist()
+    generator = random.Random(seed)
+    return [median([series[generator.randrange(len(series))] for i in series])
+            for resample in xrange(resamples)]
+
+def bootstrap_ci(series, level=95):
+    """
+    (low, high) bootstrap percentile confidence interval of the median
+    at the given confidence level (a percentage)
+    """
+    assert 0 < level < 100, "confidence level must be between 0 and 100: %s" % level
+    medians = sorted(bootstrap_medians(series))
+    tail = (100 - level) / 2.
+    return (_percentile(medians, tail, _select_sorted),
+            _percentile(medians, 100 - tail, _select_sorted))
+
+def bootstrap_ci_low(series, level=95):
+    """lower bound of the bootstrap confidence interval of the median"""
+    return bootstrap_ci(series, level)[0]
+
+def bootstrap_ci_high(series, level=95):
+    """upper bound of the bootstrap confidence interval of the median"""
+    return bootstrap_ci(series, level)[1]
+
+def bootstrap_median_ci_width(series, level=95):
+    """width of the bootstrap confidence interval of the median"""
+    low, high = bootstrap_ci(series, level)
+    return high - low
 
 def variance(series):
     """
@@ -67,7 +244,9 @@ def geometric_mean(series):
         total += math.log(i)
     return math.exp(total / len(series))
 
-scalar_filters = [mean, median, max, min, variance, stddev, dromaeo]
+scalar_filters = [mean, median, max, min, variance, stddev, dromaeo,
+                  percentile, trimmed_mean, winsorized_mean,
+                  bootstrap_ci_low, bootstrap_ci_high, bootstrap_median_ci_width]
 
 ### filters that return a list
 
@@ -111,6 +290,18 @@ series_filters = [ignore_first, ignore_max, ignore_min]
 scalar_filters = dict([(i.__name__, i) for i in scalar_filters])
 series_filters = dict([(i.__name__, i) for i in series_filters])
 
+# equivalents of the order-based filters for series that are already sorted;
+# each returns exactly what the filter returns on the unsorted series
+# (series results stay sorted)
+sorted_filters = {ignore_max: lambda series: series[:-1] if len(series) > 1 else series,
+                  ignore_min: lambda series: series[1:] if len(series) > 1 else series,
+                  max: lambda series: series[-1],
+                  min: lambda series: series[0],
+                  median: lambda series: _median(series, _select_sorted),
+                  percentile: lambda series, p: _percentile(series, p, _select_sorted),
+                  trimmed_mean: lambda series, number=1: _trimmed_mean(series, number, _ranked_sorted),
+                  winsorized_mean: lambda series, number=1: _winsorized_mean(series, number, _ranked_sorted)}
+
 ### utility functions
 
 def parse(filter_name):
@@ -180,8 +371,68 @@ def filters_args(_filters):
         retval.append([filter_functions[index], value[-1]])
     return retval
 
+class FilterChain(object):
+    """
+    a validated chain of filters, callable on a data series;
+    use compile() to get one rather than instantiating this directly
+    """
+
+    def __init__(self, filters):
+        """
+        - filters : list of (function, args)
+        """
+        self.filters = filters
+
+    def __call__(self, data):
+        return apply(data, self.filters)
+
+    def batch(self, series):
+        """apply the chain to each of a list of data series"""
+        return apply_batch(series, self.filters)
+
+    def columns(self, values, offsets):
+        """apply the chain to each of the data series stored in values; see apply_columns"""
+        return apply_columns(values, offsets, self.filters)
+
+# compiled filter chains keyed by spec
+_compiled = {}
+
+def compile(spec):
+    """
+    return the FilterChain for a filter spec, parsing and validating it
+    only the first time that spec is seen.  The spec may be a list of
+    ['filter_name', args] (as from parse) or of filter functions, bare
+    or as [function, args]; chains of functions are not validated.
+    Raises AssertionError for invalid chains, as filters() does.
+    """
+    if isinstance(spec, FilterChain):
+        return spec
+
+    key = []
+    for f in spec:
+        args = ()
+        if isinstance(f, list) or isinstance(f, tuple):
+            if len(f) == 2: # filter, extra arguments
+                f, args = f
+            elif len(f) == 1: # filter
+                f = f[0]
+            else:
+                raise AssertionError("Each value must be either [filter, [args]] or [filter]")
+        key.append((f, tuple(args)))
+    key = tuple(key)
+
+    if key not in _compiled:
+        names = [f for f, args in key]
+        if [name for name in names if isinstance(name, basestring)]:
+            chain = zip(filters(*names), [args for name, args in key])
+        else:
+            chain = list(key)
+        _compiled[key] = FilterChain(chain)
+    return _compiled[key]
+
 def apply(data, filters):
     """apply filters to a data series. does no safety check"""
+    chain = []
     for f in filters:
         args = ()
         if isinstance(f, list) or isinstance(f, tuple):
@@ -191,5 +442,224 @@ def apply(data, filters):
                 f = f[0]
             else:
                 raise AssertionError("Each value must be either [filter, [args]] or [filter]")
+        chain.append((f, args))
+
+    # when the tail of the chain only depends on the ordering of the data
+    # and needs it more than once, sort once and share it across the filters;
+    # long series are cheaper to select from once per filter
+    start = len(chain)
+    while start and chain[start-1][0] in sorted_filters:
+        start -= 1
+    if len(chain) - start < 2:
+        start = len(chain)
+
+    for f, args in chain[:start]:
+        data = f(data, *args)
+    chain = chain[start:]
+    if chain and len(data) <= SORT_CUTOFF:
+        data = sorted(data)
+        chain = [(sorted_filters[f], args) for f, args in chain]
+    for f, args in chain:
         data = f(data, *args)
     return data
+
+### batch filtering
+
+# fewer series than this are not worth setting up numpy arrays for
+BATCH_CUTOFF = 10
+
+def apply_batch(series, filters):
+    """
+    apply filters to a list of data series, returning a list of the results.
+    When numpy is available and every filter in the chain has a batch
+    implementation, all of the series are filtered together as one padded
+    array; otherwise each series is passed through apply().
+    The results are identical to [apply(data, filters) for data in series].
+    """
+    series = list(series)
+    chain = _batch_chain(filters)
+    if chain is None or len(series) < BATCH_CUTOFF:
+        return [apply(data, filters) for data in series]
+
+    lengths = numpy.array([len(data) for data in series], dtype=numpy.intp)
+    flat = numpy.fromiter(itertools.chain.from_iterable(series),
+                          dtype=numpy.float64, count=int(lengths.sum()))
+    return _apply_flat(flat, lengths, chain,
+                       lambda: [apply(data, filters) for data in series])
+
+def apply_columns(values, offsets, filters):
+    """
+    apply filters to data series stored one after another in values,
+    series i being values[offsets[i]:offsets[i + 1]], as apply_batch does;
+    values is an array('d') or numpy array, which is used without copying
+    """
+    rows = len(offsets) - 1
+    def fallback():
+        return [apply(list(values[offsets[i]:offsets[i + 1]]), filters)
+                for i in range(rows)]
+    chain = _batch_chain(filters)
+    if chain is None or rows < BATCH_CUTOFF:
+        return fallback()
+
+    flat = numpy.frombuffer(values, dtype=numpy.float64)
+    lengths = numpy.diff(numpy.asarray(offsets, dtype=numpy.intp))
+    return _apply_flat(flat, lengths, chain, fallback)
+
+def _apply_flat(flat, lengths, chain, fallback):
+    """
+    run a batch chain on the series of the given lengths packed in flat;
+    series that numpy can't handle the same way are left to fallback()
+    """
+    if not lengths.all():
+        # empty series error out in the scalar filters; keep that behaviour
+        return fallback()
+    if numpy.isnan(flat).any():
+        # ordering with NaN is ill-defined; defer to the python builtins
+        return fallback()
+    values, mask = _pad(flat, lengths)
+
+    for function, args in chain[:-1]:
+        mask = batch_series_filters[function](values, mask, *args)
+    function, args = chain[-1]
+    return batch_scalar_filters[function](values, mask, *args).tolist()
+
+def _batch_chain(filters):
+    """
+    normalize filters to a list of (function, args) if the chain can be
+    run by apply_batch; return None otherwise
+    """
+    if numpy is None or not filters:
+        return None
+    chain = []
+    for f in filters:
+        args = ()
+        if isinstance(f, list) or isinstance(f, tuple):
+            if len(f) == 2:
+                f, args = f
+            elif len(f) == 1:
+                f = f[0]
+            else:
+                return None
+        chain.append((f, tuple(args)))
+    if [f for f, args in chain[:-1] if f not in batch_series_filters]:
+        return None
+    if chain[-1][0] not in batch_scalar_filters:
+        return None
+    return chain
+
+def _pad(flat, lengths):
+    """
+    unpack series of the given lengths, one after another in flat, into
+    a (values, mask) pair of 2-d arrays padded with zeros on the right
+    """
+    rows = len(lengths)
+    offsets = numpy.cumsum(lengths) - lengths
+    row_index = numpy.repeat(numpy.arange(rows), lengths)
+    column_index = numpy.arange(flat.size) - numpy.repeat(offsets, lengths)
+    values = numpy.zeros((rows, lengths.max()), dtype=numpy.float64)
+    mask = numpy.zeros(values.shape, dtype=bool)
+    values[row_index, column_index] = flat
+    mask[row_index, column_index] = True
+    return values, mask
+
+def _compact(values, mask):
+    """
+    move the unmasked values of each row to the front, preserving order;
+    returns (values, counts) with the tail of each row zeroed
+    """
+    order = numpy.argsort(~mask, axis=1, kind='mergesort')
+    rows = numpy.arange(values.shape[0])[:, numpy.newaxis]
+    counts = mask.sum(axis=1)
+    packed = numpy.where(mask, values, 0.)[rows, order]
+    return packed, counts
+
+def _sequential_sum(values, mask):
+    """
+    row sums added left to right, matching the rounding of python's sum();
+    numpy's add.reduce uses pairwise summation, which does not
+    """
+    return numpy.cumsum(numpy.where(mask, values, 0.), axis=1)[:, -1]
+
+def _batch_ignore_first(values, mask, number=1):
+    counts = mask.sum(axis=1)
+    rank = numpy.cumsum(mask, axis=1)
+    drop = mask & (rank <= number) & (counts > number)[:, numpy.newaxis]
+    return mask & ~drop
+
+def _batch_ignore(values, mask, fill, locate):
+    counts = mask.sum(axis=1)
+    rows = numpy.nonzero(counts > 1)[0]
+    columns = locate(numpy.where(mask, values, fill), axis=1)[rows]
+    mask = mask.copy()
+    mask[rows, columns] = False
+    return mask
+
+def _batch_ignore_max(values, mask):
+    # argmax returns the first occurrence, as list.remove does
+    return _batch_ignore(values, mask, -numpy.inf, numpy.argmax)
+
+def _batch_ignore_min(values, mask):
+    return _batch_ignore(values, mask, numpy.inf, numpy.argmin)
+
+def _batch_mean(values, mask):
+    return _sequential_sum(values, mask) / mask.sum(axis=1)
+
+def _batch_median(values, mask):
+    counts = mask.sum(axis=1)
+    ordered = numpy.sort(numpy.where(mask, values, numpy.inf), axis=1)
+    rows = numpy.arange(values.shape[0])
+    middle = counts // 2
+    lower = ordered[rows, numpy.maximum(middle - 1, 0)]
+    upper = ordered[rows, middle]
+    return numpy.where(counts % 2, upper, 0.5*(lower + upper))
+
+def _batch_max(values, mask):
+    return numpy.where(mask, values, -numpy.inf).max(axis=1)
+
+def _batch_min(values, mask):
+    return numpy.where(mask, values, numpy.inf).min(axis=1)
+
+def _batch_variance(values, mask):
+    counts = mask.sum(axis=1)
+    _mean = _sequential_sum(values, mask) / counts
+    # numpy.power rather than the ** operator, which numpy shortcuts to
+    # square() and sqrt(); those can round differently than libm's pow()
+    deviations = numpy.power(values - _mean[:, numpy.newaxis], 2.)
+    return _sequential_sum(deviations, mask) / counts
+
+def _batch_stddev(values, mask):
+    return numpy.power(_batch_variance(values, mask), 0.5)
+
+def _batch_geometric_mean(values, mask):
+    counts = mask.sum(axis=1)
+    # use math.log so the logarithms round exactly as geometric_mean's do
+    logs = numpy.zeros(values.shape)
+    logs[mask] = [math.log(i) for i in values[mask]]
+    return numpy.array([math.exp(total) for total in
+                        _sequential_sum(logs, mask) / counts])
+
+def _batch_dromaeo(values, mask, chunksize=5):
+    packed, counts = _compact(values, mask)
+    chunks = -(-packed.shape[1] // chunksize)
+    padding = chunks*chunksize - packed.shape[1]
+    packed = numpy.hstack([packed, numpy.zeros((packed.shape[0], padding))])
+    packed = packed.reshape(packed.shape[0], chunks, chunksize)
+    # number of values in each chunk of each row
+    sizes = numpy.clip(counts[:, numpy.newaxis] - chunksize*numpy.arange(chunks),
+                       0, chunksize)
+    sums = numpy.cumsum(packed, axis=2)[:, :, -1]
+    chunk_mask = sizes > 0
+    means = numpy.where(chunk_mask, sums / numpy.maximum(sizes, 1), 0.)
+    return _batch_geometric_mean(means, chunk_mask)
+
+batch_series_filters = {ignore_first: _batch_ignore_first,
+                        ignore_max: _batch_ignore_max,
+                        ignore_min: _batch_ignore_min}
+batch_scalar_filters = {mean: _batch_mean,
+                        median: _batch_median,
+                        max: _batch_max,
+                        min: _batch_min,
+                        variance: _batch_variance,
+                        stddev: _batch_stddev,
+                        dromaeo: _batch_dromaeo,
+                        geometric_mean: _batch_geometric_mean}
@@ -6,10 +6,15 @@
 
 import datetime
 import filter
+import gzip
+import httplib
 import imp
+import inspect
 import mozinfo
+import oauth2 as oauth
 import os
 import post_file
+import sqlite3
 import tempfile
 import time
 import urllib
@@ -42,6 +47,9 @@ class Output(object):
     def check(cls, urls, **options):
         """check to ensure that the urls are valid"""
 
+    compress = False # whether to gzip outputs
+    strict = False # whether to raise on posts the server fails, rather than report them; see Spool.send
+
     def __init__(self, results):
         """
         - results : TalosResults instance
@@ -52,6 +60,16 @@ class Output(object):
         """return list of results strings"""
         raise NotImplementedError("Abstract base class")
 
+    @classmethod
+    def dumps(cls, results):
+        """results in a form that json can serialize, for the spool"""
+        return results
+
+    @classmethod
+    def loads(cls, data):
+        """results from the form returned by dumps"""
+        return data
+
     def output(self, results, results_url, tbpl_output):
         """output to the results_url
         - results_url : http:// or file:// URL
@@ -66,9 +84,8 @@ class Output(object):
             self.post(results, results_server, results_path, results_scheme, tbpl_output)
         elif results_scheme == 'file':
             try:
-                f = file(results_path, 'w')
-                for result in results:
-                    f.write("%s\n" % result)
+                f = self.open(results_path)
+                self.write(results, f)
                 f.close()
             except Exception, e:
                 print "Exception in writing file '%s' from results_url: %s" % (results_path, results_url)
@@ -76,6 +93,19 @@ class Output(object):
         else:
             raise NotImplementedError("%s: %s - only http://, https://, and file:// supported" % (self.__class__.__name__, results_url))
 
+    def open(self, path):
+        """open a file to output to; if compressing, it is gzipped and .gz is appended to its name"""
+        if self.compress:
+            if not path.endswith('.gz'):
+                path += '.gz'
+            return gzip.open(path, 'wb')
+        return file(path, 'w')
+
+    def write(self, results, f):
+        """write the results to a file object, one per line"""
+        for result in results:
+            f.write("%s\n" % result)
+
     def post(self, results, server, path, scheme, tbpl_output):
         raise NotImplementedError("Abstract base class")
 
@@ -152,13 +182,27 @@ class Output(object):
 class GraphserverOutput(Output):
 
     retries = 5   # number of times to attempt to contact graphserver
+    wait_time = 5 # number of seconds before the first retry of a result
+    threads = 4   # number of results to post at once
+    batch_refused = (400, 413) # statuses of a server not taking several results in a request
     info_format = ['title', 'testname', 'branch_name', 'sourcestamp', 'buildid', 'date']
 
     @classmethod
-    def check(cls, urls):
+    def check(cls, urls, **options):
         # ensure results_url link exists
         post_file.test_links(*urls)
 
+    def __init__(self, results, graphserver_batch=0, graphserver_gzip=False):
+        """
+        - graphserver_batch : number of results to post in each request, as
+                              separate files; by default each is posted on its own
+        - graphserver_gzip : whether to post gzip-encoded results, if the server
+                             takes them, and to gzip file:// outputs
+        """
+        Output.__init__(self, results)
+        self.batch = graphserver_batch
+        self.compress = graphserver_gzip
+
     def __call__(self):
         """
         results to send to graphserver:
@@ -193,17 +237,8 @@ class GraphserverOutput(Output):
             # HACK: when running xperf, we upload xperf counters to the graph server but we do not want to
             # upload the test results as they will confuse the graph server
             if not test.using_xperf:
-                vals = []
-                for result in test.results:
-                    # per test filters
-                    _filters = self.results.filters
-                    if 'filters' in test.test_config:
-                        try:
-                            _filters = filter.filters_args(test.test_config['filters'])
-                        except AssertionError, e:
-                            raise utils.talosError(str(e))
-
-                    vals.extend(result.values(_filters))
+                # filtered with the per test filters, if any
+                vals = self.results.values(test)
                 result_strings.append(self.construct_results(vals, testname=testname, **info_dict))
                 utils.stamped_msg("Generating results file: %s" % test.name(), "Stopped")
 
@@ -305,30 +340,101 @@ class GraphserverOutput(Output):
             raise utils.talosError("send failed, graph server says:\n%s" % post)
         return links
 
-    def post(self, results, server, path, scheme, tbpl_output):
-        """post results to the graphserver"""
+    def split_links(self, links, batch):
+        """
+        split the links for a batch of results into those for each result;
+        graphserver answers 'VALUES' payloads with two lines and 'AVERAGE'
+        payloads with one (see add_tbpl_output)
+        """
+        lines = links.splitlines()
+        split = []
+        for result in batch:
+            _type, info = result.splitlines()[1:3]
+            count = 2 if _type == 'VALUES' else 1
+            testname = info.split(',')[1]
+            result_lines, lines = lines[:count], lines[count:]
+            if len(result_lines) != count or result_lines[-1].split('\t')[0] != testname:
+                raise utils.talosError("graph server response does not match the results for %s:\n%s" % (testname, links))
+            split.append('\n'.join(result_lines) + '\n')
+        if lines:
+            raise utils.talosError("graph server response has more links than results:\n%s" % links)
+        return split
+
+    def match_links(self, links, batch):
+        """
+        the links for the results of a batch found in a response, by test name,
+        and the results it has none for
+        """
+        lines = {}
+        for line in links.splitlines():
+            lines.setdefault(line.split('\t')[0], []).append(line)
+        matched = []
+        missing = []
+        for result in batch:
+            testname = result.splitlines()[2].split(',')[1]
+            result_lines = lines.pop(testname, None)
+            if result_lines:
+                matched.append('\n'.join(result_lines) + '\n')
+            else:
+                missing.append(result)
+        return matched, missing
 
-        links = []
-        wait_time = 5 # number of seconds between each attempt
+    def post_batches(self, results, server, path, scheme):
+        """
+        post the results in batches of self.batch per request;
+        returns the links for the results posted, and the results left to post one at a time:
+        all of them if the server refuses batches
+        """
 
-        for index, data_string in enumerate(results):
+        batches = [results[i:i + self.batch] for i in range(0, len(results), self.batch)]
+
+        # find whether batches are taken with the first one
+        probe = post_file.Uploader(server, path, scheme,
+                                   threads=1,
+                                   retries=self.retries,
+                                   wait=self.wait_time,
+                                   process=self.process_Request,
+                                   compress=self.compress,
+                                   refuse=self.batch_refused)
+        try:
+            response = probe(batches[:1])[0]
+        except post_file.Refused, e:
+            utils.info("Graph server does not take batches of results, posting them one at a time: %s", e)
+            return [], results
+        try:
+            links = self.split_links(response, batches[0])
+        except utils.talosError, e:
+            # the server stored those results it has links for, as graphserver
+            # does the first of a batch, so only the others are posted again
+            links, missing = self.match_links(response, batches[0])
+            utils.info("Graph server answered a batch of results with links for %d of %d, posting the rest one at a time: %s",
+                       len(links), len(batches[0]), e)
+            return links, missing + results[len(batches[0]):]
+
+        uploader = post_file.Uploader(server, path, scheme,
+                                      threads=self.threads,
+                                      retries=self.retries,
+                                      wait=self.wait_time,
+                                      process=self.process_Request,
+                                      compress=probe.compress)
+        for batch, batch_links in zip(batches[1:], uploader(batches[1:])):
+            links.extend(self.split_links(batch_links, batch))
+        return links, []
 
-            times = 0
-            msg = ""
-            while times < self.retries:
-                utils.info("Posting result %d of %d to %s://%s%s, attempt %d", index, len(results), scheme, server, path, times)
-                try:
-                    links.append(self.process_Request(post_file.post_multipart(server, path, files=[("filename", "data_string", data_string)])))
-                    break
-                except utils.talosError, e:
-                    msg = str(e)
-                except Exception, e:
-                    msg = str(e)
-                times += 1
-                time.sleep(wait_time)
-                wait_time *= 2
-            else:
-                raise utils.talosError("Graph server unreachable (%d attempts)\n%s" % (self.retries, msg))
+    def post(self, results, server, path, scheme, tbpl_output):
+        """post results to the graphserver"""
+
+        links, single = [], results
+        if self.batch > 1 and len(results) > 1:
+            links, single = self.post_batches(results, server, path, scheme)
+        if single:
+            uploader = post_file.Uploader(server, path, scheme,
+                                          threads=self.threads,
+                                          retries=self.retries,
+                                          wait=self.wait_time,
+                                          process=self.process_Request,
+                                          compress=self.compress)
+            links.extend(uploader(single))
 
         # add TBPL output
         self.add_tbpl_output(links, tbpl_output, server, scheme)
@@ -383,13 +489,61 @@ two lines for 'VALUES' payloads. You received:
             print 'RETURN: %s' % link_format % (url, linkName)
 
 
+class SerializedDatazillaRequest(DatazillaRequest):
+    """DatazillaRequest that sends datasets already serialized to json"""
+
+    def send(self, data, compress=False):
+        """
+        Send a dataset serialized to json to the server; returns httplib Response.
+        - compress : whether to send the body gzip-encoded
+        """
+        path = "/%s/api/load_test" % (self.project)
+        uri = "%s://%s%s" % (self.protocol, self.host, path)
+
+        params = {'data': urllib.quote(data)}
+
+        if self.oauth_key and self.oauth_secret:
+            # sign the request as DatazillaRequest.send does
+            params.update({'user': self.project,
+                           'oauth_version': "1.0",
+                           'oauth_nonce': oauth.generate_nonce(),
+                           'oauth_timestamp': int(time.time())})
+            token = oauth.Token(key="", secret="")
+            consumer = oauth.Consumer(key=self.oauth_key, secret=self.oauth_secret)
+            params['oauth_token'] = token.key
+            params['oauth_consumer_key'] = consumer.key
+            req = oauth.Request(method="POST", url=uri, parameters=params)
+            req.sign_request(oauth.SignatureMethod_HMAC_SHA1(), consumer, token)
+            body = req.to_postdata()
+        else:
+            body = urllib.urlencode(params)
+
+        header = {'Content-type': 'application/x-www-form-urlencoded'}
+        if compress:
+            body = utils.gzip_string(body)
+            header['Content-Encoding'] = 'gzip'
+        if self.protocol == 'http':
+            conn = httplib.HTTPConnection(self.host)
+        else:
+            conn = httplib.HTTPSConnection(self.host)
+        conn.request("POST", path, body, header)
+        return conn.getresponse()
+
+
 class DatazillaOutput(Output):
     """send output to datazilla"""
 
-    def __init__(self, results, authfile=None):
+    def __init__(self, results, authfile=None, datazilla_gzip=False):
+        """
+        - authfile : file or URL of datazilla oauth credentials
+        - datazilla_gzip : whether to post gzip-encoded datasets, if the server
+                           takes them, and to gzip file:// outputs
+        """
         Output.__init__(self, results)
         self.authfile = authfile
+        self.compress = datazilla_gzip
         self.oauth = None
+        self._serialized = None # (collection, datasets, json of each dataset)
         if authfile is not None:
             # get datazilla oauth credentials
             if '://' in authfile: # authfile is a URL
@@ -408,6 +562,23 @@ class DatazillaOutput(Output):
             if self.oauth is None:
                 utils.info("File '%s' does not contain datazilla oauth information", authfile)
 
+    @classmethod
+    def collection_info(cls, collection):
+        """the arguments to DatazillaResultsCollection of a collection"""
+        attributes = inspect.getargspec(DatazillaResultsCollection.__init__)[0][1:]
+        return dict([(attr, getattr(collection, attr)) for attr in attributes])
+
+    @classmethod
+    def dumps(cls, results):
+        return {'collection': cls.collection_info(results),
+                'results': results.results.__dict__}
+
+    @classmethod
+    def loads(cls, data):
+        collection = DatazillaResultsCollection(**dict([(str(key), value) for key, value in data['collection'].items()]))
+        collection.add_datazilla_result(DatazillaResult(**dict([(str(key), value) for key, value in data['results'].items()])))
+        return collection
+
     def output(self, results, results_url, tbpl_output):
         """output to the results_url
         - results : DatazillaResults instance
@@ -421,16 +592,53 @@ class DatazillaOutput(Output):
         results_url_split = utils.urlsplit(results_url)
         results_scheme, results_server, results_path, _, _ = results_url_split
 
-        utils.info("TALOSDATA: %s" % json.dumps(results.datasets()))
+        datasets, serialized = self.serialize(results)
+        utils.info("TALOSDATA: [%s]", ', '.join(serialized))
         if results_scheme in ('http', 'https'):
             self.post(results, results_server, results_path, results_scheme, tbpl_output)
         elif results_scheme == 'file':
-            f = file(results_path, 'w')
-            f.write(json.dumps(results.datasets(), indent=2, sort_keys=True))
+            f = self.open(results_path)
+            self.write(results, f)
             f.close()
         else:
             raise NotImplementedError("%s: %s - only http://, https://, and file:// supported" % (self.__class__.__name__, results_url))
 
+    def send(self, req, data):
+        """
+        send a serialized dataset with a SerializedDatazillaRequest, compressed if
+        self.compress; if the server refuses the encoding, it is sent uncompressed,
+        as are the datasets after it
+        """
+        if self.compress:
+            response = req.send(data, compress=True)
+            if response.status not in post_file.ENCODING_REFUSED:
+                return response
+            response.read()
+            utils.info("Datazilla refused a gzip-encoded dataset (%s %s), sending it uncompressed",
+                       response.status, response.reason.lower())
+            self.compress = False
+        return req.send(data)
+
+    def serialize(self, results):
+        """
+        the datasets of a collection and the json of each, computed once
+        for the log, files and posts to all URLs
+        """
+        if self._serialized is None or self._serialized[0] is not results:
+            datasets = results.datasets()
+            self._serialized = (results, datasets, [json.dumps(dataset) for dataset in datasets])
+        return self._serialized[1:]
+
+    def write(self, results, f):
+        """write the datasets of a collection to a file object as a json list, a dataset at a time"""
+        datasets, serialized = self.serialize(results)
+        f.write('[')
+        for index, data in enumerate(serialized):
+            if index:
+                f.write(', ')
+            f.write(data)
+        f.write(']')
+
     def __call__(self):
 
         # platform
@@ -447,18 +655,13 @@ class DatazillaOutput(Output):
             res.add_testsuite(suite, options=self.run_options(test))
 
             # serialize test results
-            results = {}
             if not test.using_xperf:
-                for result in test.results:
-                    # XXX this will not work for manifests which list
-                    # the same page name twice. It also ignores cycles
-                    for page, val in result.raw_values():
-                        if page == 'NULL':
-                            results.setdefault(test.name(), []).extend(val)
-                        else:
-                            results.setdefault(page, []).extend(val)
-                for result, values in results.items():
-                    res.add_test_results(suite, result, values)
+                # XXX this will not work for manifests which list
+                # the same page name twice. It also ignores cycles
+                for page, values in self.results.raw_values(test):
+                    if page == 'NULL':
+                        page = test.name()
+                    res.add_test_results(suite, page, values)
 
                 # counters results_aux data
                 for cd in test.all_counter_results:
@@ -508,20 +711,27 @@ class DatazillaOutput(Output):
         utils.info("datazilla: %s//%s/%s; oauth=%s", scheme, server, project, bool(oauth_key and oauth_secret))
 
         # submit the request
-        req = DatazillaRequest.create(scheme, server, project, oauth_key, oauth_secret, results)
-        responses = req.submit()
+        datasets, serialized = self.serialize(results)
+        # (the request only sends the serialized datasets, so the results aren't copied to it)
+        req = SerializedDatazillaRequest(scheme, server, project, oauth_key, oauth_secret,
+                                         **self.collection_info(results))
+        responses = [self.send(req, data) for data in serialized]
 
         # print error responses
+        errors = []
         for response in responses:
             if response.status != 200:
                 # use lower-case string because buildbot is sensitive to upper case error
                 # as in 'INTERNAL SERVER ERROR'
                 # https://bugzilla.mozilla.org/show_bug.cgi?id=799576
                 reason = response.reason.lower()
-                print "Error posting to %s: %s %s" % (url, response.status, reason)
+                errors.append("Error posting to %s: %s %s" % (url, response.status, reason))
+                print errors[-1]
             else:
                 res = response.read()
                 print "Datazilla response is: %s" % res.lower()
+        if errors and self.strict:
+            raise utils.talosError('\n'.join(errors))
 
         # TBPL output
         # URLs are in the form of
@@ -563,7 +773,7 @@ class DatazillaOutput(Output):
             # build TBPL output
             # XXX this will not work for multiple URLs :(
             tbpl_output.setdefault('datazilla', {})
-            for dataset in results.datasets():
+            for dataset in datasets:
                 url = "%s&test=%s" % (url, dataset['testrun']['suite'])
                 tbpl_output['datazilla'][dataset['testrun']['suite']] = {'url': url}
                 utils.info("Datazilla results at %s", url)
@@ -572,7 +782,7 @@ class DatazillaOutput(Output):
         """test options for datazilla"""
 
         options = {}
-        test_options = ['rss', 'tpchrome', 'tpmozafterpaint', 'tpcycles', 'tppagecycles', 'tprender', 'tploadaboutblank', 'tpdelay', 'responsiveness', 'shutdown']
+        test_options = ['rss', 'tpchrome', 'tpmozafterpaint', 'tpcycles', 'tppagecycles', 'tprender', 'tploadaboutblank', 'tpdelay', 'responsiveness', 'shutdown', 'cc_time']
         for option in test_options:
             if option not in test.test_config:
                 continue
@@ -615,6 +825,123 @@ class DatazillaOutput(Output):
 
         return dict(name=self.results.title, os=platform, osversion=version, platform=processor)
 
+class SqliteOutput(Output):
+    """
+    add results to a local SQLite database, for queries over the history of runs;
+    the cycle values and counters carry the test and date of their run so that
+    the history of a test's page or counter is a lookup of a single index.
+    Global counters, accumulated over all cycles, have a NULL cycle.
+    """
+
+    schema = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, title TEXT, date INTEGER,
+                                 branch TEXT, sourcestamp TEXT, buildid TEXT,
+                                 browser_name TEXT, browser_version TEXT);
+CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS pages (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS cycle_values (run INTEGER REFERENCES runs (id),
+                                         test INTEGER REFERENCES tests (id),
+                                         page INTEGER REFERENCES pages (id),
+                                         date INTEGER, cycle INTEGER, replicate INTEGER, value REAL);
+CREATE TABLE IF NOT EXISTS counters (run INTEGER REFERENCES runs (id),
+                                     test INTEGER REFERENCES tests (id),
+                                     name TEXT, date INTEGER, cycle INTEGER, position INTEGER, value REAL);
+CREATE INDEX IF NOT EXISTS cycle_values_test_page_date ON cycle_values (test, page, date);
+CREATE INDEX IF NOT EXISTS counters_test_name_date ON counters (test, name, date);
+CREATE INDEX IF NOT EXISTS runs_buildid ON runs (buildid);
+"""
+
+    @classmethod
+    def check(cls, urls, **options):
+        for url in urls:
+            if utils.urlsplit(url)[0] != 'file':
+                raise utils.talosError("%s: %s - only file:// supported" % (cls.__name__, url))
+
+    def __call__(self):
+        """
+        rows to add to the database:
+        {'run': run info, 'values': [(test, page, cycle, replicate, value)],
+         'counters': [(test, counter, cycle or None, position, value)]}
+        """
+
+        browser_config = self.results.browser_config
+        run = dict(title=self.results.title,
+                   date=self.results.date,
+                   branch=browser_config['branch_name'],
+                   sourcestamp=browser_config['sourcestamp'],
+                   buildid=browser_config['buildid'],
+                   browser_name=browser_config['browser_name'],
+                   browser_version=browser_config['browser_version'])
+        values = []
+        counters = []
+        for test in self.results.results:
+            testname = test.name()
+            if not test.using_xperf:
+                for cycle, result in enumerate(test.results):
+                    for page, runs in result.raw_values():
+                        if page == 'NULL':
+                            page = testname
+                        values.extend([(testname, page, cycle, replicate, value)
+                                       for replicate, value in enumerate(runs)])
+            # the global counters are added to the per-cycle ones at the end of the test
+            cycle_counters = [cd for cd in test.all_counter_results
+                              if not set(cd).issubset(test.global_counters)]
+            global_counters = [cd for cd in test.all_counter_results
+                               if set(cd).issubset(test.global_counters)]
+            for cycle, cd in list(enumerate(cycle_counters)) + [(None, cd) for cd in global_counters]:
+                for name, vals in cd.items():
+                    # exclude counters whose values are tuples, as for graphserver
+                    counters.extend([(testname, name, cycle, position, value)
+                                     for position, value in enumerate(vals)
+                                     if not isinstance(value, (list, tuple))])
+        return {'run': run, 'values': values, 'counters': counters}
+
+    def output(self, results, results_url, tbpl_output):
+        """add the results to the database at a file:// URL"""
+
+        results_scheme, _, results_path, _, _ = utils.urlsplit(results_url)
+        if results_scheme != 'file':
+            raise NotImplementedError("%s: %s - only file:// supported" % (self.__class__.__name__, results_url))
+        utils.info("Adding %d values and %d counter values to %s",
+                   len(results['values']), len(results['counters']), results_path)
+
+        db = sqlite3.connect(results_path)
+        try:
+            db.executescript(self.schema)
+            with db: # one transaction, so a run is added entirely or not at all
+                self.insert(db, results)
+        finally:
+            db.close()
+
+    def insert(self, db, results):
+        """insert the rows of a run"""
+
+        run = results['run']
+        columns = sorted(run.keys())
+        cursor = db.execute("INSERT INTO runs (%s) VALUES (%s)" % (', '.join(columns), ', '.join(['?'] * len(columns))),
+                            [run[column] for column in columns])
+        run_id = cursor.lastrowid
+        date = run['date']
+
+        # ids of the test and page names, adding those not seen before
+        tests = set([row[0] for row in results['values']] + [row[0] for row in results['counters']])
+        pages = set([row[1] for row in results['values']])
+        ids = {}
+        for table, names in (('tests', tests), ('pages', pages)):
+            db.executemany("INSERT OR IGNORE INTO %s (name) VALUES (?)" % table, [(name,) for name in names])
+            ids[table] = dict([(name, id) for id, name in db.execute("SELECT id, name FROM %s" % table)
+                               if name in names])
+
+        test_ids = ids['tests']
+        page_ids = ids['pages']
+        db.executemany("INSERT INTO cycle_values (run, test, page, date, cycle, replicate, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(run_id, test_ids[test], page_ids[page], date, cycle, replicate, value)
+                        for test, page, cycle, replicate, value in results['values']])
+        db.executemany("INSERT INTO counters (run, test, name, date, cycle, position, value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(run_id, test_ids[test], name, date, cycle, position, value)
+                        for test, name, cycle, position, value in results['counters']])
+
 # available output formats
 formats = {'datazilla_urls': DatazillaOutput,
-           'results_urls': GraphserverOutput}
+           'results_urls': GraphserverOutput,
+           'sqlite_urls': SqliteOutput}
@@ -6,10 +6,23 @@
 #   This recipe is covered under the Python license: http://www.python.org/license
 
 import httplib, mimetypes
+import random
 import socket
 from socket import error, herror, gaierror, timeout
 socket.setdefaulttimeout(None)
+import threading
 import urlparse
+import utils
+from multiprocessing.pool import ThreadPool
+
+ENCODING_REFUSED = (400, 415) # statuses of a host not taking a gzip-encoded body
+
+class Refused(utils.talosError):
+    """a post the host answered with an error status, not taking it as it was sent"""
+
+    def __init__(self, status, reason):
+        utils.talosError.__init__(self, "%d %s" % (status, reason.lower()))
+        self.status = status
 
 def link_exists(host, selector, scheme='http'):
     url = "%s://%s%s" % (scheme, host, selector)
@@ -44,11 +57,79 @@ def test_links(*urls):
         if scheme in ('http', 'https') and not link_exists(server, path, scheme):
             print 'WARNING: graph server link does not exist: %s' % url
 
-def post_multipart(host, selector, fields=(), files=()):
+class ConnectionPool(object):
+    """persistent (keep-alive) connections to each host, shared between threads"""
+
+    def __init__(self):
+        self.idle = {} # (scheme, host) -> connections not in use
+        self.lock = threading.Lock()
+
+    def connect(self, scheme, host):
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host)
+        return httplib.HTTPConnection(host)
+
+    def request(self, scheme, host, method, selector, body, headers, refuse=()):
+        """
+        make a request over an idle connection to the host, or a new one;
+        return the response page, or raise Refused if its status is in refuse
+        """
+        key = (scheme, host)
+        with self.lock:
+            idle = self.idle.get(key)
+            conn = idle.pop() if idle else None
+        reused = conn is not None
+        if not reused:
+            conn = self.connect(scheme, host)
+        try:
+            try:
+                conn.request(method, selector, body, headers)
+            except error:
+                if not reused:
+                    raise
+                # the host closed the connection while it was idle, before
+                # the request was sent, so make it again
+                conn.close()
+                return self.request(scheme, host, method, selector, body, headers, refuse)
+            try:
+                response = conn.getresponse()
+            except httplib.BadStatusLine:
+                if not reused:
+                    raise
+                # the host closed the idle connection without reading the
+                # request; any other error after sending it may come after the
+                # host took the post, so is not retried here, lest it be posted twice
+                conn.close()
+                return self.request(scheme, host, method, selector, body, headers, refuse)
+            page = response.read()
+        except:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self.lock:
+                self.idle.setdefault(key, []).append(conn)
+        if response.status in refuse:
+            raise Refused(response.status, response.reason)
+        return page
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+def post_multipart(host, selector, fields=(), files=(), scheme='http', pool=None, compress=False, refuse=()):
     """
     Post fields and files to an http host as multipart/form-data.
     fields is a sequence of (name, value) elements for regular form fields.
     files is a sequence of (name, filename, value) elements for data to be uploaded as files
+    pool is a ConnectionPool to reuse connections from; by default the connection is closed
+    compress is whether to send the body gzip-encoded, for servers that take Content-Encoding: gzip;
+    Refused is raised if the server answers it with one of ENCODING_REFUSED
+    refuse is the other statuses to raise Refused for
     Return the server's response page.
     """
     try:
@@ -61,11 +142,21 @@ def post_multipart(host, selector, fields=(), files=()):
       # Summarized results to the official graph server
       content_type, body = encode_multipart_formdata(fields, files)
 
-      headers = {"Content-Type": content_type, "Content-length": str(len(body)), "Host": host, "Accept": "text/plain"}
-      conn = httplib.HTTPConnection(host)
-      conn.request("POST", selector, body, headers)
-      response = conn.getresponse()
-      return response.read()
+      headers = {"Content-Type": content_type, "Host": host, "Accept": "text/plain"}
+      if compress:
+          body = utils.gzip_string(body)
+          headers["Content-Encoding"] = "gzip"
+          refuse = tuple(refuse) + ENCODING_REFUSED
+      headers["Content-length"] = str(len(body))
+      if pool is not None:
+          return pool.request(scheme, host, "POST", selector, body, headers, refuse)
+      pool = ConnectionPool()
+      try:
+          return pool.request(scheme, host, "POST", selector, body, headers, refuse)
+      finally:
+          pool.close()
+    except Refused:
+      raise
     except (httplib.HTTPException, error, herror, gaierror, timeout), e:
       print "WARNING: graph server unreachable"
       print "WARNING: " + str(e)
@@ -74,6 +165,99 @@ def post_multipart(host, selector, fields=(), files=()):
       print "WARNING: graph server unreachable"
       raise
 
+class Uploader(object):
+    """
+    posts payloads to a host concurrently, over persistent connections,
+    retrying each payload on failure with jittered exponential backoff
+    so that one failing payload does not hold up the others
+    """
+
+    def __init__(self, host, selector, scheme='http', threads=4, retries=5, wait=5, max_wait=60, process=None, compress=False, refuse=()):
+        """
+        - threads : number of payloads to post at once
+        - retries : number of attempts for each payload
+        - wait : seconds before retrying a payload, doubling with each attempt up to max_wait;
+                 a random amount of up to half of it is taken off, so that retries are spread out
+        - process : function of a response page returning the result of the post;
+                    it should raise if the post failed, to retry it
+        - compress : whether to post the payloads gzip-encoded; if the host refuses
+                     the encoding, the payload and the rest are posted uncompressed
+        - refuse : statuses of the host refusing a payload; Refused is raised for them, without retrying
+        """
+        self.host = host
+        self.selector = selector
+        self.scheme = scheme
+        self.threads = threads
+        self.retries = retries
+        self.wait = wait
+        self.max_wait = max_wait
+        self.process = process or (lambda page: page)
+        self.compress = compress
+        self.refuse = refuse
+        self.pool = ConnectionPool()
+        self.failed = threading.Event() # set when a payload fails every attempt
+
+    def backoff(self, attempt):
+        """seconds to wait after a failed attempt (0-based) of a payload"""
+        wait = min(self.wait * 2**attempt, self.max_wait)
+        return wait - random.uniform(0, wait / 2.)
+
+    def post_one(self, (index, count, payload)):
+        """
+        post a payload, or a list of payloads as the files of a single request;
+        returns the result of processing the response
+        """
+        if isinstance(payload, basestring):
+            payload = [payload]
+        files = [("filename", "data_string", data_string) for data_string in payload]
+        msg = ""
+        attempt = 0
+        while attempt < self.retries:
+            if self.failed.is_set():
+                raise utils.talosError("Posting result %d of %d abandoned" % (index, count))
+            utils.info("Posting result %d of %d to %s://%s%s, attempt %d", index, count, self.scheme, self.host, self.selector, attempt)
+            compress = self.compress
+            try:
+                return self.process(post_multipart(self.host, self.selector, files=files,
+                                                   scheme=self.scheme, pool=self.pool,
+                                                   compress=compress, refuse=self.refuse))
+            except Refused, e:
+                if not compress or e.status not in ENCODING_REFUSED:
+                    self.failed.set()
+                    raise
+                # the host did not take the body gzip-encoded, so nothing was
+                # stored: post it again, and the rest, uncompressed
+                if self.compress:
+                    utils.info("%s://%s%s does not take gzip-encoded posts (%s), posting uncompressed", self.scheme, self.host, self.selector, e)
+                    self.compress = False
+                continue
+            except Exception, e:
+                msg = str(e)
+            attempt += 1
+            if attempt < self.retries:
+                self.failed.wait(self.backoff(attempt - 1))
+        self.failed.set()
+        raise utils.talosError("Graph server unreachable (%d attempts)\n%s" % (self.retries, msg))
+
+    def __call__(self, payloads):
+        """post the payloads; returns their results in the order of the payloads"""
+        if not payloads:
+            return []
+        self.failed.clear()
+        threads = ThreadPool(min(self.threads, len(payloads)))
+        try:
+            results = threads.map(self.post_one, [(index, len(payloads), payload)
+                                                  for index, payload in enumerate(payloads)])
+            threads.close()
+        except:
+            # the payloads not yet posted are abandoned
+            threads.terminate()
+            raise
+        finally:
+            threads.join()
+            self.pool.close()
+        return results
+
 def encode_multipart_formdata(fields, files):
     """
     fields is a sequence of (name, value) elements for regular form fields.
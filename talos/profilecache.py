@@ -0,0 +1,268 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+cache of built profiles, keyed by a hash of the contents of the source
+profile, the prefs and the extensions they were built from, so that a test
+whose profile was built before clones it rather than building it again;
+see FFSetup.CreateTempProfileDir. Snapshots of profiles after the browser
+initialized them are kept too, keyed by the build and the built profile,
+so that the launch initializing them is skipped; see TTest.initializeProfile
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+import sidecar
+import tempfile
+import time
+import utils
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # not posix: no reflinks
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+__all__ = ['ProfileCache']
+
+VERSION = 1 # increment when the way profiles are built changes
+
+FICLONE = 0x40049409 # linux ioctl cloning a file's extents (btrfs, xfs)
+
+class ProfileCache(object):
+    """
+    a directory of built profiles, one per key, evicting the least recently
+    used once they, and the digests of the files they were built from, take
+    more than max_size bytes. A profile is cloned from
+    the cache with reflinks, where the filesystem has them, so that the
+    files the browser modifies are copied on write; otherwise files the
+    browser only reads, those of the extensions, are hardlinked, and the
+    rest copied
+    """
+
+    info = 'info.json' # extensions installed, size and other info of an entry
+    linked = 'extensions' + os.sep # hardlinked, if not reflinked
+    paths = ['prefs.js', 'extensions.ini', 'extensions.json'] # where snapshots have their profile's path
+
+    def __init__(self, directory, max_size=1024*1024*1024):
+        self.directory = os.path.abspath(directory)
+        self.digests = os.path.join(self.directory, 'digests')
+        if not os.path.isdir(self.digests):
+            os.makedirs(self.digests)
+        self.max_size = max_size
+        self.key_digests = {} # key -> names of the digests of the files it was made from
+        self.reflinks = fcntl is not None
+        self.hardlinks = hasattr(os, 'link')
+
+    def key(self, source_profile, prefs, extensions, webserver):
+        """hash of what a profile is built from"""
+        md5 = hashlib.md5()
+        md5.update('%d\0%r\0%r\0' % (VERSION, sorted(prefs.items()), webserver))
+        digests = set()
+        self.update(md5, source_profile, digests)
+        for extension in extensions:
+            md5.update('%s\0' % os.path.basename(os.path.normpath(extension)))
+            self.update(md5, extension, digests)
+        key = md5.hexdigest()
+        self.key_digests[key] = sorted(digests)
+        return key
+
+    def snapshot_key(self, key, buildid, browser_path, *args):
+        """
+        key of the snapshot of a profile, of a key, after a build initialized it;
+        the binary's modification time tells apart builds with a default buildid.
+        - args : anything else the initialization depends on
+        """
+        mtime = os.path.exists(browser_path) and os.path.getmtime(browser_path)
+        return hashlib.md5('snapshot\0%s\0%s\0%s\0%r\0%r' % (key, buildid, browser_path, mtime, args)).hexdigest()
+
+    def update(self, md5, path, digests):
+        """
+        add the contents of a file, or the names and contents of the files of a directory, to a hash;
+        the names of the digests of the files are added to the set digests
+        """
+        if not os.path.isdir(path):
+            md5.update(self.cached_digest(path, digests))
+            return
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                filename = os.path.join(root, name)
+                md5.update('%s\0%s\0' % (os.path.relpath(filename, path).replace(os.sep, '/'),
+                                         self.cached_digest(filename, digests)))
+
+    def cached_digest(self, filename, digests):
+        memo = sidecar.memo(self.digests, filename)
+        digests.add(os.path.basename(memo))
+        return sidecar.cached_digest(self.digests, filename, memo)
+
+    def clone(self, key, profile_dir):
+        """
+        make a profile at profile_dir from the cache, if it has the key;
+        returns the info it was added with, or None on a miss
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            info = json.loads(file(os.path.join(entry, self.info)).read())
+            os.utime(os.path.join(entry, self.info), None) # most recently used
+            source = os.path.join(entry, 'profile')
+            for root, dirs, files in os.walk(source):
+                rel = os.path.relpath(root, source)
+                dest = os.path.normpath(os.path.join(profile_dir, rel))
+                if not os.path.isdir(dest):
+                    os.makedirs(dest)
+                for name in files:
+                    self.clone_file(os.path.join(root, name), os.path.join(dest, name),
+                                    os.path.join(rel, name).startswith(self.linked))
+        except (IOError, OSError, ValueError), e:
+            if os.path.exists(profile_dir):
+                shutil.rmtree(profile_dir, ignore_errors=True)
+            if getattr(e, 'errno', None) != errno.ENOENT:
+                utils.info("Could not clone profile %s from %s: %s", key, self.directory, e)
+            return None
+        utils.debug("cloned profile %s from %s", key, self.directory)
+        return dict([(str(name), value) for name, value in info.items()])
+
+    def restore(self, key, profile_dir):
+        """
+        replace a profile with a snapshot from the cache, if it has the key;
+        returns the info it was added with, or None on a miss
+        """
+        restored = profile_dir + '.snapshot'
+        info = self.clone(key, restored)
+        if info is None:
+            return None
+        shutil.rmtree(profile_dir)
+        os.rename(restored, profile_dir)
+
+        # the browser wrote the path of the snapshot's profile in some files
+        for name in self.paths:
+            filename = os.path.join(profile_dir, name)
+            if not os.path.isfile(filename):
+                continue
+            contents = file(filename, 'rb').read()
+            for old, new in ((info['profile_dir'], profile_dir),
+                             (json.dumps(info['profile_dir'])[1:-1], json.dumps(profile_dir)[1:-1])):
+                contents = contents.replace(old.encode('utf-8'), new.encode('utf-8'))
+            os.remove(filename) # rather than write through a link to the cache
+            file(filename, 'wb').write(contents)
+        return info
+
+    def clone_file(self, source, dest, link):
+        """
+        clone a file from the cache: a reflink if possible; otherwise
+        a hardlink if link is true, as it won't be written to; else a copy
+        """
+        if self.reflinks:
+            try:
+                with open(source, 'rb') as src:
+                    with open(dest, 'wb') as dst:
+                        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                shutil.copymode(source, dest)
+                return
+            except (IOError, OSError):
+                self.reflinks = False # not on this filesystem
+        if link and self.hardlinks:
+            try:
+                os.link(source, dest)
+                return
+            except OSError:
+                if os.path.exists(dest):
+                    os.remove(dest)
+        shutil.copy2(source, dest)
+
+    def add(self, key, profile_dir, extensions, **info):
+        """
+        copy a built profile to the cache under a key, with the ids of its extensions
+        and any other info; the least recently used profiles are then evicted to
+        bound the cache size. The digests its key was made from are evicted with it.
+        """
+        if os.path.exists(os.path.join(self.directory, key)):
+            return
+        temp = tempfile.mkdtemp(dir=self.directory, prefix='.%s.' % key)
+        try:
+            shutil.copytree(profile_dir, os.path.join(temp, 'profile'))
+            size = sum([os.path.getsize(os.path.join(root, name))
+                        for root, dirs, files in os.walk(temp) for name in files])
+            info.update(extensions=extensions, size=size, profile_dir=os.path.abspath(profile_dir),
+                        digests=self.key_digests.get(key, []))
+            utils.write_atomic(os.path.join(temp, self.info), json.dumps(info))
+            os.rename(temp, os.path.join(self.directory, key))
+        except (IOError, OSError), e:
+            # another process added it meanwhile, or the cache is not writable
+            utils.debug("could not add profile %s to %s: %s", key, self.directory, e)
+            shutil.rmtree(temp, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        """[(last use, size, key)] of the profiles in the cache, least recently used first"""
+        entries = []
+        for key in os.listdir(self.directory):
+            info = os.path.join(self.directory, key, self.info)
+            try:
+                entries.append((os.path.getmtime(info), json.loads(file(info).read())['size'], key))
+            except (IOError, OSError, ValueError, KeyError):
+                continue # not an entry, or being evicted
+        return sorted(entries)
+
+    def entry_digests(self, key):
+        """names of the digests a profile in the cache was added with"""
+        try:
+            return json.loads(file(os.path.join(self.directory, key, self.info)).read()).get('digests', [])
+        except (IOError, OSError, ValueError):
+            return [] # being evicted
+
+    def digest_sizes(self):
+        """{name: size} of the digests in the cache"""
+        sizes = {}
+        for name in os.listdir(self.digests):
+            try:
+                sizes[name] = os.path.getsize(os.path.join(self.digests, name))
+            except OSError:
+                continue # evicted by another process
+        return sizes
+
+    def remove_digests(self, names, sizes):
+        """remove digests from the cache; returns the size freed"""
+        freed = 0
+        for name in names:
+            try:
+                os.remove(os.path.join(self.digests, name))
+            except OSError:
+                continue # evicted by another process
+            freed += sizes.get(name, 0)
+        return freed
+
+    def evict(self):
+        """
+        remove the least recently used profiles, with the digests no other profile
+        was added with, until the cache is within its size; digests of no profile,
+        as of files that changed since, go first
+        """
+        entries = self.entries()
+        digests = dict([(key, set(self.entry_digests(key))) for used, entry_size, key in entries])
+        sizes = self.digest_sizes()
+        size = sum([entry[1] for entry in entries]) + sum(sizes.values())
+        if size > self.max_size:
+            referenced = set().union(*digests.values())
+            size -= self.remove_digests([name for name in sizes if name not in referenced], sizes)
+        while entries and size > self.max_size:
+            used, entry_size, key = entries.pop(0)
+            evicted = os.path.join(self.directory, '.evicted.%s.%s' % (key, time.time()))
+            try:
+                os.rename(os.path.join(self.directory, key), evicted)
+            except OSError:
+                continue # evicted by another process
+            shutil.rmtree(evicted, ignore_errors=True)
+            size -= entry_size
+            kept = set().union(*[digests[entry[2]] for entry in entries])
+            size -= self.remove_digests(digests[key] - kept, sizes)
+            utils.debug("evicted profile %s from %s", key, self.directory)
@@ -9,12 +9,21 @@ objects and methods for parsing and serializing Talos results
 see https://wiki.mozilla.org/Buildbot/Talos/DataFormat
 """
 
+import abc
+import array
+import bisect
 import filter
+import multiprocessing
 import optparse
 import os
 import output
+import Queue
 import re
+import sidecar
+import stats
+import struct
 import sys
+import threading
 import time
 import utils
 import csv
@@ -24,14 +33,23 @@ try:
 except ImportError:
     import simplejson as json
 
-__all__ = ['TalosResults', 'TestResults', 'TsResults', 'PageloaderResults', 'BrowserLogResults', 'main']
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['TalosResults', 'TestResults', 'TsResults', 'PageloaderResults', 'BrowserLogResults', 'BrowserLogStream', 'main']
 
 class TalosResults(object):
     """Container class for Talos results"""
 
     def __init__(self, title, date, browser_config, filters, remote=False, test_name_extension=''):
+        """
+        - filters : default filter chain for tests that don't specify their own;
+                    a filter.FilterChain or anything filter.compile accepts
+        """
         self.results = []
-        self.filters = filters
+        self.filters = filter.compile(filters)
         self.test_name_extension = test_name_extension
         self.remote = remote
 
@@ -40,8 +58,64 @@ class TalosResults(object):
         self.date = date
         self.browser_config = browser_config
 
+        # values computed for the output formats, shared between them:
+        # (kind, TestResults, FilterChain) -> values
+        self._values = {}
+
     def add(self, test_results):
         self.results.append(test_results)
+        self._values.clear()
+
+    def single(self, test_results):
+        """a TalosResults of the same run with only the results of one test"""
+        results = TalosResults(self.title, self.date, self.browser_config, self.filters,
+                               remote=self.remote, test_name_extension=self.test_name_extension)
+        results.add(test_results)
+        return results
+
+    def test_filters(self, test):
+        """the filter chain for a test: its own, if specified, or the default"""
+        if 'filters' not in test.test_config:
+            return self.filters
+        try:
+            return filter.compile(test.test_config['filters'])
+        except AssertionError, e:
+            raise utils.talosError(str(e))
+
+    def values(self, test, filters=None):
+        """
+        filtered [value, page] of all cycles of a test, as for graphserver;
+        computed once and shared by all outputs.
+        - filters : filter chain; by default that of self.test_filters
+        """
+        if filters is None:
+            filters = self.test_filters(test)
+        key = ('values', test, filters)
+        if key not in self._values:
+            vals = []
+            for result in test.results:
+                vals.extend(result.values(filters))
+            self._values[key] = vals
+        return self._values[key]
+
+    def raw_values(self, test):
+        """
+        [(page, runs)] of a test with the runs of all cycles of each page
+        joined, in the order pages first appear; computed once and shared
+        by all outputs
+        """
+        key = ('raw_values', test, None)
+        if key not in self._values:
+            pages = []
+            runs = {}
+            for result in test.results:
+                for page, values in result.raw_values():
+                    if page not in runs:
+                        pages.append(page)
+                        runs[page] = []
+                    runs[page].extend(values)
+            self._values[key] = [(page, runs[page]) for page in pages]
+        return self._values[key]
 
     def check_output_formats(self, output_formats, **output_options):
         """check output formats"""
@@ -65,10 +139,16 @@ class TalosResults(object):
         """
         return [i for i in formats if i not in output.formats]
 
-    def output(self, output_formats, **output_options):
+    def output(self, output_formats, spool=None, spool_timeout=None, incremental=None, **output_options):
         """
         output all results to appropriate URLs
         - output_formats: a dict mapping formats to a list of URLs
+        - spool: spool.Spool to write the results for http:// and https:// URLs to,
+                 to be sent in the background; those not sent within spool_timeout
+                 seconds are left in the spool for `talos-spool drain`
+        - incremental: IncrementalOutput the results of each test were given to
+                       as it finished; it has output them to the http:// and https://
+                       URLs already, so only its TBPL output is collected
         - output_options: a dict mapping formats to options for each format
         """
 
@@ -76,12 +156,33 @@ class TalosResults(object):
         tbpl_output = {}
         try:
 
+            if incremental is not None:
+                tbpl_output = incremental.finish(spool_timeout if spool is not None else None)
+
             for key, urls in output_formats.items():
+                if incremental is not None:
+                    urls = [url for url in urls if not IncrementalOutput.remote(url)]
+                    if not urls:
+                        continue
                 options = output_options.get(key, {})
                 _output = output.formats[key](self, **options)
                 results = _output()
                 for url in urls:
-                    _output.output(results, url, tbpl_output)
+                    if spool is not None and IncrementalOutput.remote(url):
+                        spool.add(key, url, results, options)
+                    else:
+                        _output.output(results, url, tbpl_output)
+
+            if incremental is not None and incremental.error is not None and spool is None:
+                raise incremental.error
+
+            if spool is not None and spool.added:
+                sender = spool.sender()
+                sender.start()
+                sender.join(spool_timeout)
+                tbpl_output.update(sender.tbpl_output())
+                if sender.isAlive() or sender.left:
+                    print "Results not yet sent are left in %s for talos-spool drain" % spool.directory
 
         except utils.talosError, e:
             # print to results.out
@@ -97,10 +198,90 @@ class TalosResults(object):
         print "TinderboxPrint: TalosResult: %s" % json.dumps(tbpl_output)
 
 
+class IncrementalOutput(threading.Thread):
+    """
+    outputs the results of each test to the http:// and https:// URLs
+    in the background as soon as the test finishes, while the next runs;
+    the TBPL output is collected from the responses for each test
+    """
+
+    def __init__(self, talos_results, output_formats, spool=None, **output_options):
+        """
+        - talos_results : TalosResults of the run
+        - output_formats : a dict mapping formats to a list of URLs, as for TalosResults.output
+        - spool : spool.Spool to send the results through; those that can't be
+                  sent are left in it, to be retried by the spool's sender
+        - output_options : a dict mapping formats to options for each format
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True # what is not sent when talos exits is in the spool, if any
+        self.talos_results = talos_results
+        self.output_formats = dict([(key, [url for url in urls if self.remote(url)])
+                                    for key, urls in output_formats.items()])
+        self.spool = spool
+        self.output_options = output_options
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self._tbpl_output = {}
+        self.error = None # first failure to output, if not spooled
+
+    @classmethod
+    def remote(cls, url):
+        """whether results to the URL are output incrementally"""
+        return utils.urlsplit(url)[0] in ('http', 'https')
+
+    def add(self, test_results):
+        """output the results of a test, once those before it are"""
+        self.queue.put(test_results)
+
+    def run(self):
+        while True:
+            test_results = self.queue.get()
+            if test_results is None:
+                return
+            results = self.talos_results.single(test_results)
+            tbpl_output = {}
+            for key, urls in self.output_formats.items():
+                if not urls:
+                    continue
+                options = self.output_options.get(key, {})
+                try:
+                    _output = output.formats[key](results, **options)
+                    payload = _output()
+                    for url in urls:
+                        if self.spool is not None:
+                            self.spool.send(self.spool.add(key, url, payload, options), tbpl_output)
+                        else:
+                            _output.output(payload, url, tbpl_output)
+                except Exception, e:
+                    utils.info("Failed to output %s results of %s: %s", key, test_results.name(), e)
+                    if self.error is None:
+                        self.error = e if isinstance(e, utils.talosError) else utils.talosError(str(e))
+            with self.lock:
+                for key, value in tbpl_output.items():
+                    self._tbpl_output.setdefault(key, {}).update(value)
+
+    def tbpl_output(self):
+        """TBPL output of the tests output so far"""
+        with self.lock:
+            return dict([(key, value.copy()) for key, value in self._tbpl_output.items()])
+
+    def finish(self, timeout=None):
+        """wait up to timeout seconds for the tests added to be output; returns their TBPL output"""
+        self.queue.put(None)
+        self.join(timeout)
+        if self.isAlive():
+            utils.info("Results of some tests were not output within %s seconds", timeout)
+        return self.tbpl_output()
+
+
 class TestResults(object):
     """container object for all test results across cycles"""
 
-    def __init__(self, test_config, global_counters=None, extensions=None):
+    def __init__(self, test_config, global_counters=None, extensions=None, cache_dir=None):
+        """
+        - cache_dir : directory of sidecar files of parsed browser logs (see BrowserLogResults)
+        """
         self.results = []
         self.test_config = test_config
         self.format = None
@@ -108,6 +289,8 @@ class TestResults(object):
         self.all_counter_results = []
         self.extensions = extensions
         self.using_xperf = False
+        self.stats = {} # page -> stats.RunningStats of the runs of all cycles so far
+        self.cache_dir = cache_dir
 
     def name(self):
         return self.test_config['name']
@@ -115,20 +298,28 @@ class TestResults(object):
     def add(self, results, counter_results=None):
         """
         accumulate one cycle of results
-        - results : TalosResults instance or path to browser log
+        - results : TalosResults instance, path to browser log or BrowserLogStream
         - counter_results : counters accumulated for this cycle
         """
 
-        if isinstance(results, basestring):
+        if isinstance(results, BrowserLogStream):
+            # convert to a results class from the browser log, as parsed while it was written
+            browserLog = BrowserLogResults(filename=results.filename, results_raw=results,
+                                           counter_results=counter_results, global_counters=self.global_counters)
+            results = browserLog.results()
+            self.using_xperf = browserLog.using_xperf
+
+        elif isinstance(results, basestring):
             # ensure the browser log exists
             if not os.path.isfile(results):
-                raise talosError("no output from browser [%s]" % results)
+                raise utils.talosError("no output from browser [%s]" % results)
 
             # convert to a results class via parsing the browser log
-            browserLog = BrowserLogResults(filename=results, counter_results=counter_results, global_counters=self.global_counters)
+            browserLog = BrowserLogResults(filename=results, counter_results=counter_results, global_counters=self.global_counters,
+                                           cache_dir=self.cache_dir)
             results = browserLog.results()
+            self.using_xperf = browserLog.using_xperf
 
-        self.using_xperf = browserLog.using_xperf
         # ensure the results format matches previous results
         if self.results:
             if not results.format == self.results[0].format:
@@ -138,32 +329,101 @@ class TestResults(object):
 
         self.results.append(results)
 
+        # update the running per-page statistics
+        debug = utils.debug_enabled()
+        for page, runs in results.raw_values():
+            page_stats = self.stats.setdefault(page, stats.RunningStats())
+            page_stats.extend(runs)
+            page_stats.end_cycle()
+            if debug:
+                utils.debug("%s: cycle %d: %s: %s", self.name(), len(self.results), page,
+                            page_stats.summary())
+
         if counter_results:
             self.all_counter_results.append(counter_results)
 
+    def summary(self, page):
+        """summary statistics of all runs of a page seen so far"""
+        return self.stats[page].summary()
+
 class Results(object):
+    """
+    results of one cycle, stored by column: the manifest index and
+    (interned) name of each page, and the runs of all pages one after
+    another in an array of doubles, those of page i being
+    runs[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self):
+        self.indices = array.array('l')
+        self.pages = []
+        self.runs = array.array('d')
+        self.offsets = array.array('l', [0])
+
+    @classmethod
+    def from_columns(cls, indices, pages, runs, offsets):
+        """results from columns as stored by another instance, without parsing"""
+        results = cls.__new__(cls)
+        Results.__init__(results)
+        results.counter_results = None
+        results.indices.extend(indices)
+        for page in pages:
+            if isinstance(page, str):
+                page = intern(page)
+            results.pages.append(page)
+        results.runs = runs
+        results.offsets = array.array('l', offsets)
+        return results
+
+    def __setstate__(self, state):
+        # share the page names of results from other processes, as add does
+        self.__dict__.update(state)
+        self.pages = [isinstance(page, str) and intern(page) or page
+                      for page in self.pages]
+
+    def add(self, index, page, runs):
+        """add the runs of a page"""
+        self.indices.append(index)
+        if isinstance(page, str):
+            page = intern(page) # share the name between cycles
+        self.pages.append(page)
+        self.runs.extend(runs)
+        self.offsets.append(len(self.runs))
+
+    def page_runs(self, i):
+        """the runs of page i, as a list"""
+        return self.runs[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    @property
+    def results(self):
+        """list of {'index', 'page', 'runs'} for each page; built on each access"""
+        return [{'index': index, 'page': page, 'runs': self.page_runs(i)}
+                for i, (index, page) in enumerate(zip(self.indices, self.pages))]
+
+    def array(self):
+        """numpy view of the runs of all pages, sharing their memory"""
+        return numpy.frombuffer(self.runs, dtype=numpy.float64)
+
     def filter(self, *filters):
         """
         filter the results set;
         applies each of the filters in order to the results data
         filters should be callables that take a list
         the last filter should return a scalar (float or int)
+        alternatively, a single filter.FilterChain may be passed
         returns a list of [[data, page], ...]
         """
-        retval = []
-        for result in self.results:
-            page = result['page']
-            data = result['runs']
-            data = filter.apply(data, filters)
-            retval.append([data, page])
-        return retval
+        if len(filters) == 1 and isinstance(filters[0], filter.FilterChain):
+            filters = filters[0]
+        data = filter.compile(filters).columns(self.runs, self.offsets)
+        return [[value, page] for value, page in zip(data, self.pages)]
 
     def raw_values(self):
-        return [(result['page'], result['runs']) for result in self.results]
+        return [(page, self.page_runs(i)) for i, page in enumerate(self.pages)]
 
     def values(self, filters):
         """return filtered (value, page) for each value"""
-        return [[val, page] for val, page in self.filter(*filters)
+        return [[val, page] for val, page in self.filter(filter.compile(filters))
                 if val > -1]
 
 
@@ -175,36 +435,28 @@ class TsResults(Results):
     format = 'tsformat'
 
     def __init__(self, string, counter_results=None):
+        Results.__init__(self)
         self.counter_results = counter_results
 
         string = string.strip()
         lines = string.splitlines()
 
         # gather the data
-        self.results = []
         index = 0
 
         # Handle the case where we support a pagename in the results (new format)
         for line in lines:
-            result = {}
             r = line.strip().split(',')
             r = [i for i in r if i]
             if len(r) <= 1:
                 continue
-            result['index'] = index
-            result['page'] = r[0]
             #note: if we have len(r) >1, then we have pagename,raw_results
-            result['runs'] = [float(i) for i in r[1:]]
-            self.results.append(result)
+            self.add(index, r[0], [float(i) for i in r[1:]])
             index += 1
 
         # The original case where we just have numbers and no pagename
-        if not self.results:
-            result = {}
-            result['index'] = index
-            result['page'] = 'NULL'
-            result['runs'] = [float(val) for val in string.split('|')]
-            self.results.append(result)
+        if not self.pages:
+            self.add(index, 'NULL', [float(val) for val in string.split('|')])
 
 
 class PageloaderResults(Results):
@@ -221,6 +473,7 @@ class PageloaderResults(Results):
         - counter_results : counter results dictionary
         """
 
+        Results.__init__(self)
         self.counter_results = counter_results
 
         string = string.strip()
@@ -233,21 +486,12 @@ class PageloaderResults(Results):
         lines = [line for line in lines if ';' in line]
 
         # gather the data
-        self.results = []
         for line in lines:
-            result = {}
             r = line.strip('|').split(';')
             r = [i for i in r if i]
             if len(r) <= 2:
                 continue
-            result['index'] = int(r[0])
-            result['page'] = r[1]
-            result['runs'] = [float(i) for i in r[2:]]
-
-            # fix up page
-            result['page'] = self.format_pagename(result['page'])
-
-            self.results.append(result)
+            self.add(int(r[0]), self.format_pagename(r[1]), [float(i) for i in r[2:]])
 
     def format_pagename(self, page):
         """
@@ -273,14 +517,21 @@ class BrowserLogResults(object):
                    ('endTime', ('__startAfterTerminationTimestamp', '__endAfterTerminationTimestamp'))
                    ]
 
-    # regular expression for failure case if we can't parse the tokens
-    RESULTS_REGEX_FAIL = re.compile('__FAIL(.*?)__FAIL', re.DOTALL|re.MULTILINE)
+    # tokens for the time spent in cycle collection between page loads, if forced
+    cc_tokens = ('__start_cc_report', '__end_cc_report')
+    CC_REGEX = re.compile('_x_x_mozilla_cycle_collect,(\S*)')
+
+    # token for failure case if we can't parse the tokens:
+    # the output between the first two of these is the error message
+    fail_token = '__FAIL'
 
-    # regular expression for RSS results
-    RSS_REGEX = re.compile('RSS:\s+([a-zA-Z0-9]+):\s+([0-9]+)$')
+    # regular expression for RSS results, one per line
+    # (logs are read in binary mode, so lines may end with '\r\n')
+    RSS_REGEX = re.compile('RSS:[^\S\n]+([a-zA-Z0-9]+):[^\S\n]+([0-9]+)\r?$', re.MULTILINE)
+    rss_counters = ['Main_RSS', 'Content_RSS']
 
     # regular expression for responsiveness results
-    RESULTS_RESPONSIVENESS_REGEX = re.compile('MOZ_EVENT_TRACE\ssample\s\d*?\s(\d*\.?\d*)$', re.DOTALL|re.MULTILINE)
+    RESULTS_RESPONSIVENESS_REGEX = re.compile('MOZ_EVENT_TRACE\ssample\s\d*?\s(\d*\.?\d*)\r?$', re.DOTALL|re.MULTILINE)
 
     # classes for results types
     classes = {'tsformat': TsResults,
@@ -289,38 +540,61 @@ class BrowserLogResults(object):
     # If we are using xperf, we do not upload the regular results, only xperf counters
     using_xperf = False
 
-    def __init__(self, filename=None, results_raw=None, counter_results=None, global_counters=None):
+    def __init__(self, filename=None, results_raw=None, counter_results=None, global_counters=None,
+                 cache_dir=None):
         """
-        - shutdown : whether to record shutdown results or not
+        - cache_dir : directory of sidecar files of parsed logs, keyed by the hash
+                      of the log; a log parsed before is loaded from its sidecar
+                      instead of being parsed again
         """
 
         self.counter_results = counter_results
         self.global_counters = global_counters
+        self.cache_dir = cache_dir
+        self._results = None
 
         if not (results_raw or filename):
             raise utils.talosError("Must specify filename or results_raw")
 
         self.filename = filename
         if results_raw is None:
-            # read the file
+            # map the file, so that only the report is read into memory
 
             if not os.path.isfile(filename):
                 raise utils.talosError("File '%s' does not exist" % filename)
 
-            try:
-               with open(filename, 'r') as f:
-                   results_raw = f.read()
-            except Exception, e:
-                raise exception
+            if cache_dir is not None:
+                sidecar_path = sidecar.path(cache_dir, filename)
+                if os.path.exists(sidecar_path):
+                    try:
+                        self.load(sidecar_path)
+                    except (ValueError, struct.error, IOError), e:
+                        # unreadable or stale: parsed again, and rewritten
+                        utils.info("Ignoring sidecar %s: %s", sidecar_path, e)
+                    else:
+                        self.counters(self.counter_results, self.global_counters)
+                        return
+
+            with utils.MappedFile(filename) as results_raw:
+                self.process(results_raw)
+            self.results_raw = None # the file is closed
+
+            if cache_dir is not None:
+                self.save(sidecar_path)
+        else:
+            self.process(results_raw)
+
+    def process(self, results_raw):
+        """parse the browser log, a string or utils.MappedFile, and accumulate the counters"""
 
         self.results_raw = results_raw
 
         # parse the results
+        self.scan()
         try:
-            match = self.RESULTS_REGEX_FAIL.search(self.results_raw)
-            if match:
-                self.error(match.group(1))
-                raise utils.talosError(match.group(1))
+            failures = self.token_positions.get(self.fail_token, [])
+            if len(failures) > 1:
+                self.error(self.results_raw[failures[0] + len(self.fail_token):failures[1]])
 
             self.parse()
         except utils.talosError:
@@ -336,6 +610,56 @@ class BrowserLogResults(object):
             message += ' [%s]' % self.filename
         raise utils.talosError(message)
 
+    @classmethod
+    def scanner(cls):
+        """
+        regular expression matching any of the tokens; no token may overlap
+        another in the log. The common prefix of the tokens is factored out
+        so that the regular expression engine can search for it as a literal
+        """
+        if '_scanner' not in cls.__dict__:
+            tokens = set([cls.fail_token])
+            tokens.update(cls.cc_tokens)
+            for attr, pair in cls.report_tokens + cls.time_tokens:
+                tokens.update(pair)
+            prefix = os.path.commonprefix(list(tokens))
+            tokens = sorted([token[len(prefix):] for token in tokens], key=len, reverse=True)
+            cls._scanner = re.compile('%s(?:%s)' % (re.escape(prefix),
+                                                    '|'.join([re.escape(token) for token in tokens])))
+        return cls._scanner
+
+    def scan(self):
+        """
+        find the positions of all tokens, and the RSS and responsiveness
+        values if those counters are wanted, in a single pass over the browser log
+        """
+        if isinstance(self.results_raw, BrowserLogStream):
+            # already scanned as the log was written
+            self.token_positions = self.results_raw.token_positions
+            self.rss_values = self.results_raw.rss_values
+            self.responsiveness_values = self.results_raw.responsiveness_values
+            return
+
+        self.token_positions = {}
+        self.rss_values = []
+        self.responsiveness_values = []
+
+        def token(position, match):
+            self.token_positions.setdefault(match.group(), []).append(position)
+        def rss(position, match):
+            self.rss_values.append(match.groups())
+        def responsiveness(position, match):
+            self.responsiveness_values.append(match.group(1))
+
+        # all counters are kept in a sidecar, whether wanted this time or not
+        cache = self.cache_dir is not None
+        handlers = [(self.scanner(), token)]
+        if cache or self.counter_results is not None and set(self.rss_counters).intersection(self.counter_results.keys()):
+            handlers.append((self.RSS_REGEX, rss))
+        if cache or self.global_counters is not None and 'responsiveness' in self.global_counters:
+            handlers.append((self.RESULTS_RESPONSIVENESS_REGEX, responsiveness))
+        utils.scan(self.results_raw, *handlers)
+
     def parse(self):
         position = -1
 
@@ -372,10 +696,24 @@ class BrowserLogResults(object):
             position = _last_token
             previous_tokens = tokens
 
+        # parse the cycle collection report, if any
+        self.cc_time = None
+        report, _last_token = self.get_single_token(*self.cc_tokens)
+        if report is not None:
+            match = self.CC_REGEX.search(report)
+            if not match:
+                self.error("Could not find cycle collection time in browser output: %s" % report)
+            try:
+                self.cc_time = int(match.group(1))
+            except ValueError:
+                self.error("Could not cast cc_time to an integer: %s" % match.group(1))
+
     def get_single_token(self, start_token, end_token):
         """browser logs should only have a single instance of token pairs"""
         try:
-            parts, last_token = utils.tokenize(self.results_raw, start_token, end_token)
+            parts, last_token = utils.match_tokens(self.results_raw, start_token, end_token,
+                                                   self.token_positions.get(start_token, []),
+                                                   self.token_positions.get(end_token, []))
         except AssertionError, e:
             self.error(str(e))
         if not parts:
@@ -390,7 +728,48 @@ class BrowserLogResults(object):
         if self.format not in self.classes:
             raise utils.talosError("Unable to find a results class for format: %s" % repr(self.format))
 
-        return self.classes[self.format](self.browser_results)
+        if self._results is None:
+            self._results = self.classes[self.format](self.browser_results)
+        return self._results
+
+    ### methods for sidecars
+
+    def save(self, filename):
+        """save the parsed log to a sidecar file"""
+        results = self.results()
+        packer = sidecar.Packer()
+        packer.string(self.format)
+        for attr, tokens in self.time_tokens:
+            packer.int(getattr(self, attr))
+        packer.ints(results.indices)
+        packer.strings(results.pages)
+        packer.ints(results.offsets)
+        packer.doubles(results.runs)
+        packer.strings([value for rss in self.rss_values for value in rss])
+        packer.strings(self.responsiveness_values)
+        packer.ints([self.cc_time] if self.cc_time is not None else [])
+        packer.save(filename)
+
+    def load(self, filename):
+        """load the parsed log from a sidecar file written by save"""
+        unpacker = sidecar.Unpacker(filename)
+        self.format = unpacker.string()
+        if self.format not in self.classes:
+            raise ValueError("Unknown format: %s" % self.format)
+        for attr, tokens in self.time_tokens:
+            setattr(self, attr, unpacker.int())
+        indices = unpacker.ints()
+        pages = unpacker.strings()
+        offsets = unpacker.ints()
+        runs = unpacker.doubles()
+        self._results = self.classes[self.format].from_columns(indices, pages, runs, offsets)
+        rss = unpacker.strings()
+        self.rss_values = zip(rss[::2], rss[1::2])
+        self.responsiveness_values = unpacker.strings()
+        cc_time = unpacker.ints()
+        self.cc_time = cc_time[0] if cc_time else None
+        self.browser_results = None # the report itself isn't kept
+        self.results_raw = None
 
     ### methods for counters
 
@@ -403,6 +782,8 @@ class BrowserLogResults(object):
         if global_counters is not None:
             if 'shutdown' in global_counters:
                 self.shutdown(global_counters)
+            if 'cc_time' in global_counters:
+                self.cc(global_counters)
             if 'responsiveness' in global_counters:
                 global_counters['responsiveness'].extend(self.responsiveness())
             self.xperf(global_counters)
@@ -428,80 +809,260 @@ class BrowserLogResults(object):
             return
 
         filename = 'etl_output_thread_stats.csv'
-        if not os.path.exists(filename):
+        thread_stats = XperfThreadStats.load(filename)
+        if thread_stats is None:
             print "Warning: we are looking for xperf results file %s, and didn't find it" % filename
             return
 
-        contents = file(filename).read()
-        lines = contents.splitlines()
-        reader = csv.reader(lines)
-        header = None
-        for row in reader:
-            # Read CSV
-            row = [i.strip() for i in row]
-            if not header:
-                # We are assuming the first row is the header and all other data is counters
-                header = row
-                continue
-            values = dict(zip(header, row))
-
-            # Format for talos
-            thread = values['thread']
-            counter = values['counter'].rsplit('_io_bytes', 1)[0]
-            counter_name = '%s_%s_%sio' % (thread, values['stage'], counter)
-            value = float(values['value'])
-
-            # Accrue counter
-            if counter_name in counter_results:
-                counter_results.setdefault(counter_name, []).append(value)
+        # Accrue counters
+        for counter_name in counter_results.keys():
+            values = thread_stats.counter(counter_name)
+            if values:
+                counter_results[counter_name].extend(values)
                 self.using_xperf = True
 
         if (set(mainthread_counters).intersection(counter_results.keys())):
             filename = 'etl_output.csv'
-            if not os.path.exists(filename):
+            file_io = XperfFileIO.load(filename)
+            if file_io is None:
                 print "Warning: we are looking for xperf results file %s, and didn't find it" % filename
                 return
 
-            contents = file(filename).read()
-            lines = contents.splitlines()
-            reader = csv.reader(lines)
-            header = None
-            for row in reader:
-                row = [i.strip() for i in row]
-                if not header:
-                    # We are assuming the first row is the header and all other data is counters
-                    header = row
-                    continue
-                values = dict(zip(header, row))
-                for i, mainthread_counter in enumerate(mainthread_counters):
-                    if int(values[mainthread_counter_keys[i]]) > 0:
-                        counter_results.setdefault(mainthread_counter, []).append(
-                            [int(values[mainthread_counter_keys[i]]),
-                            values['filename']])
+            for key, mainthread_counter in zip(mainthread_counter_keys, mainthread_counters):
+                values = file_io.mainthread(key)
+                if values:
+                    counter_results.setdefault(mainthread_counter, []).extend(values)
 
     def rss(self, counter_results):
         """record rss counters in counter_results dictionary"""
 
-        counters = ['Main', 'Content']
-        if not set(['%s_RSS' % i for i in counters]).intersection(counter_results.keys()):
+        if not set(self.rss_counters).intersection(counter_results.keys()):
             # no RSS counters to accumulate
             return
-        for line in self.results_raw.split('\n'):
-            rssmatch = self.RSS_REGEX.search(line)
-            if rssmatch:
-                (type, value) = (rssmatch.group(1), rssmatch.group(2))
-                # type will be 'Main' or 'Content'
-                counter_name = '%s_RSS' % type
-                if counter_name in counter_results:
-                    counter_results[counter_name].append(value)
+        for type, value in self.rss_values:
+            # type will be 'Main' or 'Content'
+            counter_name = '%s_RSS' % type
+            if counter_name in counter_results:
+                counter_results[counter_name].append(value)
 
     def shutdown(self, counter_results):
         """record shutdown time in counter_results dictionary"""
         counter_results.setdefault('shutdown', []).append(int(self.endTime - self.startTime))
 
+    def cc(self, counter_results):
+        """record the time spent in cycle collection in counter_results dictionary"""
+        if self.cc_time is not None:
+            counter_results.setdefault('cc_time', []).append(self.cc_time)
+
     def responsiveness(self):
-        return self.RESULTS_RESPONSIVENESS_REGEX.findall(self.results_raw)
+        return self.responsiveness_values
+
+
+class BrowserLogStream(object):
+    """
+    the browser log, fed as it is written (see talosProcess.logToFile)
+    rather than read back from the file once the browser has quit.
+    Tokens and counter values are found as each piece arrives and only
+    the text within token pairs is kept, which is all BrowserLogResults
+    needs to parse the log; pass this as its results_raw.
+    Pieces should be whole lines, so that no token is split between them.
+    """
+
+    def __init__(self, filename=None):
+        """
+        - filename : the log file written alongside, for error messages
+        """
+        self.filename = filename
+        self.size = 0
+        self.token_positions = {}
+        self.rss_values = []
+        self.responsiveness_values = []
+        self.kept = [] # text within token pairs
+        self.kept_positions = [] # and its position in the log
+        self.lock = threading.Lock() # the browser output and talosProcess's quit thread both write
+
+        # count of each start token and the fail token still open
+        self.pairs = dict([pair for attr, pair in BrowserLogResults.report_tokens + BrowserLogResults.time_tokens])
+        self.pairs[BrowserLogResults.cc_tokens[0]] = BrowserLogResults.cc_tokens[1]
+        self.ends = dict([(end, start) for start, end in self.pairs.items()])
+        self.unmatched = dict([(start, 0) for start in self.pairs])
+        self.unmatched[BrowserLogResults.fail_token] = 0
+
+    def __len__(self):
+        return self.size
+
+    def is_open(self):
+        """whether the log is within a token pair"""
+        return bool([token for token, count in self.unmatched.items() if count > 0])
+
+    def feed(self, text):
+        """add the next piece of the log"""
+        tokens = []
+        def token(position, match):
+            tokens.append(match.group())
+            self.token_positions.setdefault(match.group(), []).append(self.size + position)
+        def rss(position, match):
+            self.rss_values.append(match.groups())
+        def responsiveness(position, match):
+            self.responsiveness_values.append(match.group(1))
+
+        self.lock.acquire()
+        try:
+            keep = self.is_open()
+            utils.scan(text,
+                       (BrowserLogResults.scanner(), token),
+                       (BrowserLogResults.RSS_REGEX, rss),
+                       (BrowserLogResults.RESULTS_RESPONSIVENESS_REGEX, responsiveness))
+            for name in tokens:
+                if name == BrowserLogResults.fail_token:
+                    # only the text between the first two is used
+                    self.unmatched[name] = int(len(self.token_positions[name]) == 1)
+                elif name in self.pairs:
+                    self.unmatched[name] += 1
+                else:
+                    self.unmatched[self.ends[name]] -= 1
+            if keep or tokens:
+                self.kept.append(text)
+                self.kept_positions.append(self.size)
+            self.size += len(text)
+        finally:
+            self.lock.release()
+
+    def __getitem__(self, index):
+        """the text of a slice within a token pair"""
+        start, stop, step = index.indices(self.size)
+        assert step == 1, "BrowserLogStream only supports contiguous slices"
+        if stop <= start:
+            return ''
+        first = bisect.bisect_right(self.kept_positions, start) - 1
+        last = bisect.bisect_left(self.kept_positions, stop)
+        assert first >= 0, "Log text at %d was not kept" % start
+        position = self.kept_positions[first]
+        for kept_position, text in zip(self.kept_positions[first:last], self.kept[first:last]):
+            assert kept_position == position, "Log text at %d was not kept" % position
+            position += len(text)
+        assert position >= stop, "Log text at %d was not kept" % position
+        offset = self.kept_positions[first]
+        return ''.join(self.kept[first:last])[start - offset:stop - offset]
+
+class XperfCSV(object):
+    """
+    a csv file written by xtalos/etlparser.py, parsed only once for each
+    (path, mtime, size) and indexed for the lookups BrowserLogResults.xperf makes
+    """
+
+    __metaclass__ = abc.ABCMeta
 
+    # path -> ((mtime, size), instance), for each subclass
+    _cache = None
+
+    @classmethod
+    def load(cls, path):
+        """the parsed file, re-read only if it has changed; None if it does not exist"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if cls._cache is None:
+            cls._cache = {}
+        key = (stat.st_mtime, stat.st_size)
+        if path not in cls._cache or cls._cache[path][0] != key:
+            cls._cache[path] = (key, cls(path))
+        return cls._cache[path][1]
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            # etlparser.py separates the fields with ', '
+            reader = csv.reader(f, skipinitialspace=True)
+            # We are assuming the first row is the header and all other data is counters
+            header = [i.strip() for i in reader.next()]
+            self.parse(header, (row for row in reader if row))
+
+    @abc.abstractmethod
+    def parse(self, header, rows):
+        """index the rows, lists of the fields of each, by the columns of the header"""
+
+
+class XperfThreadStats(XperfCSV):
+    """etl_output_thread_stats.csv: the value of each counter of each stage of each thread"""
+
+    def parse(self, header, rows):
+        thread, stage, counter, value = [header.index(column)
+                                         for column in ('thread', 'stage', 'counter', 'value')]
+        self.index = {} # (thread, stage, counter) -> values
+        self.names = {} # talos counter name -> values
+        lists = {} # (thread, stage, counter) -> both lists of values
+        for row in rows:
+            key = (row[thread].strip(), row[stage].strip(), row[counter].strip().rsplit('_io_bytes', 1)[0])
+            if key not in lists:
+                lists[key] = (self.index.setdefault(key, []),
+                              self.names.setdefault('%s_%s_%sio' % key, []))
+            index_values, name_values = lists[key]
+            index_values.append(float(row[value]))
+            name_values.append(index_values[-1])
+
+    def counter(self, name):
+        """values of a talos counter, e.g. main_startup_fileio"""
+        return self.names.get(name, [])
+
+
+class XperfFileIO(XperfCSV):
+    """etl_output.csv: the I/O counts of each file accessed, by thread and stage"""
+
+    keys = ['readcount', 'readbytes', 'writecount', 'writebytes']
+
+    def parse(self, header, rows):
+        filename = header.index('filename')
+        columns = [header.index(key) for key in self.keys]
+        self.nonzero = dict([(key, []) for key in self.keys]) # key -> [[count, filename]]
+        nonzero = [self.nonzero[key] for key in self.keys]
+        for row in rows:
+            name = row[filename].strip()
+            counts = [int(row[column]) for column in columns]
+            for values, count in zip(nonzero, counts):
+                if count > 0:
+                    values.append([count, name])
+
+    def mainthread(self, key):
+        """
+        [count, filename] for each file with a nonzero count, e.g. of readbytes;
+        the entries are shared between lookups and should not be modified
+        """
+        return self.nonzero[key]
+
+
+def parse_log(args):
+    """
+    TestResults of a browser log, named for its path;
+    - args : (path, cache_dir), as a single argument for a process pool
+    """
+    filename, cache_dir = args
+    test_results = TestResults({'name': filename}, cache_dir=cache_dir)
+    test_results.add(filename)
+    return test_results
+
+def parse_logs(filenames, jobs=1, cache_dir=None):
+    """
+    TestResults of each browser log, in the order given;
+    - jobs : number of processes to parse the logs in
+    """
+    args = [(filename, cache_dir) for filename in filenames]
+    if jobs <= 1 or len(args) <= 1:
+        for arg in args:
+            yield parse_log(arg)
+        return
+    pool = multiprocessing.Pool(min(jobs, len(args)))
+    try:
+        # imap returns the results in order, however the work is shared
+        chunksize = max(1, len(args) / (4 * jobs))
+        for test_results in pool.imap(parse_log, args, chunksize):
+            yield test_results
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 def main(args=sys.argv[1:]):
 
@@ -515,10 +1076,18 @@ def main(args=sys.argv[1:]):
                       default='qm-pxp01')
     parser.add_option("--date", dest="date",
                       default=time.time())
-    options, args = parser.parse_args()
+    parser.add_option("--cache-dir", dest="cache_dir",
+                      help="directory of parsed browser logs to load instead of parsing them again")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="number of processes to parse the browser logs in [DEFAULT: %default]")
+    parser.add_option("-o", "--output", dest="output",
+                      help="file:// URL to write the graphserver-format data to [DEFAULT: stdout]")
+    options, args = parser.parse_args(args)
     if not args:
         parser.print_help()
         parser.exit()
+    if options.output and utils.urlsplit(options.output)[0] != 'file':
+        parser.error("Only file:// URLs are supported for --output")
 
     # make a browser_config dictionary with minimal information
     browser_config = {'branch_name': '',
@@ -530,27 +1099,25 @@ def main(args=sys.argv[1:]):
 
     # filters
     # TODO: add to CLI options
-    filters = [filter.ignore_max, filter.mean]
+    filters = filter.compile([['ignore_max', []], ['mean', []]])
 
     # gather the results
     results = TalosResults(title=options.title,
                            date=options.date,
                            browser_config=browser_config,
                            filters=filters)
-    for arg in args:
-        browser_log = BrowserLogResults(arg)
-        test_results = TestResults({'name': arg})
-        test_results.add(browser_log.results())
+    if options.cache_dir and not os.path.isdir(options.cache_dir):
+        os.makedirs(options.cache_dir)
+    for test_results in parse_logs(args, options.jobs, options.cache_dir):
         results.add(test_results)
 
-    # print the graphserver-format data
+    # output the graphserver-format data
     # TODO: add the ability to specify results_urls, raw_results_urls
-    # and ability to output to stdout
-    import tempfile
-    filename = tempfile.mktemp()
-    results.output(results_urls=['file://%s' % filename])
-    contents = file(filename).read()
-    print contents
+    graphserver = output.GraphserverOutput(results)
+    if options.output:
+        graphserver.output(graphserver(), options.output, {})
+    else:
+        graphserver.write(graphserver(), sys.stdout)
 
 if __name__ == '__main__':
     main()
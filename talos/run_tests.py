@@ -9,6 +9,7 @@ import filter
 import optparse
 import os
 import PerfConfigurator
+import platform
 import post_file
 import sys
 import time
@@ -16,9 +17,11 @@ import traceback
 import urllib
 import urlparse
 import utils
+import workers
 import json
 
-from results import TalosResults
+from results import IncrementalOutput, TalosResults
+from spool import Spool
 from ttest import TTest
 from utils import talosError, talosCrash, talosRegression
 
@@ -179,6 +182,14 @@ def setup_webserver(webserver):
     print "WARNING: unable to start web server without custom port configured"
     return None
 
+def finish_output(incremental, spool, browser_config):
+  """when stopping early, let the results of the tests completed be output"""
+  if incremental is None:
+    return
+  incremental.finish(browser_config.get('spool_timeout') if spool is not None else None)
+  if spool is not None and spool.entries():
+    print "Results not yet sent are left in %s for talos-spool drain" % spool.directory
+
 def run_tests(configurator):
   """Runs the talos tests on the given configuration and generates a report.
 
@@ -191,7 +202,7 @@ def run_tests(configurator):
   # data filters
   filters = config['filters']
   try:
-      filters = filter.filters_args(filters)
+      filters = filter.compile(filters)
   except AssertionError, e:
       raise talosError(str(e))
 
@@ -217,10 +228,11 @@ def run_tests(configurator):
     test['setup'] = utils.interpolatePath(test['setup'])
     test['cleanup'] = utils.interpolatePath(test['cleanup'])
 
-    # ensure test-specific filters are valid
+    # ensure test-specific filters are valid;
+    # the compiled chains are cached for the output formats
     if 'filters' in test:
       try:
-        filter.filters_args(test['filters'])
+        filter.compile(test['filters'])
       except AssertionError, e:
         raise talosError(str(e))
       except IndexError, e:
@@ -303,6 +315,16 @@ def run_tests(configurator):
   results_urls, results_options = configurator.output_options()
   talos_results.check_output_formats(results_urls, **results_options)
 
+  # spool of results to http:// and https:// URLs, and output of
+  # the results of each test as soon as it finishes, if asked
+  spool = None
+  if results_urls and browser_config.get('spool_dir'):
+    spool = Spool(browser_config['spool_dir'])
+  incremental = None
+  if results_urls and browser_config.get('incremental_output'):
+    incremental = IncrementalOutput(talos_results, results_urls, spool=spool, **results_options)
+    incremental.start()
+
   results_log = browser_config['results_log']
 
   # setup a webserver, if --develop is specified to PerfConfigurator.py
@@ -312,45 +334,74 @@ def run_tests(configurator):
     if httpd:
       httpd.start()
 
+  # tests marked parallel-safe, with --parallelTests, run concurrently on workers after the others
+  serial, parallel = range(len(tests)), []
+  if browser_config.get('workers', 0) > 1:
+    if browser_config['remote'] or browser_config['develop'] or platform.system() != 'Linux':
+      utils.info("Workers are only used for local tests on Linux, not in develop mode; running tests one at a time")
+    else:
+      serial, parallel = workers.partition(tests)
+
   # run the tests
   utils.startTimer()
   utils.stamped_msg(title, "Started")
-  for test in tests:
-    testname = test['name']
-    test['browser_log'] = browser_config['browser_log']
-    utils.stamped_msg("Running test " + testname, "Started")
+  completed = {} # test results by the index of the test, added in order at the end
+  try:
+    for index in serial:
+      test = tests[index]
+      testname = test['name']
+      test['browser_log'] = browser_config['browser_log']
+      utils.stamped_msg("Running test " + testname, "Started")
 
-    if os.path.exists('logcat.log'):
-        os.unlink('logcat.log')
+      if os.path.exists('logcat.log'):
+          os.unlink('logcat.log')
 
-    try:
       mytest = TTest(browser_config['remote'])
       if mytest:
-        talos_results.add(mytest.runTest(browser_config, test))
+        test_results = mytest.runTest(browser_config, test)
+        completed[index] = test_results
+        if incremental is not None:
+          incremental.add(test_results)
       else:
         utils.stamped_msg("Error found while running %s" % testname, "Error")
-    except talosRegression, tr:
-      utils.stamped_msg("Detected a regression for " + testname, "Stopped")
-      print_logcat()
-      if httpd:
-        httpd.stop()
-      # by returning 1, we report an orange to buildbot
-      # http://docs.buildbot.net/latest/developer/results.html
-      return 1
-    except (talosCrash, talosError):
-      # NOTE: if we get into this condition, talos has an internal problem and cannot continue
-      #       this will prevent future tests from running
-      utils.stamped_msg("Failed %s" % testname, "Stopped")
-      talosError_tb = sys.exc_info()
-      traceback.print_exception(*talosError_tb)
+
+      utils.stamped_msg("Completed test " + testname, "Stopped")
       print_logcat()
-      if httpd:
-        httpd.stop()
-      # indicate a failure to buildbot, turn the job red
-      return 2
 
-    utils.stamped_msg("Completed test " + testname, "Stopped")
+    if parallel:
+      testname = ', '.join([tests[index]['name'] for index in parallel])
+      utils.stamped_msg("Running tests %s on %d workers" % (testname, browser_config['workers']), "Started")
+      utils.info("Tests run concurrently compete for memory bandwidth, GPU, disk and caches: "
+                 "their numbers are not comparable with those of tests run one at a time")
+      for index, test_results in workers.run(tests, parallel, browser_config, browser_config['workers']):
+        completed[index] = test_results
+        if incremental is not None:
+          incremental.add(test_results)
+      utils.stamped_msg("Completed tests %s on workers" % testname, "Stopped")
+  except talosRegression, tr:
+    utils.stamped_msg("Detected a regression for " + testname, "Stopped")
+    print_logcat()
+    if httpd:
+      httpd.stop()
+    finish_output(incremental, spool, browser_config)
+    # by returning 1, we report an orange to buildbot
+    # http://docs.buildbot.net/latest/developer/results.html
+    return 1
+  except (talosCrash, talosError):
+    # NOTE: if we get into this condition, talos has an internal problem and cannot continue
+    #       this will prevent future tests from running
+    utils.stamped_msg("Failed %s" % testname, "Stopped")
+    talosError_tb = sys.exc_info()
+    traceback.print_exception(*talosError_tb)
     print_logcat()
+    if httpd:
+      httpd.stop()
+    finish_output(incremental, spool, browser_config)
+    # indicate a failure to buildbot, turn the job red
+    return 2
+
+  for index in sorted(completed):
+    talos_results.add(completed[index])
 
   elapsed = utils.stopTimer()
   print "cycle time: " + elapsed
@@ -362,7 +413,8 @@ def run_tests(configurator):
 
   # output results
   if results_urls:
-    talos_results.output(results_urls, **results_options)
+    talos_results.output(results_urls, spool=spool, spool_timeout=browser_config.get('spool_timeout'),
+                         incremental=incremental, **results_options)
 
   # we will stop running tests on a failed test, or we will return 0 for green
   return 0
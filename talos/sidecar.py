@@ -0,0 +1,154 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+compact binary sidecar files of parsed browser logs, keyed by a hash of
+the log's contents, so that reanalysis of archived logs can load each
+cycle rather than parse it again; see BrowserLogResults
+"""
+
+import array
+import hashlib
+import os
+import struct
+import sys
+import utils
+
+__all__ = ['digest', 'memo', 'cached_digest', 'path', 'Packer', 'Unpacker']
+
+MAGIC = 'TALOSLOG'
+VERSION = 2 # increment when the contents change
+suffix = '.talos'
+
+def digest(filename, blocksize=1024*1024):
+    """md5 hex digest of the contents of a file"""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def memo(cache_dir, filename):
+    """file in cache_dir remembering the digest of a file, by its path, size and modification time"""
+    stat = os.stat(filename)
+    key = '%s\0%d\0%d\0%r' % (os.path.abspath(filename), stat.st_ino, stat.st_size, stat.st_mtime)
+    return os.path.join(cache_dir, hashlib.md5(key).hexdigest() + '.digest')
+
+def cached_digest(cache_dir, filename, memo_path=None):
+    """
+    digest of a file, remembered in cache_dir by its path, size and
+    modification time, so that an unchanged file is not read again to hash it
+    - memo_path : the file remembering it, if already known
+    """
+    memo_path = memo_path or memo(cache_dir, filename)
+    try:
+        value = file(memo_path).read()
+        if len(value) == 32: # not truncated
+            return value
+    except IOError:
+        pass # not remembered, or evicted meanwhile
+    value = digest(filename)
+    utils.write_atomic(memo_path, value)
+    return value
+
+def path(cache_dir, filename):
+    """path of the sidecar of a log in cache_dir"""
+    return os.path.join(cache_dir, cached_digest(cache_dir, filename) + suffix)
+
+
+class Packer(object):
+    """packs values, little-endian, for Unpacker to read back in the same order"""
+
+    def __init__(self):
+        self.parts = [MAGIC, struct.pack('<I', VERSION)]
+
+    def int(self, value):
+        self.parts.append(struct.pack('<q', value))
+
+    def string(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        self.parts.append(struct.pack('<I', len(value)))
+        self.parts.append(value)
+
+    def strings(self, values):
+        """pack the lengths of the strings, then the strings"""
+        values = [isinstance(value, unicode) and value.encode('utf-8') or value
+                  for value in values]
+        self.ints([len(value) for value in values])
+        self.parts.extend(values)
+
+    def ints(self, values):
+        self.int(len(values))
+        self.parts.append(struct.pack('<%dq' % len(values), *values))
+
+    def doubles(self, values):
+        """pack an array('d')"""
+        if sys.byteorder == 'big':
+            values = array.array('d', values)
+            values.byteswap()
+        self.int(len(values))
+        self.parts.append(values.tostring())
+
+    def save(self, filename):
+        """write the packed values to a file, atomically"""
+        utils.write_atomic(filename, ''.join(self.parts))
+
+
+class Unpacker(object):
+    """reads back the values packed by Packer"""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.data = f.read()
+        self.offset = 0
+        if self.read(len(MAGIC)) != MAGIC or self.unpack('<I')[0] != VERSION:
+            raise ValueError("Not a talos sidecar of version %d: %s" % (VERSION, filename))
+
+    def read(self, size):
+        if self.offset + size > len(self.data):
+            raise ValueError("Truncated talos sidecar")
+        value = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return value
+
+    def unpack(self, format):
+        return struct.unpack(format, self.read(struct.calcsize(format)))
+
+    def int(self):
+        return self.unpack('<q')[0]
+
+    def count(self, size):
+        """the number of values of a size in bytes that follow, checked against the bytes left"""
+        count = self.int()
+        if count < 0 or count * size > len(self.data) - self.offset:
+            raise ValueError("Corrupt talos sidecar: %d values of %d bytes at offset %d" % (count, size, self.offset))
+        return count
+
+    def string(self):
+        return self.read(self.unpack('<I')[0])
+
+    def strings(self):
+        lengths = self.ints()
+        if min(lengths or [0]) < 0:
+            raise ValueError("Corrupt talos sidecar: negative string length")
+        data = self.read(sum(lengths))
+        values = []
+        offset = 0
+        for length in lengths:
+            values.append(data[offset:offset + length])
+            offset += length
+        return values
+
+    def ints(self):
+        count = self.count(8)
+        return list(self.unpack('<%dq' % count))
+
+    def doubles(self):
+        """unpack an array('d')"""
+        values = array.array('d')
+        values.fromstring(self.read(8 * self.count(8)))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
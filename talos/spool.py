@@ -0,0 +1,172 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+spool of results to send to graphserver and datazilla: each payload is
+written to a file of its own before it is sent, and only removed once it
+has been, so results survive the servers being unreachable and can be
+sent later with `talos-spool drain`
+"""
+
+import optparse
+import os
+import output
+import sys
+import threading
+import time
+import utils
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+__all__ = ['Spool', 'Sender', 'main']
+
+class Spool(object):
+    """a directory of payloads not yet sent, one file each, sent in the order added"""
+
+    suffix = '.json'
+    claimed = '.sending' # suffix of payloads being sent
+    stale = 3600 # seconds after which a claimed payload is taken to be abandoned
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.added = [] # payloads added by this instance
+        self.count = 0
+
+    def add(self, format, url, results, options=None):
+        """
+        write a payload to the spool; returns its path
+        - format : key of the output class in output.formats
+        - url : http:// or https:// URL to send the results to
+        - results : results as returned by the output class
+        - options : options to the output class
+        """
+        entry = {'format': format,
+                 'url': url,
+                 'options': options or {},
+                 'results': output.formats[format].dumps(results)}
+        self.count += 1
+        name = '%017.6f-%d-%d%s' % (time.time(), os.getpid(), self.count, self.suffix)
+        path = os.path.join(self.directory, name)
+        utils.write_atomic(path, json.dumps(entry))
+        self.added.append(path)
+        return path
+
+    def entries(self):
+        """paths of the payloads not yet sent, in the order added"""
+        now = time.time()
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith(self.suffix):
+                entries.append(path)
+            elif name.endswith(self.claimed):
+                try:
+                    if now - os.path.getmtime(path) > self.stale:
+                        # the sender went away while sending
+                        entries.append(path[:-len(self.claimed)])
+                        os.rename(path, entries[-1])
+                except OSError:
+                    pass # sent or reclaimed meanwhile
+        return entries
+
+    def claim(self, path):
+        """take a payload to send it, so that no other sender does; returns the claimed path or None"""
+        claimed = path + self.claimed
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None # sent or claimed by another sender
+        os.utime(claimed, None)
+        return claimed
+
+    def send(self, path, tbpl_output):
+        """
+        send a payload and remove it from the spool;
+        returns whether it was sent; if not it is left in the spool
+        """
+        claimed = self.claim(path)
+        if claimed is None:
+            return False
+        try:
+            entry = json.loads(file(claimed).read())
+            cls = output.formats[entry['format']]
+            _output = cls(None, **dict([(str(key), value) for key, value in entry['options'].items()]))
+            _output.strict = True # what the server fails stays in the spool
+            _output.output(cls.loads(entry['results']), entry['url'], tbpl_output)
+        except Exception, e:
+            utils.info("Failed to send %s: %s", path, e)
+            os.rename(claimed, path)
+            return False
+        os.remove(claimed)
+        return True
+
+    def drain(self, tbpl_output=None):
+        """send all payloads in the spool; returns the number left"""
+        if tbpl_output is None:
+            tbpl_output = {}
+        return len([path for path in self.entries()
+                    if not self.send(path, tbpl_output)])
+
+    def sender(self):
+        """a Sender thread for this spool"""
+        return Sender(self)
+
+
+class Sender(threading.Thread):
+    """
+    sends the payloads of a spool in the background: first those added by
+    this process, collecting their TBPL output, then any left by earlier runs
+    """
+
+    def __init__(self, spool):
+        threading.Thread.__init__(self)
+        self.daemon = True # what is not sent when talos exits stays in the spool
+        self.spool = spool
+        self.lock = threading.Lock()
+        self._tbpl_output = {}
+        self.left = None
+
+    def run(self):
+        left = 0
+        for path in self.spool.added:
+            tbpl_output = {}
+            if os.path.exists(path) and not self.spool.send(path, tbpl_output):
+                left += 1
+            with self.lock:
+                for key, value in tbpl_output.items():
+                    self._tbpl_output.setdefault(key, {}).update(value)
+        self.left = left + self.spool.drain()
+
+    def tbpl_output(self):
+        """TBPL output of the payloads sent so far"""
+        with self.lock:
+            return dict([(key, value.copy()) for key, value in self._tbpl_output.items()])
+
+
+def main(args=sys.argv[1:]):
+    usage = '%prog drain spool_dir'
+    parser = optparse.OptionParser(usage=usage, description=__doc__)
+    options, args = parser.parse_args(args)
+    if len(args) != 2 or args[0] != 'drain':
+        parser.error("Please specify the drain command and the spool directory")
+    command, directory = args
+    if not os.path.isdir(directory):
+        parser.error("Not a directory: %s" % directory)
+    utils.startLogger('info')
+
+    spool = Spool(directory)
+    tbpl_output = {}
+    left = spool.drain(tbpl_output)
+    print "TinderboxPrint: TalosResult: %s" % json.dumps(tbpl_output)
+    if left:
+        print "%d results could not be sent and are left in %s" % (left, spool.directory)
+    sys.exit(bool(left))
+
+if __name__ == '__main__':
+    main()
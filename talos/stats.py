@@ -0,0 +1,145 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+constant-memory accumulators for streams of run data;
+these summarize results as they arrive, cycle by cycle, where the
+functions in filter.py need the whole series at once
+"""
+
+import copy
+import math
+
+__all__ = ['RunningGeometricMean', 'RunningDromaeo', 'RunningStats']
+
+class RunningGeometricMean(object):
+    """geometric mean accumulated as a sum of logarithms"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.defined = True # the geometric mean is undefined for values <= 0
+
+    def add(self, value):
+        self.count += 1
+        if value > 0:
+            self.total += math.log(value)
+        else:
+            self.defined = False
+
+    def value(self):
+        """geometric mean, or None if there is nothing to summarize"""
+        if not (self.count and self.defined):
+            return None
+        return math.exp(self.total / self.count)
+
+
+class RunningDromaeo(object):
+    """
+    streaming equivalent of filter.dromaeo:
+    the geometric mean of the means of consecutive chunks of values;
+    chunks end with each cycle, as filter.dromaeo chunks each cycle's series
+    """
+
+    chunksize = 5 # see filter.dromaeo
+
+    def __init__(self):
+        self.chunk_total = 0.
+        self.chunk_count = 0
+        self.means = RunningGeometricMean()
+
+    def add(self, value):
+        self.chunk_total += value
+        self.chunk_count += 1
+        if self.chunk_count == self.chunksize:
+            self.means.add(self.chunk_total / self.chunk_count)
+            self.chunk_total = 0.
+            self.chunk_count = 0
+
+    def end_cycle(self):
+        """end the chunk, partial or not, as dromaeo_chunks does at the end of a series"""
+        if self.chunk_count:
+            self.means.add(self.chunk_total / self.chunk_count)
+            self.chunk_total = 0.
+            self.chunk_count = 0
+
+    def value(self):
+        """dromaeo score, counting any partial chunk as dromaeo_chunks does"""
+        if not self.chunk_count:
+            return self.means.value()
+        means = copy.copy(self.means)
+        means.add(self.chunk_total / self.chunk_count)
+        return means.value()
+
+
+class RunningStats(object):
+    """
+    count, mean and variance (Welford's algorithm), min, max,
+    geometric mean and dromaeo score of a stream of values
+    http://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Online_algorithm
+    """
+
+    def __init__(self, values=()):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._mean = 0.
+        self._m2 = 0. # sum of squares of differences from the mean
+        self.geometric = RunningGeometricMean()
+        self.dromaeo_score = RunningDromaeo()
+        self.extend(values)
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.geometric.add(value)
+        self.dromaeo_score.add(value)
+
+    def extend(self, values):
+        for value in values:
+            self.add(value)
+
+    def end_cycle(self):
+        """mark the end of the values of a cycle"""
+        self.dromaeo_score.end_cycle()
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self._mean
+
+    def variance(self):
+        """population variance, as filter.variance"""
+        if not self.count:
+            return None
+        return self._m2 / self.count
+
+    def stddev(self):
+        if not self.count:
+            return None
+        return self.variance()**0.5
+
+    def geometric_mean(self):
+        return self.geometric.value()
+
+    def dromaeo(self):
+        return self.dromaeo_score.value()
+
+    def summary(self):
+        """dictionary of all of the statistics"""
+        return dict(count=self.count,
+                    mean=self.mean(),
+                    variance=self.variance(),
+                    stddev=self.stddev(),
+                    min=self.min,
+                    max=self.max,
+                    geometric_mean=self.geometric_mean(),
+                    dromaeo=self.dromaeo())
@@ -3,7 +3,7 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 from mozprocess import ProcessHandler
-from threading import Thread
+from threading import Event, Thread
 import os
 import time
 
@@ -18,11 +18,19 @@ class talosProcess(ProcessHandler):
                        env=None,
                        ignore_children=False,
                        logfile=None,
+                       log_stream=None,
                        **kwargs):
+        """
+        - logfile : file to write the output to
+        - log_stream : results.BrowserLogStream to feed the output to as it is written
+        """
 
         self.firstTime = int(time.time()) * 1000
         self.logfile = logfile
+        self.log_stream = log_stream
         self.results_file = None
+        self.quitThread = None # waits for the browser to quit once the test is done
+        self.logClosed = Event()
         if env is None:
             env = os.environ.copy()
 
@@ -30,6 +38,9 @@ class talosProcess(ProcessHandler):
                                 ignore_children=ignore_children, logfile=self.logfile, **kwargs)
 
     def logToFile(self, msg):
+        if self.log_stream is not None:
+            self.log_stream.feed(msg)
+
         if not self.logfile:
             return
 
@@ -41,21 +52,45 @@ class talosProcess(ProcessHandler):
     def closeLogFile(self):
         if self.results_file:
             self.results_file.close()
+        self.logClosed.set()
 
-    def waitForQuit(self, timeout=5):
-        for i in range(1, timeout):
+    def waitForQuit(self, timeout=4, interval=0.05):
+        """
+        wait for the browser to quit, for up to timeout seconds, then kill it; either
+        way, mark its termination and close the log. The browser is checked for every
+        interval seconds, so its termination is marked within that of it quitting
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
             if self.proc.returncode != None:
                 self.logToFile("__startBeforeLaunchTimestamp%d__endBeforeLaunchTimestamp\n" % self.firstTime)
                 self.logToFile("__startAfterTerminationTimestamp%d__endAfterTerminationTimestamp\n" % (int(time.time()) * 1000))
                 self.closeLogFile()
                 return
-            time.sleep(1)
+            time.sleep(interval)
 
         self.proc.kill()
         self.logToFile("__startBeforeLaunchTimestamp%d__endBeforeLaunchTimestamp\n" % self.firstTime)
         self.logToFile("__startAfterTerminationTimestamp%d__endAfterTerminationTimestamp\n" % (int(time.time()) * 1000))
         self.closeLogFile()
 
+    def waitForReady(self, processes_left=None, timeout=5, interval=0.05):
+        """
+        once wait() returns, wait until the log is complete and closed and,
+        if given, processes_left() returns no processes, for up to timeout seconds
+        more than waitForQuit may take; returns whether it was all so
+        """
+        if self.quitThread is not None:
+            self.quitThread.join(timeout + 1)
+        else:
+            self.closeLogFile() # the browser quit without ending the test
+        deadline = time.time() + timeout
+        while processes_left is not None and processes_left():
+            if time.time() >= deadline:
+                return False
+            time.sleep(interval)
+        return self.logClosed.is_set()
+
     def onTimeout(self):
         """
         When we timeout, dictate this in the log file.
@@ -72,9 +107,9 @@ class talosProcess(ProcessHandler):
         Search for signs of error
         """
         if line.find('__endTimestamp') != -1:
-            thread = Thread(target=self.waitForQuit)
-            thread.setDaemon(True) # don't hang on quit
-            thread.start()
+            self.quitThread = Thread(target=self.waitForQuit)
+            self.quitThread.setDaemon(True) # don't hang on quit
+            self.quitThread.start()
         print line
         self.logToFile(line + "\n")
 
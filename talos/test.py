@@ -8,6 +8,7 @@ class Test(object):
     keys = []
     desktop = True
     mobile = True
+    parallel_safe = False # run concurrently with other tests on workers; set by --parallelTests, never by default
 
     @classmethod
     def name(cls):
@@ -57,8 +58,9 @@ class Test(object):
 
 class TsBase(Test):
     """abstract base class for ts-style tests"""
-    keys = ['url', 'url_timestamp', 'timeout', 'cycles', 'shutdown', 'profile_path', 'xperf_counters',
-            'xperf_providers', 'xperf_user_providers', 'xperf_stackwalk', 'tpmozafterpaint', 'setup', 'cleanup']
+    keys = ['url', 'url_timestamp', 'timeout', 'cycles', 'shutdown', 'turnaround', 'profile_path', 'xperf_counters',
+            'xperf_providers', 'xperf_user_providers', 'xperf_stackwalk', 'tpmozafterpaint', 'setup', 'cleanup',
+            'parallel_safe']
 
 class ts(TsBase):
     """
@@ -201,9 +203,9 @@ class PageloaderTest(Test):
     keys = ['tpmanifest', 'tpcycles', 'tppagecycles', 'tprender', 'tpchrome', 'tpmozafterpaint', 'tploadaboutblank',
             'rss', 'resolution', 'cycles',
             'win_counters', 'w7_counters', 'linux_counters', 'mac_counters', 'remote_counters', 'xperf_counters',
-            'timeout', 'shutdown', 'responsiveness', 'profile_path',
+            'timeout', 'shutdown', 'responsiveness', 'cc_time', 'turnaround', 'profile_path',
             'xperf_providers', 'xperf_user_providers', 'xperf_stackwalk', 'filters', 'preferences', 'extensions',
-            'setup', 'cleanup'
+            'setup', 'cleanup', 'parallel_safe'
             ]
 
 class tart(PageloaderTest):
@@ -39,6 +39,7 @@ from ffprocess_linux import LinuxProcess
 from ffprocess_win32 import Win32Process
 from ffprocess_mac import MacProcess
 from ffsetup import FFSetup
+from profilecache import ProfileCache
 import talosProcess
 
 class TTest(object):
@@ -46,6 +47,7 @@ class TTest(object):
     _ffsetup = None
     _ffprocess = None
     platform_type = ''
+    snapshot_info = ['browser_name', 'browser_version', 'buildid'] # browser_config set by initialization
 
     def __init__(self, remote = False):
         cmanager, platformtype, ffprocess = self.getPlatformType(remote)
@@ -100,22 +102,48 @@ class TTest(object):
             self._ffsetup.initializeRemoteDevice(browser_config, ffprocess)
             self._hostproc = ffprocess
 
-    def createProfile(self, profile_path, preferences, extensions, webserver):
+    def createProfile(self, profile_path, preferences, extensions, webserver, profile_cache=None):
         # Create the new profile
         temp_dir, profile_dir = self._ffsetup.CreateTempProfileDir(profile_path,
                                                      preferences,
                                                      extensions,
-                                                     webserver)
+                                                     webserver,
+                                                     profile_cache=profile_cache)
         utils.debug("created profile")
         return profile_dir, temp_dir
 
-    def initializeProfile(self, profile_dir, browser_config):
+    def initializeProfile(self, profile_dir, browser_config, profile_cache=None):
+        """
+        launch the browser once with the new profile; with a profile cache, the
+        initialized profile is snapshotted, and a snapshot of it by the same build
+        is restored instead of launching the browser
+        """
+        snapshot_key = None
+        if profile_cache is not None and self._ffsetup.profile_key and not browser_config['remote']:
+            snapshot_key = profile_cache.snapshot_key(self._ffsetup.profile_key,
+                                                      browser_config['buildid'],
+                                                      browser_config['browser_path'],
+                                                      browser_config['init_url'],
+                                                      browser_config['extra_args'])
+            info = profile_cache.restore(snapshot_key, profile_dir)
+            if info is not None:
+                # as the initialization would have read them from the browser
+                for key in self.snapshot_info:
+                    if info.get(key) is not None:
+                        browser_config[key] = str(info[key])
+                utils.info("Restored initialized profile %s", snapshot_key)
+                return
+
         if not self._ffsetup.InitializeNewProfile(profile_dir, browser_config):
             raise talosError("failed to initialize browser")
         processes = self._ffprocess.checkAllProcesses(browser_config['process'], browser_config['child_process'])
         if processes:
             raise talosError("browser failed to close after being initialized")
 
+        if snapshot_key is not None:
+            profile_cache.add(snapshot_key, profile_dir, self._ffsetup.extensions,
+                              **dict([(key, browser_config.get(key)) for key in self.snapshot_info]))
+
     def cleanupProfile(self, dir):
         # Delete the temp profile directory  Make it writeable first,
         # because every once in a while browser seems to drop a read-only
@@ -223,10 +251,12 @@ class TTest(object):
                 shutil.move(browser_config['results_log'], browser_config['browser_log'])
 
             if os.path.isfile(browser_config['browser_log']):
+                # log the browser output a block of lines at a time,
+                # rather than reading all of it into memory
                 results_file = open(browser_config['browser_log'], "r")
-                results_raw = results_file.read()
+                for lines in iter(lambda: results_file.readlines(1024 * 1024), []):
+                    utils.info(''.join(lines))
                 results_file.close()
-                utils.info(results_raw)
 
             if profile_dir:
                 try:
@@ -266,6 +296,8 @@ class TTest(object):
 
         """
         self.initializeLibraries(browser_config)
+        if browser_config.get('isolated'):
+            self._ffprocess.isolate() # on a worker; see workers.py
 
         utils.debug("operating with platform_type : %s", self.platform_type)
         self.counters = test_config.get(self.platform_type + 'counters', [])
@@ -308,11 +340,16 @@ class TTest(object):
             if 'extensions' in test_config and test_config['extensions']:
                 extensions.append(test_config['extensions'])
 
+            profile_cache = None
+            if browser_config.get('profile_cache_dir'):
+                profile_cache = ProfileCache(browser_config['profile_cache_dir'],
+                                             browser_config['profile_cache_size'] * 1024 * 1024)
             profile_dir, temp_dir = self.createProfile(test_config['profile_path'], 
                                                        preferences, 
                                                        extensions, 
-                                                       browser_config['webserver'])
-            self.initializeProfile(profile_dir, browser_config)
+                                                       browser_config['webserver'],
+                                                       profile_cache=profile_cache)
+            self.initializeProfile(profile_dir, browser_config, profile_cache=profile_cache)
             test_config['url'] = utils.interpolatePath(test_config['url'], profile_dir=profile_dir, firefox_path=browser_config['browser_path'])
 
             if browser_config['fennecIDs']:
@@ -322,7 +359,7 @@ class TTest(object):
             utils.debug("initialized %s", browser_config['process'])
 
             # setup global (cross-cycle) counters:
-            # shutdown, responsiveness
+            # shutdown, responsiveness, cc_time, turnaround
             global_counters = {}
             if browser_config.get('xperf_path'):
                 for c in test_config.get('xperf_counters', []):
@@ -330,6 +367,10 @@ class TTest(object):
 
             if test_config['shutdown']:
                 global_counters['shutdown'] = []
+            if test_config.get('cc_time'):
+                global_counters['cc_time'] = []
+            if test_config.get('turnaround'):
+                global_counters['turnaround'] = []
             if test_config.get('responsiveness') and platform.system() != "Linux":
                 # ignore responsiveness tests on linux until we fix Bug 710296
                utils.setEnvironmentVars({'MOZ_INSTRUMENT_EVENT_LOOP': '1'})
@@ -367,6 +408,7 @@ class TTest(object):
                                                                 test_config['url'])
 
                 self.counter_results = None
+                browser_log = None # the browser output, parsed as it is written
                 if not browser_config['remote']:
                     if test_config['setup']:
                         # Generate bcontroller.yml for xperf
@@ -376,7 +418,9 @@ class TTest(object):
                         setup.wait()
 
                     self.isFinished = False
-                    browser = talosProcess.talosProcess(command_args, env=os.environ.copy(), logfile=browser_config['browser_log'])
+                    browser_log = results.BrowserLogStream(browser_config['browser_log'])
+                    browser = talosProcess.talosProcess(command_args, env=os.environ.copy(), logfile=browser_config['browser_log'],
+                                                        log_stream=browser_log)
                     browser.run(timeout=timeout)
                     self.pid = browser.pid
 
@@ -389,7 +433,7 @@ class TTest(object):
 
                     # todo: ctrl+c doesn't close the browser windows
                     browser.wait()
-                    browser = None
+                    quit_time = time.time()
                     self.isFinished = True
  
                     if test_config['cleanup']:
@@ -399,14 +443,20 @@ class TTest(object):
                         cleanup.run()
                         cleanup.wait()
 
-                    # allow mozprocess to terminate fully.  It appears our log file is partial unless we wait
-                    time.sleep(5)
+                    # the log is partial until mozprocess has terminated fully: wait
+                    # for it to be closed and for the browser's processes to be gone
+                    if not browser.waitForReady(lambda: self._ffprocess.checkAllProcesses(browser_config['process'],
+                                                                                          browser_config['child_process'])):
+                        utils.info("browser processes or log still open after cycle %d", i)
+                    browser = None
                 else:
                     self._ffprocess.runProgram(browser_config, command_args, timeout=timeout)
+                    quit_time = None
 
                 # check if we found results from our webserver
                 if os.path.isfile(browser_config['results_log']):
                     shutil.move(browser_config['results_log'], browser_config['browser_log'])
+                    browser_log = None # parse those instead of the browser output
 
                 # ensure the browser log exists
                 browser_log_filename = browser_config['browser_log']
@@ -417,14 +467,22 @@ class TTest(object):
                 if os.path.exists(browser_config['error_filename']):
                     raise talosRegression("Talos has found a regression, if you have questions ask for help in irc on #perf")
 
-                # add the results from the browser output
-                test_results.add(browser_log_filename, counter_results=self.counter_results)
+                # add the results from the browser output;
+                # the log file is only read if it wasn't parsed as it was written
+                test_results.add(browser_log or browser_log_filename, counter_results=self.counter_results)
 
                 #clean up any stray browser processes
                 self.cleanupAndCheckForCrashes(browser_config, profile_dir, test_config['name'])
                 #clean up the bcontroller process
                 timer = 0
 
+                # time from the browser quitting to being ready for the next cycle
+                if quit_time is not None:
+                    turnaround = int((time.time() - quit_time) * 1000)
+                    utils.info("Cycle %d turnaround: %d ms", i, turnaround)
+                    if 'turnaround' in global_counters:
+                        global_counters['turnaround'].append(turnaround)
+
             # cleanup
             self.cleanupProfile(temp_dir)
             utils.restoreEnvironmentVars()
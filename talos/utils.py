@@ -4,16 +4,20 @@
 
 """Utility functions for Talos"""
 
+import gzip
+import mmap
 import os
 import shlex
 import subprocess
 import sys
+import tempfile
 import time
 import urlparse
 import yaml
 import string
 import mozlog
 from mozlog import debug,info
+from StringIO import StringIO
 import platform
 from mozprocess import pid as mozpid
 
@@ -34,6 +38,10 @@ def stopTimer():
   stop_time = time.time()
   return time.strftime("%H:%M:%S", time.gmtime(stop_time-START_TIME))
 
+def debug_enabled():
+  """whether debug messages are logged, so that costly ones are only built then"""
+  return mozlog.getSysLogger().isEnabledFor(mozlog.DEBUG)
+
 def startLogger(levelChoice):
   #declare and define global logger object to send logging messages to
   mozlog.basicConfig(format = '%(levelname)s : %(message)s', level = log_levels[levelChoice])
@@ -155,10 +163,15 @@ def tokenize(string, start, end):
   tokenize a string by start + end tokens,
   returns parts and position of last token
   """
+  return match_tokens(string, start, end, findall(string, start), findall(string, end))
+
+def match_tokens(string, start, end, _start, _end):
+  """
+  pair the positions of start + end tokens in a string, as from findall;
+  returns parts and position of last token
+  """
   assert end not in start, "End token '%s' is contained in start token '%s'" % (end, start)
   assert start not in end, "Start token '%s' is contained in end token '%s'" % (start, end)
-  _start = findall(string, start)
-  _end = findall(string, end)
   if not _start and not _end:
       return [], -1
   assert len(_start), "Could not find start token: '%s'" % start
@@ -171,6 +184,118 @@ def tokenize(string, start, end):
     parts.append(string[_start[i] + len(start):_end[i]])
   return parts, _end[-1]
 
+class MappedFile(object):
+  """
+  read-only view of a file, memory mapped a part at a time so that
+  memory use doesn't grow with the size of the file;
+  slices are read into strings and utils.scan searches it window by window
+  """
+
+  window = 16 * 1024 * 1024 # a multiple of mmap.ALLOCATIONGRANULARITY
+  overlap = 64 * 1024 # between windows: the longest match utils.scan can find
+
+  def __init__(self, filename):
+    self.file = open(filename, 'rb')
+    self.size = os.fstat(self.file.fileno()).st_size
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.file.close()
+
+  def __len__(self):
+    return self.size
+
+  def map(self, start, end):
+    """map the file from start to end; returns the map and the offset of start in it"""
+    offset = start - start % mmap.ALLOCATIONGRANULARITY
+    return mmap.mmap(self.file.fileno(), end - offset, access=mmap.ACCESS_READ, offset=offset), start - offset
+
+  def __getitem__(self, index):
+    start, stop, step = index.indices(self.size)
+    assert step == 1, "MappedFile only supports contiguous slices"
+    if stop <= start:
+      return ''
+    region, offset = self.map(start, stop)
+    try:
+      return region[offset:offset + stop - start]
+    finally:
+      region.close()
+
+  def windows(self):
+    """
+    yields (position, window, end) for overlapping maps of the file:
+    the window maps the file from position, and matches starting
+    before end in it belong to this window rather than the next
+    """
+    position = 0
+    while position < self.size:
+      stop = min(position + self.window + self.overlap, self.size)
+      window, offset = self.map(position, stop)
+      try:
+        if stop == self.size:
+          yield position, window, len(window)
+          return
+        yield position, window, self.window
+      finally:
+        window.close()
+      position += self.window
+
+def scan(string, *handlers):
+  """
+  call handler(position, match) for each non-overlapping match of its
+  regular expression in a string or MappedFile, in order of position;
+  handlers are (regex, handler) pairs. Matches in a MappedFile are only
+  valid during the call and may be no longer than MappedFile.overlap
+  """
+  if isinstance(string, basestring):
+    windows = [(0, string, len(string))]
+  else:
+    windows = string.windows()
+  resume = [0] * len(handlers) # where to continue the search for each regex
+  for position, window, end in windows:
+    for index, (regex, handler) in enumerate(handlers):
+      for match in regex.finditer(window, max(resume[index] - position, 0)):
+        if match.start() >= end:
+          break
+        handler(position + match.start(), match)
+        resume[index] = position + match.end()
+
+def write_atomic(filename, contents):
+  """
+  write contents to a file so that readers never see it partially written:
+  they go to a temporary file in the same directory, renamed over the file
+  """
+  fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                              prefix='.%s.' % os.path.basename(filename))
+  try:
+    f = os.fdopen(fd, 'wb')
+    try:
+      f.write(contents)
+      f.flush()
+      os.fsync(f.fileno())
+    finally:
+      f.close()
+    if os.name == 'nt' and os.path.exists(filename):
+      os.remove(filename) # os.rename does not replace files on windows
+    os.rename(temp, filename)
+  except:
+    if os.path.exists(temp):
+      os.remove(temp)
+    raise
+
+def gzip_string(contents, compresslevel=6):
+  """contents compressed in the gzip format, as for Content-Encoding: gzip"""
+  buffer = StringIO()
+  f = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=compresslevel, mtime=0)
+  f.write(contents)
+  f.close()
+  return buffer.getvalue()
+
 # methods for introspecting network availability
 # Used for the --develop option where we dynamically create a webserver
 
@@ -0,0 +1,248 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+workers running the tests marked parallel-safe, with --parallelTests,
+concurrently, for throughput; the tests compete for memory bandwidth, GPU,
+disk and caches, so their numbers are not comparable with those of tests run
+one at a time. Each worker is a process in a session of its own, so that it
+only sees and cleans up its own browsers, pinned to its own CPUs, with its
+own display, browser log and results log, running its share of the tests;
+see run_tests
+"""
+
+import copy
+import multiprocessing
+import os
+import Queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import time
+import traceback
+import utils
+
+__all__ = ['parallel', 'partition', 'cpu_sets', 'session_pids', 'Worker', 'run']
+
+def parallel(test):
+    """whether a test may run on a worker: marked parallel-safe, without counters, which are by process name"""
+    return bool(test.get('parallel_safe')) and not [key for key, value in test.items()
+                                                     if key.endswith('_counters') and value]
+
+def partition(tests):
+    """indices of the tests to run one at a time, and of those that may run on workers"""
+    serial = [index for index, test in enumerate(tests) if not parallel(test)]
+    return serial, [index for index, test in enumerate(tests) if parallel(test)]
+
+def cpu_sets(workers, cpus=None):
+    """the CPUs of each worker: the CPUs split evenly, or one each, shared, if there are fewer CPUs than workers"""
+    if cpus is None:
+        cpus = multiprocessing.cpu_count()
+    size = max(cpus // workers, 1)
+    return [[(index * size + cpu) % cpus for cpu in range(size)]
+            for index in range(workers)]
+
+def session_pids(session):
+    """pids of the processes of a session; browsers are in process groups of their own in it"""
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            if os.getsid(int(name)) == session:
+                pids.append(int(name))
+        except OSError:
+            pass # it has exited
+    return pids
+
+def run_test(browser_config, test_config):
+    """run a test, as run_tests does; returns its TestResults"""
+    from ttest import TTest
+    utils.stamped_msg("Running test " + test_config['name'], "Started")
+    test_results = TTest(False).runTest(browser_config, test_config)
+    utils.stamped_msg("Completed test " + test_config['name'], "Stopped")
+    return test_results
+
+
+class Worker(multiprocessing.Process):
+    """
+    runs its tests one after another, putting (worker, index, results, error) on a queue;
+    terminated, it stops the test it is running, cleaning up after it as a failed test
+    """
+
+    display_base = 90 # number of the first display tried for a worker's Xvfb
+    display_timeout = 10 # seconds for Xvfb to be ready
+    stop_timeout = 60 # seconds for a worker to finish its test once the rest are abandoned
+
+    def __init__(self, number, tests, browser_config, queue, stop, cpus=None, run_test=run_test):
+        """
+        - number : number of the worker
+        - tests : [(index, test_config)] to run
+        - queue : multiprocessing.Queue for the results of each test, then (number, None, None, None)
+        - stop : multiprocessing.Event set when the tests not yet started are abandoned
+        - cpus : CPUs to pin the worker to
+        - run_test : function of (browser_config, test_config) running a test
+        """
+        multiprocessing.Process.__init__(self, name='talos-worker-%d' % number)
+        self.number = number
+        self.tests = tests
+        self.browser_config = browser_config
+        self.queue = queue
+        self.stop = stop
+        self.cpus = cpus
+        self.run_test = run_test
+        self.directory = tempfile.mkdtemp(prefix='talos-worker-%d-' % number)
+
+    def run(self):
+        os.setsid() # the browsers started are those of this session
+        signal.signal(signal.SIGTERM, self.terminated)
+        self.pin()
+        xvfb = None
+        try:
+            xvfb, display = self.start_display()
+            browser_config = self.config(self.directory, display)
+            for index, test_config in self.tests:
+                if self.stop.is_set():
+                    break
+                try:
+                    self.queue.put((self.number, index, self.run_test(browser_config, copy.deepcopy(test_config)), None))
+                except Exception, e:
+                    self.queue.put((self.number, index, None, (e, traceback.format_exc())))
+                    break
+        finally:
+            self.cleanup(xvfb)
+            self.queue.put((self.number, None, None, None))
+
+    def terminated(self, signum, frame):
+        raise utils.talosError("worker %d terminated" % self.number)
+
+    def cleanup(self, xvfb=None):
+        """stop the worker's Xvfb and remove its logs"""
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def kill_session(self):
+        """kill what is left of the session of a worker that was terminated or died, and clean up after it"""
+        for pid in session_pids(self.pid):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass # it has exited
+        self.cleanup()
+
+    def pin(self):
+        """pin this process, and so the browsers it starts, to its CPUs"""
+        if not self.cpus:
+            return
+        try:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(['taskset', '-p', '-c', ','.join([str(cpu) for cpu in self.cpus]), str(os.getpid())],
+                                stdout=devnull)
+        except OSError, e:
+            utils.info("Could not pin worker %d to CPUs %s: %s", self.number, self.cpus, e)
+
+    def start_display(self):
+        """start a private Xvfb; returns (process, display), or (None, None) if there's no Xvfb"""
+        display = self.display_base + self.number
+        while os.path.exists('/tmp/.X%d-lock' % display):
+            display += 1 # taken
+        try:
+            with open(os.devnull, 'w') as devnull:
+                xvfb = subprocess.Popen(['Xvfb', ':%d' % display, '-nolisten', 'tcp', '-screen', '0', '1600x1200x24'],
+                                        stdout=devnull, stderr=devnull)
+        except OSError, e:
+            utils.info("Could not start Xvfb for worker %d, using the display of talos: %s", self.number, e)
+            return None, None
+
+        # ready once it listens on its socket
+        deadline = time.time() + self.display_timeout
+        while not os.path.exists('/tmp/.X11-unix/X%d' % display):
+            if xvfb.poll() is not None or time.time() > deadline:
+                if xvfb.poll() is None:
+                    xvfb.terminate()
+                xvfb.wait()
+                raise utils.talosError("Xvfb failed to start on display :%d for worker %d" % (display, self.number))
+            time.sleep(0.05)
+        return xvfb, ':%d' % display
+
+    def config(self, directory, display):
+        """browser_config of the worker, with its own logs and display"""
+        browser_config = copy.deepcopy(self.browser_config)
+        browser_config['browser_log'] = os.path.join(directory, 'browser_output.txt')
+        browser_config['results_log'] = os.path.join(directory, 'results_log.txt')
+        browser_config['error_filename'] = os.path.join(directory, 'browser_failures.txt')
+        browser_config['isolated'] = True
+        if 'talos.logfile' in browser_config['preferences']:
+            browser_config['preferences']['talos.logfile'] = browser_config['browser_log']
+        if display:
+            browser_config['env'] = dict(browser_config['env'], DISPLAY=display)
+        return browser_config
+
+
+def run(tests, indices, browser_config, workers, run_test=run_test):
+    """
+    run tests on workers; yields (index, TestResults) in the order of the indices.
+    The first test to fail, in that order, is raised once those before it are yielded;
+    the tests not yet started are then abandoned.
+    - tests : list of test configs
+    - indices : indices of the tests to run
+    - workers : number of workers
+    """
+
+    workers = min(workers, len(indices))
+    queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    processes = [Worker(number, [(index, tests[index]) for index in indices[number::workers]],
+                        browser_config, queue, stop, cpus=cpus, run_test=run_test)
+                 for number, cpus in enumerate(cpu_sets(workers))]
+    for process in processes:
+        process.start()
+
+    pending = sorted(indices)
+    results = {}
+    failures = {}
+    done = set()
+    try:
+        while pending:
+            if pending[0] in results:
+                index = pending.pop(0)
+                yield index, results.pop(index)
+                continue
+            if pending[0] in failures or len(done) == len(processes):
+                failed = [index for index in pending if index in failures]
+                if not failed:
+                    raise utils.talosError("workers exited without running tests: %s"
+                                           % ', '.join([tests[index]['name'] for index in pending]))
+                error, tb = failures[failed[0]]
+                print "Failed %s on a worker:\n%s" % (tests[failed[0]]['name'], tb)
+                raise error
+
+            try:
+                number, index, test_results, failure = queue.get(timeout=1)
+            except Queue.Empty:
+                # workers that died without saying so are done
+                done.update([process.number for process in processes
+                             if not process.is_alive()])
+                continue
+            if index is None:
+                done.add(number)
+            elif failure is not None:
+                failures[index] = failure
+                stop.set()
+            else:
+                results[index] = test_results
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(process.stop_timeout)
+            terminated = process.is_alive()
+            if terminated:
+                process.terminate()
+                process.join(process.stop_timeout)
+            if terminated or process.exitcode != 0:
+                process.kill_session()
+                process.join()
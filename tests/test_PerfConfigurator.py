@@ -11,6 +11,8 @@ Classes:
         Methods:
         - test_cli
         Tests PerfConfigurator command line interface.
+        - test_parallel_tests
+        Tests that tests run concurrently only if asked.
         - test_errors
         Tests if errors and exceptions are correctly raised.
         - assertError
@@ -76,6 +78,17 @@ class PerfConfiguratorUnitTest(unittest.TestCase):
         # cleanup
         os.remove(outfile)
     
+    def test_parallel_tests(self):
+        """tests run concurrently on workers only if asked"""
+        outfile = tempfile.mktemp(suffix='.yaml')
+        for args, parallel in (([], [False, False]),
+                               (['--parallelTests', 'tresize', '--workers', '2'], [False, True])):
+            example = PerfConfigurator()
+            example.parse_args(['--activeTests', 'ts:tresize', '--develop', '-e', ffox_path, '-o', outfile] + args)
+            self.assertEqual([test['parallel_safe'] for test in example.config['tests']], parallel)
+        self.assertEqual(example.browser_config()['workers'], 2)
+        os.remove(outfile)
+
     def test_errors(self):
         """
         Tests if errors and exceptions are correctly raised.
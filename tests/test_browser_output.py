@@ -5,9 +5,17 @@ test talos browser output parsing
 """
 
 import os
+import shutil
+import struct
+import subprocess
+import sys
+import mmap
+import tempfile
 import unittest
 
+from talos import utils
 from talos.results import BrowserLogResults
+from talos.results import BrowserLogStream
 from talos.results import PageloaderResults
 from talos.utils import talosError
 
@@ -139,6 +147,207 @@ __startAfterTerminationTimestamp1333663596551__endAfterTerminationTimestamp
 
         self.compare_error_message(bad_report, "Multiple matches for %s,%s" % (self.start_report(), self.end_report()))
 
+    def test_counters(self):
+        """RSS and responsiveness counters are read from the log"""
+
+        report = """__start_report392__end_report
+RSS: Main: 1234
+RSS: Content: 5678
+MOZ_EVENT_TRACE sample 1333663595953 45.5
+__startTimestamp1333663595953__endTimestamp
+__startBeforeLaunchTimestamp1333663595557__endBeforeLaunchTimestamp
+MOZ_EVENT_TRACE sample 1333663596000 12
+__startAfterTerminationTimestamp1333663596551__endAfterTerminationTimestamp
+"""
+        counter_results = {'Main_RSS': [], 'Content_RSS': []}
+        global_counters = {'responsiveness': [], 'shutdown': []}
+        BrowserLogResults(results_raw=report,
+                          counter_results=counter_results,
+                          global_counters=global_counters)
+        self.assertEqual(counter_results, {'Main_RSS': ['1234'],
+                                           'Content_RSS': ['5678']})
+        self.assertEqual(global_counters['responsiveness'], ['45.5', '12'])
+        self.assertEqual(global_counters['shutdown'], [598])
+
+    def test_cc_time(self):
+        """the cycle collection report is accumulated as the cc_time counter"""
+
+        report = """__start_tp_report_x_x_mozilla_page_load
+_x_x_mozilla_page_load_details
+|i|pagename|runs|
+|0;a.html;10;20
+__end_tp_report
+__start_cc_report
+_x_x_mozilla_cycle_collect,123
+__end_cc_report
+__startTimestamp1333663595953__endTimestamp
+__startBeforeLaunchTimestamp1333663595557__endBeforeLaunchTimestamp
+__startAfterTerminationTimestamp1333663596551__endAfterTerminationTimestamp
+"""
+        global_counters = {'cc_time': []}
+        BrowserLogResults(results_raw=report, global_counters=global_counters)
+        stream = BrowserLogStream()
+        for line in report.splitlines(True):
+            stream.feed(line)
+        BrowserLogResults(results_raw=stream, global_counters=global_counters)
+        self.assertEqual(global_counters['cc_time'], [123, 123])
+
+        # cycle collection is not always forced
+        start = report.index('__start_cc_report')
+        end = report.index('__startTimestamp')
+        browser_log = BrowserLogResults(results_raw=report[:start] + report[end:],
+                                        global_counters=global_counters)
+        self.assertEqual(browser_log.cc_time, None)
+        self.assertEqual(global_counters['cc_time'], [123, 123])
+
+        self.compare_error_message(report.replace('collect,123', 'collect,many'),
+                                   "Could not cast cc_time to an integer: many")
+
+    def test_failure_message(self):
+        """the failure message is taken from between the __FAIL markers"""
+
+        report = "__start_report392__end_report\n__FAILtimed out__FAIL\n__FAILagain__FAIL"
+        self.compare_error_message(report, "timed out")
+
+    def test_mapped_windows(self):
+        """tokens and counters are found across the windows of a mapped log"""
+
+        browser_tsvg = os.path.join(here, 'browser_output.tsvg.txt')
+        window, overlap = utils.MappedFile.window, utils.MappedFile.overlap
+        utils.MappedFile.window = mmap.ALLOCATIONGRANULARITY
+        utils.MappedFile.overlap = 128
+        try:
+            results = []
+            for kwargs in ({'filename': browser_tsvg},
+                           {'results_raw': file(browser_tsvg).read()}):
+                counter_results = {'Main_RSS': []}
+                browser_log = BrowserLogResults(counter_results=counter_results, **kwargs)
+                results.append((browser_log.browser_results, browser_log.startTime,
+                                browser_log.endTime, counter_results))
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(len(results[0][-1]['Main_RSS']), 65)
+        finally:
+            utils.MappedFile.window, utils.MappedFile.overlap = window, overlap
+
+    def test_stream(self):
+        """a log fed line by line parses as the log file does"""
+
+        browser_tsvg = os.path.join(here, 'browser_output.tsvg.txt')
+        stream = BrowserLogStream(browser_tsvg)
+        for line in file(browser_tsvg):
+            stream.feed(line)
+        # only the text within the tokens is kept
+        self.assertTrue(sum([len(text) for text in stream.kept]) < len(stream))
+
+        results = []
+        for kwargs in ({'filename': browser_tsvg},
+                       {'filename': browser_tsvg, 'results_raw': stream}):
+            counter_results = {'Main_RSS': []}
+            browser_log = BrowserLogResults(counter_results=counter_results, **kwargs)
+            results.append((browser_log.browser_results, browser_log.startTime,
+                            browser_log.endTime, counter_results))
+        self.assertEqual(results[0], results[1])
+
+        # errors are reported as for the file
+        stream = BrowserLogStream()
+        for line in [self.start_report(), 'garbage\n', self.end_report(), self.end_report()]:
+            stream.feed(line)
+        self.assertRaises(talosError, BrowserLogResults, results_raw=stream)
+
+    def test_sidecar(self):
+        """a log parsed with a cache_dir is loaded from its sidecar the next time"""
+
+        browser_tsvg = os.path.join(here, 'browser_output.tsvg.txt')
+        tempdir = tempfile.mkdtemp()
+        try:
+            def parse():
+                counter_results = {'Main_RSS': []}
+                global_counters = {'responsiveness': [], 'shutdown': []}
+                browser_log = BrowserLogResults(browser_tsvg, counter_results=counter_results,
+                                                global_counters=global_counters, cache_dir=tempdir)
+                results = browser_log.results()
+                return (browser_log, (browser_log.format, browser_log.startTime, browser_log.endTime,
+                                      results.raw_values(), list(results.indices),
+                                      counter_results, global_counters))
+            sidecars = lambda: [i for i in os.listdir(tempdir) if i.endswith('.talos')]
+            parsed, expected = parse()
+            self.assertNotEqual(parsed.browser_results, None)
+            self.assertEqual(len(sidecars()), 1)
+
+            loaded, values = parse()
+            self.assertEqual(loaded.browser_results, None) # not parsed again
+            self.assertEqual(values, expected)
+            self.assertEqual(len(values[-2]['Main_RSS']), 65)
+
+            # a corrupt sidecar is ignored, and replaced
+            sidecar = os.path.join(tempdir, sidecars()[0])
+            contents = file(sidecar, 'rb').read()
+            with open(sidecar, 'wb') as f:
+                f.write(contents[:len(contents)/2])
+            parsed, values = parse()
+            self.assertNotEqual(parsed.browser_results, None)
+            self.assertEqual(values, expected)
+            self.assertEqual(file(sidecar, 'rb').read(), contents)
+
+            # as is one with a bad count of values midway
+            offset = len('TALOSLOG') + 4 + 4 + len(parsed.format) + 8 * len(parsed.time_tokens)
+            for count in (-1, len(contents)):
+                with open(sidecar, 'wb') as f:
+                    f.write(contents[:offset] + struct.pack('<q', count) + contents[offset + 8:])
+                parsed, values = parse()
+                self.assertNotEqual(parsed.browser_results, None)
+                self.assertEqual(values, expected)
+                self.assertEqual(file(sidecar, 'rb').read(), contents)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_large_log(self):
+        """peak memory does not grow with the size of the browser log"""
+
+        try:
+            import resource
+        except ImportError:
+            return # peak memory is only measured on unix
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            small = os.path.join(tempdir, 'small.log')
+            large = os.path.join(tempdir, 'large.log')
+            noise = ''.join(['[JavaScript Warning: "noise %d"]\n' % i
+                             for i in range(20000)]) + 'RSS: Main: 1234\n'
+            chunks = 500 * 1024 * 1024 / len(noise)
+            report = file(os.path.join(here, 'browser_output.tsvg.txt')).read()
+            with open(small, 'w') as f:
+                f.write(noise + report)
+            with open(large, 'w') as f:
+                for i in range(chunks):
+                    f.write(noise)
+                f.write(report)
+
+            def parse(filename):
+                """parse the log in a new process; returns (peak memory, Main_RSS count)"""
+                script = """import resource
+from talos.results import BrowserLogResults
+counter_results = {'Main_RSS': []}
+BrowserLogResults(%r, counter_results=counter_results)
+print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(counter_results['Main_RSS'])
+""" % filename
+                env = os.environ.copy()
+                env['PYTHONPATH'] = os.path.dirname(here)
+                process = subprocess.Popen([sys.executable, '-c', script], env=env,
+                                           stdout=subprocess.PIPE)
+                stdout, stderr = process.communicate()
+                self.assertEqual(process.returncode, 0)
+                return [int(i) for i in stdout.split()]
+
+            small_rss, small_count = parse(small)
+            large_rss, large_count = parse(large)
+            self.assertEqual(large_count, chunks + small_count - 1)
+            # ru_maxrss is in kilobytes on linux and bytes on mac
+            self.assertTrue(large_rss - small_rss < 100 * 1024 * (1024 if sys.platform == 'darwin' else 1))
+        finally:
+            shutil.rmtree(tempdir)
+
     def start_report(self):
         """return a start report token"""
         return BrowserLogResults.report_tokens[0][1][0] # start token
@@ -6,6 +6,7 @@ test talos' filter module:
 http://hg.mozilla.org/build/talos/file/tip/talos/filter.py
 """
 
+import array
 import os
 import sys
 import tempfile
@@ -78,5 +79,239 @@ class TestFilter(unittest.TestCase):
         # delete foo again
         del talos.filter.scalar_filters['foo']
 
+class TestOrderStatistics(unittest.TestCase):
+
+    def series(self):
+        """short and long series, with ties"""
+        random = __import__('random').Random(7)
+        series = [[3.], [2., 1.], [5., 5., 5., 1.]]
+        for length in (25, 129, 1000, 10000):
+            series.append([random.choice([random.uniform(0, 100), 50.])
+                           for i in range(length)])
+        return series
+
+    def test_select(self):
+        """select returns the values of sorted ranks, with or without numpy"""
+        numpy = talos.filter.numpy
+        try:
+            for talos.filter.numpy in (numpy, None):
+                for series in self.series():
+                    ordered = sorted(series)
+                    ranks = [len(series) - 1, 0, len(series)/2]
+                    self.assertEqual(talos.filter.select(series, *ranks),
+                                     [ordered[rank] for rank in ranks])
+                    if len(series) > 4:
+                        self.assertEqual(sorted(talos.filter.ranked(series, 2, len(series) - 3)),
+                                         ordered[2:-2])
+        finally:
+            talos.filter.numpy = numpy
+
+    def test_median(self):
+        """median by selection matches the middle of the sorted series"""
+        self.assertEqual(talos.filter.median([4., 1., 3.]), 3.)
+        self.assertEqual(talos.filter.median([4., 1., 3., 2.]), 2.5)
+        for series in self.series():
+            ordered = sorted(series)
+            middle = len(ordered)/2
+            if len(ordered) % 2:
+                expected = ordered[middle]
+            else:
+                expected = 0.5*(ordered[middle-1] + ordered[middle])
+            self.assertEqual(talos.filter.median(series), expected)
+
+    def test_percentile(self):
+        data = [15., 20., 35., 40., 50.]
+        self.assertEqual(talos.filter.percentile(data, 0), 15.)
+        self.assertEqual(talos.filter.percentile(data, 50), 35.)
+        self.assertEqual(talos.filter.percentile(data, 100), 50.)
+        self.assertEqual(talos.filter.percentile(data, 40), 29.)
+        self.assertRaises(AssertionError, talos.filter.percentile, data, 101)
+
+    def test_trimmed_and_winsorized_mean(self):
+        data = [10., 100., 2., 3., -50.]
+        self.assertEqual(talos.filter.trimmed_mean(data, 1), 5.)
+        self.assertEqual(talos.filter.trimmed_mean(data, 2), 3.)
+        self.assertEqual(talos.filter.winsorized_mean(data, 1), 5.4)
+        # short series are left alone
+        self.assertEqual(talos.filter.trimmed_mean([1., 2.], 1), 1.5)
+        self.assertEqual(talos.filter.winsorized_mean([1., 2.], 1), 1.5)
+
+    def test_shared_sort(self):
+        """chains sorting once give what the filters give one at a time"""
+        chains = [[['ignore_max', []], ['median', []]],
+                  [['ignore_max', []], ['ignore_min', []], ['percentile', [90]]],
+                  [['ignore_first', [2]], ['ignore_min', []], ['trimmed_mean', [3]]],
+                  [['ignore_max', []], ['winsorized_mean', [2]]],
+                  [['ignore_min', []], ['max', []]]]
+        for chain in chains:
+            filters = talos.filter.filters_args(chain)
+            for series in self.series():
+                expected = series
+                for f, args in filters:
+                    expected = f(expected, *args)
+                self.assertEqual(talos.filter.apply(series, filters), expected)
+
+    def test_parse(self):
+        """the new filters are available by name"""
+        self.assertEqual(talos.filter.parse('percentile:95'), ['percentile', [95]])
+        self.assertEqual(talos.filter.parse('trimmed_mean:2'), ['trimmed_mean', [2]])
+        filters = talos.filter.filters_args([['ignore_first', [1]], ['winsorized_mean', [1]]])
+        self.assertEqual(filters[-1][0], talos.filter.winsorized_mean)
+
+class TestBootstrap(unittest.TestCase):
+
+    data = [98.2, 101.5, 99.9, 100.3, 97.4, 103.8, 100.1, 99.2, 98.8, 100.6,
+            101.1, 99.5, 102.4, 100.0, 98.9]
+
+    def test_interval(self):
+        """the interval brackets the median and is reproducible"""
+        numpy = talos.filter.numpy
+        try:
+            for talos.filter.numpy in (numpy, None):
+                low, high = talos.filter.bootstrap_ci(self.data)
+                self.assertTrue(low <= talos.filter.median(self.data) <= high)
+                self.assertEqual((low, high), talos.filter.bootstrap_ci(self.data))
+                self.assertEqual(talos.filter.bootstrap_ci_low(self.data, 95), low)
+                self.assertEqual(talos.filter.bootstrap_ci_high(self.data, 95), high)
+                self.assertEqual(talos.filter.bootstrap_median_ci_width(self.data), high - low)
+
+                # a wider confidence level gives a wider interval
+                self.assertTrue(talos.filter.bootstrap_median_ci_width(self.data, 99) >=
+                                talos.filter.bootstrap_median_ci_width(self.data, 50))
+        finally:
+            talos.filter.numpy = numpy
+
+    def test_stable(self):
+        """a series without spread has an interval of zero width"""
+        self.assertEqual(talos.filter.bootstrap_median_ci_width([42.] * 10), 0.)
+        self.assertEqual(talos.filter.bootstrap_ci([42.]), (42., 42.))
+
+    def test_filters(self):
+        """the bootstrap filters may end a filter chain"""
+        self.assertEqual(talos.filter.parse('bootstrap_ci_low:90'), ['bootstrap_ci_low', [90]])
+        chain = talos.filter.compile([['ignore_first', [1]], ['bootstrap_median_ci_width', []]])
+        self.assertEqual(chain(self.data), talos.filter.bootstrap_median_ci_width(self.data[1:]))
+
+class TestCompile(unittest.TestCase):
+
+    def test_cached(self):
+        """a spec is parsed and validated once; equal specs share a chain"""
+        chain = talos.filter.compile([['ignore_first', [2]], ['median', []]])
+        self.assertTrue(chain is talos.filter.compile([['ignore_first', (2,)], ['median', []]]))
+        self.assertTrue(chain is talos.filter.compile(chain))
+        self.assertFalse(chain is talos.filter.compile([['ignore_first', [3]], ['median', []]]))
+
+    def test_call(self):
+        """a compiled chain gives what apply gives"""
+        data = TestFilter.data
+        chain = talos.filter.compile([['ignore_first', [2]], ['median', []]])
+        self.assertEqual(chain(data), talos.filter.apply(data, talos.filter.filters_args([['ignore_first', [2]], ['median', []]])))
+        self.assertEqual(chain.batch([data, data[:5]]), [chain(data), chain(data[:5])])
+
+        # chains of functions
+        chain = talos.filter.compile([talos.filter.ignore_max, [max, []]])
+        self.assertEqual(chain(data), 28)
+
+    def test_invalid(self):
+        self.assertRaises(AssertionError, talos.filter.compile, [['median', []], ['ignore_max', []]])
+        self.assertRaises(AssertionError, talos.filter.compile, [['badfilter', []]])
+
+class TestBatchFilter(unittest.TestCase):
+
+    # chains used by the test definitions in talos/test.py and PerfConfigurator
+    chains = [[['ignore_first', [1]], ['median', []]],
+              [['ignore_first', [5]], ['median', []]],
+              [['ignore_max', []], ['median', []]],
+              [['ignore_max', []], ['mean', []]],
+              [['ignore_min', []], ['ignore_max', []], ['stddev', []]],
+              [['ignore_first', [2]], ['variance', []]],
+              [['ignore_max', []], ['max', []]],
+              [['min', []]],
+              [['mean', []]],
+              [['dromaeo', []]],
+              [['ignore_first', [3]], ['dromaeo', []]]]
+
+    def series(self):
+        """ragged series, including ties and series too short to filter"""
+        random = __import__('random').Random(42)
+        series = [[random.choice([1., 2., 3.])] * 4,
+                  [5.],
+                  [7., 3.],
+                  [0.1] * 11]
+        for length in range(1, 40):
+            series.append([random.uniform(1, 5000) for i in range(length)])
+        for page in range(500):
+            series.append([random.uniform(1, 50000) for i in range(25)])
+        return series
+
+    def test_matches_apply(self):
+        """apply_batch returns exactly what apply returns for each series"""
+        if talos.filter.numpy is None:
+            return
+        series = self.series()
+        for chain in self.chains:
+            filters = talos.filter.filters_args(chain)
+            expected = [talos.filter.apply(data, filters) for data in series]
+            self.assertEqual(talos.filter.apply_batch(series, filters), expected)
+
+    def test_columns(self):
+        """apply_columns on series stored one after another matches apply"""
+        series = self.series()
+        values = array.array('d', [value for data in series for value in data])
+        offsets = [0]
+        for data in series:
+            offsets.append(offsets[-1] + len(data))
+        for chain in self.chains:
+            filters = talos.filter.filters_args(chain)
+            expected = [talos.filter.apply(data, filters) for data in series]
+            self.assertEqual(talos.filter.apply_columns(values, offsets, filters), expected)
+
+    def test_geometric_mean(self):
+        """geometric_mean is not registered by name but may be passed directly"""
+        if talos.filter.numpy is None:
+            return
+        series = self.series()
+        filters = [talos.filter.ignore_first, talos.filter.geometric_mean]
+        expected = [talos.filter.apply(data, filters) for data in series]
+        self.assertEqual(talos.filter.apply_batch(series, filters), expected)
+
+    def test_fallback(self):
+        """without numpy or with unknown filters, each series is applied in turn"""
+        series = self.series()
+        filters = talos.filter.filters_args([['ignore_max', []], ['median', []]])
+        expected = [talos.filter.apply(data, filters) for data in series]
+
+        numpy = talos.filter.numpy
+        talos.filter.numpy = None
+        try:
+            self.assertEqual(talos.filter.apply_batch(series, filters), expected)
+        finally:
+            talos.filter.numpy = numpy
+
+        custom = [[talos.filter.ignore_max, []], [lambda x: sum(x)]]
+        self.assertEqual(talos.filter.apply_batch(series, custom),
+                         [sum(talos.filter.ignore_max(data)) for data in series])
+
+    def outcome(self, function, *args):
+        """the result of a call, or the type of exception it raised"""
+        try:
+            return function(*args)
+        except Exception, e:
+            return type(e)
+
+    def test_empty_series(self):
+        """series of one value or none, among enough to be batched, go as the scalar path goes"""
+        if talos.filter.numpy is None:
+            return
+        single = [[float(value)] for value in range(1, talos.filter.BATCH_CUTOFF + 1)]
+        for series in (single, single + [[]], [[]] + single + [[1., 2.]]):
+            self.assertTrue(len(series) >= talos.filter.BATCH_CUTOFF)
+            for chain in self.chains:
+                filters = talos.filter.filters_args(chain)
+                expected = self.outcome(lambda: [talos.filter.apply(data, filters) for data in series])
+                self.assertEqual(self.outcome(talos.filter.apply_batch, series, filters), expected)
+        self.assertRaises(ZeroDivisionError, talos.filter.apply_batch,
+                          single + [[]], [talos.filter.mean])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""
+test the output formats
+"""
+
+import BaseHTTPServer
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import urllib
+import urlparse
+from StringIO import StringIO
+
+from dzclient import DatazillaResult, DatazillaResultsCollection
+from talos.output import DatazillaOutput, SqliteOutput
+from talos.results import TalosResults, TestResults
+from talos.utils import talosError
+from test_post_file import Server
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """stand-in for datazilla's load_test API, taking gzip-encoded posts if the server does, after its errors"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['content-length']))
+        encoding = self.headers.get('content-encoding')
+        self.server.encodings.append(encoding)
+        if self.server.errors:
+            self.server.errors -= 1
+            self.send_error(500)
+            return
+        if encoding == 'gzip':
+            if not self.server.gzip:
+                self.send_error(415)
+                return
+            body = gzip.GzipFile(fileobj=StringIO(body)).read()
+        self.server.posts.append((self.path, urlparse.parse_qs(body)))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write('ok')
+
+    def log_message(self, *args):
+        pass
+
+class TestDatazillaOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = DatazillaResultsCollection(machine_name='talos-r3-fed-001', os='linux',
+                                                     branch='Mozilla-Inbound', id='20131012',
+                                                     test_date=1381600000)
+        result = DatazillaResult()
+        for suite in ('tsvg', 'tp5n'):
+            result.add_testsuite(suite, options={'tpcycles': 10})
+            result.add_test_results(suite, 'hixie-001.xml', [45643, 14976])
+            result.add_talos_auxiliary(suite, 'Main_RSS', [1234])
+        self.collection.add_datazilla_result(result)
+        self.datasets = json.loads(json.dumps(self.collection.datasets()))
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_serialize(self):
+        """the datasets are serialized once for all outputs"""
+        output = DatazillaOutput(None)
+        datasets, serialized = output.serialize(self.collection)
+        self.assertTrue(output.serialize(self.collection)[1] is serialized)
+        self.assertEqual([json.loads(data) for data in serialized], self.datasets)
+
+    def test_file(self):
+        output = DatazillaOutput(None)
+        filename = os.path.join(self.tempdir, 'datazilla.json')
+        output.output(self.collection, 'file://%s' % filename, {})
+        self.assertEqual(json.loads(file(filename).read()), self.datasets)
+
+    def test_gzip_file(self):
+        """file:// outputs are gzipped if asked, with .gz appended"""
+        output = DatazillaOutput(None, datazilla_gzip=True)
+        filename = os.path.join(self.tempdir, 'datazilla.json')
+        output.output(self.collection, 'file://%s' % filename, {})
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(json.loads(gzip.open(filename + '.gz').read()), self.datasets)
+
+    def start_server(self, gzip=False, errors=0):
+        """a stand-in datazilla, answering its first errors posts with 500"""
+        server = Server(('127.0.0.1', 0), Handler)
+        server.posts = []
+        server.encodings = []
+        server.gzip = gzip
+        server.errors = errors
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def post(self, gzip=False, **kwargs):
+        """post the collection to a stand-in datazilla; returns the server"""
+        server = self.start_server(gzip)
+        try:
+            output = DatazillaOutput(None, **kwargs)
+            output.output(self.collection, 'http://127.0.0.1:%d/talos' % server.server_address[1], {})
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([path for path, params in server.posts], ['/talos/api/load_test'] * 2)
+        # the data is quoted before it is form-encoded, as dzclient does
+        self.assertEqual([json.loads(urllib.unquote(params['data'][0])) for path, params in server.posts],
+                         self.datasets)
+        return server
+
+    def test_post(self):
+        self.assertEqual(self.post().encodings, [None, None])
+
+    def test_post_gzip(self):
+        """datasets are posted gzip-encoded, if the server takes them"""
+        self.assertEqual(self.post(gzip=True, datazilla_gzip=True).encodings, ['gzip', 'gzip'])
+        self.assertEqual(self.post(gzip=False, datazilla_gzip=True).encodings, ['gzip', None, None])
+
+    def test_post_gzip_error(self):
+        """a dataset the server fails to take gzip-encoded is not sent again uncompressed"""
+        server = self.start_server(gzip=True, errors=1)
+        try:
+            output = DatazillaOutput(None, datazilla_gzip=True)
+            output.output(self.collection, 'http://127.0.0.1:%d/talos' % server.server_address[1], {})
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(server.encodings, ['gzip', 'gzip'])
+        self.assertEqual(len(server.posts), 1)
+        self.assertTrue(output.compress)
+
+class TestSqliteOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'talos.sqlite')
+        browser_config = dict(branch_name='Mozilla-Inbound', sourcestamp='abcdef', buildid='20131012',
+                              browser_name='Firefox', browser_version='27.0a1')
+        self.results = TalosResults('qm-pxp01', 1381600000, browser_config, [['median', []]])
+        test = TestResults({'name': 'tsvg'}, {'turnaround': []})
+        for cycle in range(2):
+            test.add(os.path.join(here, 'browser_output.tsvg.txt'), {'Private Bytes': [1000 + cycle, 2000 + cycle]})
+            test.global_counters['turnaround'].append(150 + cycle)
+        # as ttest adds them
+        test.all_counter_results.extend([{key: value} for key, value in test.global_counters.items()])
+        self.results.add(test)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_check(self):
+        SqliteOutput.check(['file://%s' % self.filename])
+        self.assertRaises(talosError, SqliteOutput.check, ['http://127.0.0.1/talos'])
+
+    def test_output(self):
+        """each run is added to the database, with its per-cycle values and counters"""
+        output = SqliteOutput(self.results)
+        for date in (1381600000, 1381700000):
+            self.results.date = date
+            output.output(output(), 'file://%s' % self.filename, {})
+
+        db = sqlite3.connect(self.filename)
+        try:
+            self.assertEqual(db.execute("SELECT date, buildid FROM runs ORDER BY id").fetchall(),
+                             [(1381600000, '20131012'), (1381700000, '20131012')])
+            self.assertEqual(db.execute("SELECT name FROM tests").fetchall(), [('tsvg',)])
+            self.assertEqual(db.execute("SELECT COUNT(*) FROM pages").fetchone()[0], 12)
+
+            runs = dict(self.results.results[0].results[0].raw_values())['hixie-001.xml']
+            rows = db.execute("""SELECT cycle_values.run, cycle, value FROM cycle_values
+                                 JOIN tests ON tests.id = cycle_values.test
+                                 JOIN pages ON pages.id = cycle_values.page
+                                 WHERE tests.name = ? AND pages.name = ? AND date >= ?
+                                 ORDER BY cycle_values.run, cycle, replicate""",
+                              ('tsvg', 'hixie-001.xml', 1381700000)).fetchall()
+            self.assertEqual(rows, [(2, cycle, value) for cycle in range(2) for value in runs])
+
+            self.assertEqual(db.execute("SELECT cycle, value FROM counters WHERE run = 1 AND name = 'Private Bytes' ORDER BY cycle, position").fetchall(),
+                             [(0, 1000), (0, 2000), (1, 1001), (1, 2001)])
+            self.assertEqual(db.execute("SELECT cycle, value FROM counters WHERE run = 1 AND name = 'turnaround' ORDER BY position").fetchall(),
+                             [(None, 150), (None, 151)])
+            self.assertEqual(db.execute("SELECT MAX(cycle) FROM counters").fetchone()[0], 1)
+            plan = ' '.join([row[-1] for row in db.execute(
+                "EXPLAIN QUERY PLAN SELECT value FROM cycle_values WHERE test = 1 AND page = 1 AND date > 0")])
+            self.assertTrue('cycle_values_test_page_date' in plan)
+        finally:
+            db.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""
+test posting results to a stand-in graph server
+"""
+
+import BaseHTTPServer
+import SocketServer
+import cgi
+import errno
+import gzip
+import httplib
+import random
+import socket
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+from talos import post_file
+from talos.output import GraphserverOutput
+from talos.utils import talosError
+
+def links(payload):
+    """graphserver's answer to a payload: two lines for VALUES, one for AVERAGE"""
+    if payload.startswith('START'):
+        _type, info = payload.splitlines()[1:3]
+        testname = info.split(',')[1]
+    else:
+        _type, testname = 'VALUES', payload
+    response = 'RETURN\t%s\t1.0\tgraph.html#%s\n' % (testname, testname)
+    if _type == 'VALUES':
+        response = 'RETURN\t%s\tgraph.html#%s\n' % (testname, testname) + response
+    return response
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    answers each payload as graphserver does, after some latency, unless told to fail;
+    a request of several payloads is refused unless the server takes batches, or
+    'first', taking only the first, and a gzip-encoded one only if it takes those
+    """
+
+    protocol_version = 'HTTP/1.1' # keep-alive
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['content-length']))
+        encoding = self.headers.get('content-encoding')
+        with server.lock:
+            server.encodings.append(encoding)
+        if encoding == 'gzip':
+            if not getattr(server, 'gzip', False):
+                self.send_error(415)
+                return
+            body = gzip.GzipFile(fileobj=StringIO(body)).read()
+            self.headers['content-length'] = str(len(body))
+        form = cgi.FieldStorage(fp=StringIO(body), headers=self.headers,
+                                environ={'REQUEST_METHOD': 'POST',
+                                         'CONTENT_TYPE': self.headers['content-type']})
+        payloads = form.getlist('filename')
+        payload = payloads[0]
+        with server.lock:
+            server.requests.append(payload if len(payloads) == 1 else payloads)
+            server.ports.add(self.client_address[1])
+            failure = server.failures.get(payload)
+            if failure:
+                server.failures[payload] = failure[1:]
+                failure = failure[0]
+        time.sleep(random.uniform(0, server.latency))
+
+        if failure == 'drop':
+            self.close_connection = 1 # without a response
+            return
+        if failure == 'error':
+            response = 'Internal Server Error'
+            self.send_response(500)
+        elif len(payloads) > 1 and not server.batch:
+            response = 'Only one file may be posted'
+            self.send_response(400)
+        elif server.batch == 'first':
+            response = links(payload)
+            self.send_response(200)
+        else:
+            response = ''.join([links(payload) for payload in payloads])
+            self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.ports = set()
+        self.server.failures = {} # payload -> failures of its next posts
+        self.server.latency = 0.02
+        self.server.batch = False
+        self.server.encodings = []
+        self.host = '127.0.0.1:%d' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.payloads = ['test%d' % i for i in range(20)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def uploader(self, **kwargs):
+        output = GraphserverOutput(None)
+        kwargs.setdefault('wait', 0.01)
+        return post_file.Uploader(self.host, '/post', process=output.process_Request, **kwargs)
+
+    def test_order(self):
+        """results come back in the order of the payloads, over persistent connections"""
+        links = self.uploader(threads=4)(self.payloads)
+        self.assertEqual([link.split()[0] for link in links], self.payloads)
+        self.assertEqual(sorted(self.server.requests), sorted(self.payloads))
+        self.assertTrue(len(self.server.ports) <= 4)
+
+    def test_retry(self):
+        """failed payloads are retried without holding up the others"""
+        self.server.failures = {'test3': ['error', 'error'],
+                                'test7': ['drop']}
+        links = self.uploader(threads=4)(self.payloads)
+        self.assertEqual([link.split()[0] for link in links], self.payloads)
+        self.assertEqual(self.server.requests.count('test3'), 3)
+        self.assertEqual(self.server.requests.count('test7'), 2)
+        self.assertEqual(len(self.server.requests), len(self.payloads) + 3)
+
+    def test_unreachable(self):
+        """a payload failing every attempt fails the upload"""
+        self.server.failures = {'test5': ['error'] * 3}
+        self.assertRaises(talosError, self.uploader(retries=3), self.payloads)
+        self.assertEqual(self.server.requests.count('test5'), 3)
+
+    def test_backoff(self):
+        """the wait before each retry doubles, up to a limit, less up to half of it"""
+        uploader = self.uploader(wait=1, max_wait=6)
+        for attempt, wait in enumerate([1, 2, 4, 6, 6]):
+            backoff = uploader.backoff(attempt)
+            self.assertTrue(wait / 2. <= backoff <= wait)
+
+    def test_graphserver(self):
+        """the graphserver output collects the links of all results"""
+        tbpl_output = {}
+        output = GraphserverOutput(None)
+        output.wait_time = 0.01
+        self.server.failures = {'test2': ['error']}
+        output.post(self.payloads, self.host, '/post', 'http', tbpl_output)
+        self.assertEqual(sorted(tbpl_output['graphserver'].keys()), sorted(self.payloads))
+        self.assertEqual(tbpl_output['graphserver']['test2'],
+                         {'url': 'http://%s/graph.html#test2' % self.host, 'result': '1.0'})
+
+    def test_batches(self):
+        """several results are posted in each request, if the server takes them"""
+        output = GraphserverOutput(None, graphserver_batch=8)
+        output.wait_time = 0.01
+        info = dict(title='qm-pxp01', branch_name='', sourcestamp='NULL', buildid='1', date=0)
+        results = []
+        for i in range(20):
+            if i % 3:
+                results.append(output.construct_results([[i, 'a.html'], [i, 'b.html']], 'test%d' % i, **info))
+            else:
+                results.append(output.construct_results([[i, 'NULL']], 'test%d_responsiveness' % i, **info))
+        names = [result.splitlines()[2].split(',')[1] for result in results]
+
+        for batch, requests in ((True, 3), (False, 1 + 20)):
+            self.server.batch = batch
+            self.server.requests = []
+            tbpl_output = {}
+            output.post(results, self.host, '/post', 'http', tbpl_output)
+            self.assertEqual(len(self.server.requests), requests)
+            self.assertEqual(sorted(tbpl_output['graphserver'].keys()), sorted(names))
+
+        # a failed probe is retried, and batches still used
+        self.server.batch = True
+        self.server.requests = []
+        self.server.failures = {results[0]: ['error']}
+        output.post(results, self.host, '/post', 'http', {})
+        self.assertEqual(len(self.server.requests), 4)
+
+        # the results of a probe the server answered links for are not posted again
+        self.server.batch = 'first'
+        self.server.requests = []
+        tbpl_output = {}
+        output.post(results, self.host, '/post', 'http', tbpl_output)
+        self.assertEqual(sorted(self.server.requests[1:]), sorted(results[1:]))
+        self.assertEqual(sorted(tbpl_output['graphserver'].keys()), sorted(names))
+
+        # the links must match the results
+        output = GraphserverOutput(None)
+        processed = [output.process_Request(links(result)) for result in results[:2]]
+        self.assertEqual(output.split_links(''.join(processed), results[:2]), processed)
+        self.assertRaises(talosError, output.split_links, processed[1], results[:2])
+        self.assertRaises(talosError, output.split_links, ''.join(processed), results[:1])
+
+    def test_gzip(self):
+        """results are posted gzip-encoded, if the server takes them"""
+        for gzip, encodings in ((True, ['gzip'] * 20), (False, ['gzip', None] + [None] * 19)):
+            self.server.gzip = gzip
+            self.server.encodings = []
+            self.server.requests = []
+            links = self.uploader(threads=1, compress=True)(self.payloads)
+            self.assertEqual([link.split()[0] for link in links], self.payloads)
+            self.assertEqual(self.server.requests, self.payloads)
+            self.assertEqual(self.server.encodings, encodings)
+
+        # other failures are retried as they were posted, not sent again uncompressed
+        self.server.gzip = True
+        self.server.encodings = []
+        self.server.failures = {'test3': ['error']}
+        uploader = self.uploader(threads=1, compress=True)
+        uploader(self.payloads)
+        self.assertEqual(self.server.encodings, ['gzip'] * 21)
+        self.assertTrue(uploader.compress)
+
+
+class Connection(object):
+    """stand-in for an httplib connection, failing as the host closing it would"""
+
+    def __init__(self, sent, failure=None):
+        self.sent = sent
+        self.failure = failure
+        self.closed = False
+
+    def request(self, method, selector, body, headers):
+        if self.failure == 'send':
+            raise socket.error(errno.EPIPE, 'Broken pipe')
+        self.sent.append(body)
+
+    def getresponse(self):
+        if self.failure == 'status':
+            raise httplib.BadStatusLine("''")
+        if self.failure == 'reset':
+            raise socket.error(errno.ECONNRESET, 'Connection reset by peer')
+        return Response()
+
+    def close(self):
+        self.closed = True
+
+class Response(object):
+    status = 200
+    reason = 'OK'
+    will_close = False
+
+    def read(self):
+        return 'page'
+
+class TestConnectionPool(unittest.TestCase):
+
+    def pool(self, failure):
+        """a pool with an idle connection failing as given, and a working one to make after it"""
+        self.sent = []
+        pool = post_file.ConnectionPool()
+        pool.connect = lambda scheme, host: Connection(self.sent)
+        self.idle = Connection(self.sent, failure)
+        pool.idle[('http', 'graphs')] = [self.idle]
+        return pool
+
+    def test_closed_idle(self):
+        """a request the host did not take on an idle connection it closed is made again"""
+        for failure in 'send', 'status':
+            pool = self.pool(failure)
+            self.assertEqual(pool.request('http', 'graphs', 'POST', '/post', 'body', {}), 'page')
+            self.assertTrue(self.idle.closed)
+            self.assertEqual(self.sent, ['body'] if failure == 'send' else ['body', 'body'])
+
+    def test_sent(self):
+        """a request that may have been taken is not made again, lest it be posted twice"""
+        pool = self.pool('reset')
+        self.assertRaises(socket.error, pool.request, 'http', 'graphs', 'POST', '/post', 'body', {})
+        self.assertTrue(self.idle.closed)
+        self.assertEqual(self.sent, ['body'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+test the cache of built profiles
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from talos.ffsetup import FFSetup
+from talos.profilecache import ProfileCache
+
+here = os.path.dirname(os.path.abspath(__file__))
+talos_dir = os.path.join(os.path.dirname(here), 'talos')
+
+class TestProfileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.source_profile = os.path.join(self.tempdir, 'base_profile')
+        shutil.copytree(os.path.join(talos_dir, 'base_profile'), self.source_profile)
+        self.extensions = [os.path.join(talos_dir, 'pageloader')]
+        self.prefs = {'dom.send_after_paint_to_content': True, 'browser.startup.page': 0}
+        self.cache = ProfileCache(os.path.join(self.tempdir, 'cache'))
+        self.temp_dirs = []
+
+    def tearDown(self):
+        for temp_dir in self.temp_dirs:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        shutil.rmtree(self.tempdir)
+
+    def create(self, prefs=None):
+        """create a profile through the cache; returns (profile_dir, extension ids)"""
+        ffsetup = FFSetup(None)
+        temp_dir, profile_dir = ffsetup.CreateTempProfileDir(self.source_profile, prefs or self.prefs,
+                                                             self.extensions, 'localhost',
+                                                             profile_cache=self.cache)
+        self.temp_dirs.append(temp_dir)
+        return profile_dir, ffsetup.extensions
+
+    def files(self, profile_dir):
+        """{relative path: contents} of the files of a profile"""
+        files = {}
+        for root, dirs, names in os.walk(profile_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, profile_dir)] = file(path, 'rb').read()
+        return files
+
+    def test_clone(self):
+        """a profile built before is cloned from the cache, with the same files and extensions"""
+        built, extensions = self.create()
+        self.assertEqual(len(self.cache.entries()), 1)
+        cloned, cloned_extensions = self.create()
+        self.assertEqual(cloned_extensions, extensions)
+        self.assertEqual(self.files(cloned), self.files(built))
+
+        # writing to a clone leaves the cache alone; the files of
+        # extensions, which the browser only reads, may be hardlinked
+        for name in self.files(cloned):
+            if name.startswith(self.cache.linked):
+                continue
+            with open(os.path.join(cloned, name), 'ab') as f:
+                f.write('modified')
+        self.assertEqual(self.files(self.create()[0]), self.files(built))
+
+    def test_key(self):
+        """the key changes with the source profile, prefs or extensions"""
+        key = self.cache.key(self.source_profile, self.prefs, self.extensions, 'localhost')
+        self.assertEqual(self.cache.key(self.source_profile, dict(self.prefs), self.extensions, 'localhost'), key)
+        self.assertNotEqual(self.cache.key(self.source_profile, {}, self.extensions, 'localhost'), key)
+        self.assertNotEqual(self.cache.key(self.source_profile, self.prefs, [], 'localhost'), key)
+        with open(os.path.join(self.source_profile, 'prefs.js'), 'a') as f:
+            f.write('\n')
+        self.assertNotEqual(self.cache.key(self.source_profile, self.prefs, self.extensions, 'localhost'), key)
+
+    def test_evict(self):
+        """the least recently used profiles are evicted to keep to the size"""
+        self.create()
+        size = self.cache.entries()[0][1]
+        self.cache.max_size = 2 * size + sum(self.cache.digest_sizes().values())
+        first = self.cache.entries()[0][2]
+        self.create({'a': 1})
+        os.utime(os.path.join(self.cache.directory, first, self.cache.info), (0, 0))
+        self.create({'b': 2})
+        keys = [key for used, entry_size, key in self.cache.entries()]
+        self.assertEqual(len(keys), 2)
+        self.assertFalse(first in keys)
+
+    def test_evict_digests(self):
+        """digests count toward the size, and are evicted with the profiles no other was made from"""
+        self.create()
+        first = self.cache.entries()[0][2]
+        with open(os.path.join(self.source_profile, 'prefs.js'), 'a') as f:
+            f.write('\n')
+        self.create()
+        os.utime(os.path.join(self.cache.directory, first, self.cache.info), (0, 0))
+        second = self.cache.entries()[1][2]
+        first_digests = set(self.cache.entry_digests(first))
+        second_digests = set(self.cache.entry_digests(second))
+        self.assertTrue(first_digests - second_digests)
+        self.assertEqual(set(os.listdir(self.cache.digests)), first_digests | second_digests)
+
+        self.cache.max_size = (sum([entry[1] for entry in self.cache.entries()]) +
+                               sum(self.cache.digest_sizes().values()) - 1)
+        self.cache.evict()
+        self.assertEqual([key for used, entry_size, key in self.cache.entries()], [second])
+        self.assertEqual(set(os.listdir(self.cache.digests)), second_digests)
+
+    def test_snapshot(self):
+        """an initialized profile is restored in place of another, with its path in the files the browser wrote"""
+        built, extensions = self.create()
+        with open(os.path.join(built, 'extensions.ini'), 'w') as f:
+            f.write('[ExtensionDirs]\nExtension0=%s\n' % os.path.join(built, 'extensions', 'pageloader@mozilla.org'))
+        browser_path = os.path.join(self.tempdir, 'firefox')
+        file(browser_path, 'w').close()
+        profile_key = self.cache.key(self.source_profile, self.prefs, self.extensions, 'localhost')
+        key = self.cache.snapshot_key(profile_key, '20131012', browser_path, 'about:blank')
+        self.assertEqual(self.cache.snapshot_key(profile_key, '20131012', browser_path, 'about:blank'), key)
+        self.assertNotEqual(self.cache.snapshot_key(profile_key, '20131013', browser_path, 'about:blank'), key)
+        self.cache.add(key, built, extensions, buildid='20131012')
+
+        profile_dir = self.create()[0]
+        info = self.cache.restore(key, profile_dir)
+        self.assertEqual(info['buildid'], '20131012')
+        self.assertEqual(info['extensions'], extensions)
+        self.assertEqual(file(os.path.join(profile_dir, 'extensions.ini')).read(),
+                         '[ExtensionDirs]\nExtension0=%s\n' % os.path.join(profile_dir, 'extensions', 'pageloader@mozilla.org'))
+        self.assertEqual(self.cache.restore('0' * 32, profile_dir), None)
+        self.assertTrue(os.path.isdir(profile_dir))
+
+if __name__ == '__main__':
+    unittest.main()
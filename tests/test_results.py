@@ -28,9 +28,18 @@ _x_x_mozilla_page_load_details
 |11;hixie-007.xml;1628;1623;1623;1617;1622
 """
 
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+import talos.output
 import talos.filter
 import talos.results
+import talos.utils
+from test_post_file import Handler, Server
+
+here = os.path.dirname(os.path.abspath(__file__))
 
 class TestPageloaderResults(unittest.TestCase):
 
@@ -78,5 +87,222 @@ class TestPageloaderResults(unittest.TestCase):
         self.assertEqual(filtered[0][0], 68.)
         self.assertEqual(filtered[-1][0], 1623.)
 
+    def test_columns(self):
+        """the runs of all pages are stored in one array"""
+        results = talos.results.PageloaderResults(results_string)
+        self.assertEqual(len(results.runs), 60)
+        self.assertEqual(list(results.offsets), range(0, 65, 5))
+        self.assertEqual(list(results.indices), range(12))
+        self.assertEqual(results.page_runs(11), [1628., 1623., 1623, 1617., 1622.])
+
+        # page names are shared between cycles
+        other = talos.results.PageloaderResults(results_string)
+        self.assertTrue(other.pages[5] is results.pages[5])
+
+        if talos.filter.numpy is not None:
+            view = results.array()
+            self.assertEqual(view.tolist(), results.runs.tolist())
+            results.runs[0] = 0.
+            self.assertEqual(view[0], 0.)
+
+    def test_ts_results(self):
+        """ts results, with and without page names"""
+        results = talos.results.TsResults('392|400|398')
+        self.assertEqual(results.raw_values(), [('NULL', [392., 400., 398.])])
+        results = talos.results.TsResults('a,1,2\nb,3,4\n')
+        self.assertEqual(results.raw_values(), [('a', [1., 2.]), ('b', [3., 4.])])
+        self.assertEqual(results.values([[max, []]]), [[2., 'a'], [4., 'b']])
+
+class TestTestResults(unittest.TestCase):
+
+    def test_running_stats(self):
+        """per-page statistics are updated as each cycle is added"""
+        test_results = talos.results.TestResults({'name': 'tsvg'})
+        browser_log = os.path.join(here, 'browser_output.tsvg.txt')
+
+        test_results.add(browser_log)
+        summary = test_results.summary('hixie-001.xml')
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['max'], 45643.)
+
+        stream = talos.results.BrowserLogStream(browser_log)
+        for line in file(browser_log):
+            stream.feed(line)
+        test_results.add(stream)
+        self.assertEqual(test_results.summary('hixie-001.xml')['count'], 10)
+        runs = dict(test_results.results[0].raw_values())['hixie-001.xml']
+        self.assertAlmostEqual(test_results.summary('hixie-001.xml')['mean'],
+                               talos.filter.mean(runs))
+        self.assertEqual(len(test_results.stats), 12)
+
+class TestTalosResults(unittest.TestCase):
+
+    def test_values_cache(self):
+        """filtered and raw values are computed once and shared until add"""
+        test_results = talos.results.TestResults({'name': 'tsvg'})
+        test_results.add(os.path.join(here, 'browser_output.tsvg.txt'))
+        results = talos.results.TalosResults('tsvg', 0, {},
+                                             [['ignore_max', []], ['median', []]])
+        results.add(test_results)
+
+        values = results.values(test_results)
+        self.assertEqual(len(values), 12)
+        self.assertTrue(results.values(test_results) is values)
+        self.assertEqual(values, test_results.results[0].values(results.filters))
+
+        raw_values = results.raw_values(test_results)
+        self.assertTrue(results.raw_values(test_results) is raw_values)
+        self.assertEqual(raw_values, test_results.results[0].raw_values())
+
+        # per-test filters
+        test_results.test_config['filters'] = [['max', []]]
+        self.assertEqual(results.values(test_results),
+                         test_results.results[0].values([['max', []]]))
+
+        # adding a test invalidates the cache
+        results.add(talos.results.TestResults({'name': 'ts'}))
+        self.assertFalse(results.raw_values(test_results) is raw_values)
+
+        test_results.test_config['filters'] = [['nosuchfilter', []]]
+        self.assertRaises(talos.utils.talosError, results.values, test_results)
+
+class TestXperf(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tempdir = tempfile.mkdtemp()
+        os.chdir(self.tempdir)
+        with open('etl_output_thread_stats.csv', 'w') as f:
+            f.write("""thread, stage, counter, value
+main, startup, file_io_bytes, 100
+main, startup, net_io_bytes, 5
+nonmain, normal, file_io_bytes, 7
+main, startup, file_io_bytes, 200
+""")
+        with open('etl_output.csv', 'w') as f:
+            f.write("""filename, tid, stage, readcount, readbytes, writecount, writebytes
+c:\\a.dll, 1 (main), startup, 2, 4096, 0, 0
+c:\\b.dat, 1 (main), startup, 0, 0, 1, 512
+""")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tempdir)
+
+    def test_counters(self):
+        """xperf counters are looked up from the indexed csv files"""
+        counter_results = {'main_startup_fileio': [],
+                           'nonmain_normal_fileio': [],
+                           'mainthread_readbytes': [],
+                           'mainthread_writecount': []}
+        browser_log = talos.results.BrowserLogResults(results_raw=file(os.path.join(here, 'browser_output.ts.txt')).read())
+        browser_log.xperf(counter_results)
+        self.assertTrue(browser_log.using_xperf)
+        self.assertEqual(counter_results['main_startup_fileio'], [100., 200.])
+        self.assertEqual(counter_results['nonmain_normal_fileio'], [7.])
+        self.assertEqual(counter_results['mainthread_readbytes'], [[4096, 'c:\\a.dll']])
+        self.assertEqual(counter_results['mainthread_writecount'], [[1, 'c:\\b.dat']])
+
+        stats = talos.results.XperfThreadStats.load('etl_output_thread_stats.csv')
+        self.assertEqual(stats.index[('main', 'startup', 'net')], [5.])
+
+    def test_cache(self):
+        """the csv files are only parsed again when they change"""
+        stats = talos.results.XperfThreadStats.load('etl_output_thread_stats.csv')
+        self.assertTrue(talos.results.XperfThreadStats.load('etl_output_thread_stats.csv') is stats)
+        with open('etl_output_thread_stats.csv', 'a') as f:
+            f.write("main, normal, file_io_bytes, 1\n")
+        changed = talos.results.XperfThreadStats.load('etl_output_thread_stats.csv')
+        self.assertFalse(changed is stats)
+        self.assertEqual(changed.counter('main_normal_fileio'), [1.])
+        self.assertEqual(talos.results.XperfThreadStats.load('nonexistent.csv'), None)
+
+    def test_abstract(self):
+        """each csv file is parsed by its own class"""
+        self.assertRaises(TypeError, talos.results.XperfCSV, 'etl_output_thread_stats.csv')
+
+class TestMain(unittest.TestCase):
+
+    def test_jobs(self):
+        """logs parsed in a process pool are output in the order given"""
+        logs = [os.path.join(here, 'browser_output.%s.txt' % name)
+                for name in ('tsvg', 'ts', 'tsvg', 'ts')]
+        tempdir = tempfile.mkdtemp()
+        try:
+            outputs = []
+            for jobs in (1, 3):
+                filename = os.path.join(tempdir, 'output-%d.txt' % jobs)
+                talos.results.main(['--date', '0', '--jobs', str(jobs),
+                                    '--output', 'file://%s' % filename] + logs)
+                outputs.append(file(filename).read())
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertEqual([line.split(',')[1] for line in outputs[0].splitlines()
+                              if line.startswith('qm-pxp01')], logs)
+        finally:
+            shutil.rmtree(tempdir)
+
+class TestIncrementalOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.ports = set()
+        self.server.failures = {}
+        self.server.latency = 0
+        self.server.batch = False
+        self.server.encodings = []
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/post' % self.server.server_address[1]
+
+        browser_config = dict(branch_name='', sourcestamp='NULL', buildid='1',
+                              browser_name='Firefox', browser_version='27.0a1')
+        self.results = talos.results.TalosResults('qm-pxp01', 0, browser_config, [['median', []]])
+        self.wait_time = talos.output.GraphserverOutput.wait_time
+        talos.output.GraphserverOutput.wait_time = 0.01
+
+    def tearDown(self):
+        talos.output.GraphserverOutput.wait_time = self.wait_time
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def test_incremental(self):
+        """the results of each test are posted as it is added; the rest are output at the end"""
+        filename = os.path.join(self.tempdir, 'results.out')
+        output_formats = {'results_urls': [self.url, 'file://%s' % filename]}
+        incremental = talos.results.IncrementalOutput(self.results, output_formats)
+        incremental.start()
+        for name in ('tsvg', 'tsvg_opacity'):
+            test_results = talos.results.TestResults({'name': name})
+            test_results.add(os.path.join(here, 'browser_output.tsvg.txt'))
+            self.results.add(test_results)
+            incremental.add(test_results)
+
+        self.results.output(output_formats, incremental=incremental)
+        self.assertFalse(incremental.isAlive())
+        self.assertEqual([request.splitlines()[2].split(',')[1] for request in self.server.requests],
+                         ['tsvg', 'tsvg_opacity'])
+        self.assertEqual(sorted(incremental.tbpl_output()['graphserver'].keys()), ['tsvg', 'tsvg_opacity'])
+        self.assertEqual(len(file(filename).read().split('START')), 3)
+
+    def test_failure(self):
+        """a test whose results can't be posted doesn't stop the others, but fails the output"""
+        incremental = talos.results.IncrementalOutput(self.results, {'results_urls': [self.url]})
+        incremental.start()
+        for name in ('ts', 'tsvg'):
+            test_results = talos.results.TestResults({'name': name})
+            test_results.add(os.path.join(here, 'browser_output.tsvg.txt'))
+            if name == 'ts':
+                payload = talos.output.GraphserverOutput(self.results.single(test_results))()[0]
+                self.server.failures = {payload: ['error'] * 5}
+            self.results.add(test_results)
+            incremental.add(test_results)
+        self.assertEqual(incremental.finish().get('graphserver', {}).keys(), ['tsvg'])
+        self.assertTrue(isinstance(incremental.error, talos.utils.talosError))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+test the spool of results to send
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from dzclient import DatazillaResult, DatazillaResultsCollection
+from talos import output
+from talos.spool import Spool
+from test_post_file import Handler, Server
+import test_output
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.spool = Spool(os.path.join(self.tempdir, 'spool'))
+        self.wait_time = output.GraphserverOutput.wait_time
+        output.GraphserverOutput.wait_time = 0.01
+
+        # a port for the graph server, which is down to begin with
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.url = 'http://127.0.0.1:%d/post' % self.port
+        self.server = None
+
+    def tearDown(self):
+        output.GraphserverOutput.wait_time = self.wait_time
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def start_server(self):
+        self.server = Server(('127.0.0.1', self.port), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.ports = set()
+        self.server.failures = {}
+        self.server.latency = 0
+        self.server.batch = False
+        self.server.encodings = []
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def test_drain(self):
+        """payloads stay in the spool until they are sent"""
+        self.spool.add('results_urls', self.url, ['test0', 'test1'])
+        self.spool.add('results_urls', self.url, ['test2'], {'graphserver_batch': 0})
+        self.assertEqual(len(self.spool.entries()), 2)
+
+        self.assertEqual(self.spool.drain(), 2)
+        self.assertEqual(len(self.spool.entries()), 2)
+
+        self.start_server()
+        tbpl_output = {}
+        self.assertEqual(self.spool.drain(tbpl_output), 0)
+        self.assertEqual(os.listdir(self.spool.directory), [])
+        self.assertEqual(sorted(self.server.requests[:2]), ['test0', 'test1'])
+        self.assertEqual(self.server.requests[2:], ['test2'])
+        self.assertEqual(sorted(tbpl_output['graphserver'].keys()), ['test0', 'test1', 'test2'])
+
+    def test_sender(self):
+        """the payloads added are sent in the background, before those left by earlier runs"""
+        self.spool.add('results_urls', self.url, ['old'])
+        spool = Spool(self.spool.directory)
+        spool.add('results_urls', self.url, ['new'])
+        self.start_server()
+        sender = spool.sender()
+        sender.start()
+        sender.join(30)
+        self.assertFalse(sender.isAlive())
+        self.assertEqual(sender.left, 0)
+        self.assertEqual(self.server.requests, ['new', 'old'])
+        self.assertEqual(sender.tbpl_output()['graphserver'].keys(), ['new'])
+
+    def test_claimed(self):
+        """payloads being sent are left alone, unless abandoned"""
+        path = self.spool.add('results_urls', self.url, ['test0'])
+        claimed = self.spool.claim(path)
+        self.assertEqual(self.spool.claim(path), None)
+        self.assertEqual(self.spool.entries(), [])
+        os.utime(claimed, (0, 0))
+        self.assertEqual(self.spool.entries(), [path])
+
+    def collection(self):
+        collection = DatazillaResultsCollection(machine_name='talos-r3-fed-001', os='linux',
+                                                branch='Mozilla-Inbound', id='20131012',
+                                                test_date=1381600000)
+        result = DatazillaResult()
+        result.add_testsuite('tsvg', options={'tpcycles': 10})
+        result.add_test_results('tsvg', 'hixie-001.xml', [45643, 14976])
+        result.add_talos_auxiliary('tsvg', 'Main_RSS', [1234])
+        collection.add_datazilla_result(result)
+        return collection
+
+    def test_datazilla(self):
+        """datazilla collections are written to the spool as json"""
+        collection = self.collection()
+        data = json.loads(json.dumps(output.DatazillaOutput.dumps(collection)))
+        self.assertEqual(output.DatazillaOutput.loads(data).datasets(), collection.datasets())
+
+    def test_datazilla_error(self):
+        """datasets datazilla fails to take stay in the spool"""
+        self.spool.add('datazilla_urls', 'http://127.0.0.1:%d/talos' % self.port, self.collection())
+        self.server = Server(('127.0.0.1', self.port), test_output.Handler)
+        self.server.posts = []
+        self.server.encodings = []
+        self.server.gzip = False
+        self.server.errors = 1 # 500
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+        self.assertEqual(self.spool.drain(), 1)
+        self.assertEqual(len(self.spool.entries()), 1)
+        self.assertEqual(self.server.posts, [])
+        self.assertEqual(self.spool.drain(), 0)
+        self.assertEqual(os.listdir(self.spool.directory), [])
+        self.assertEqual(len(self.server.posts), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+test talos' streaming statistics against the filters they mirror
+"""
+
+import random
+import unittest
+import talos.filter
+import talos.stats
+
+class TestRunningStats(unittest.TestCase):
+
+    def test_matches_filters(self):
+        """accumulated statistics agree with the whole-series filters"""
+        generator = random.Random(11)
+        for length in (1, 2, 5, 7, 25, 1000):
+            data = [generator.uniform(1, 5000) for i in range(length)]
+            stats = talos.stats.RunningStats()
+            for value in data:
+                stats.add(value)
+            self.assertEqual(stats.count, length)
+            self.assertEqual(stats.min, min(data))
+            self.assertEqual(stats.max, max(data))
+            self.assertAlmostEqual(stats.mean(), talos.filter.mean(data), places=6)
+            variance = talos.filter.variance(data)
+            self.assertAlmostEqual(stats.variance(), variance, delta=1e-9*max(variance, 1.))
+            self.assertAlmostEqual(stats.geometric_mean(), talos.filter.geometric_mean(data), places=6)
+            self.assertAlmostEqual(stats.dromaeo(), talos.filter.dromaeo(data), places=6)
+
+    def test_empty(self):
+        stats = talos.stats.RunningStats()
+        summary = stats.summary()
+        self.assertEqual(summary['count'], 0)
+        self.assertEqual([key for key, value in summary.items() if value not in (None, 0)], [])
+
+    def test_non_positive(self):
+        """the geometric mean is undefined with values <= 0"""
+        stats = talos.stats.RunningStats([3., 0., 4.])
+        self.assertEqual(stats.geometric_mean(), None)
+        self.assertEqual(stats.mean(), 7./3)
+
+    def test_dromaeo_partial_chunk(self):
+        """a partial chunk counts, but does not disturb later chunks"""
+        stats = talos.stats.RunningDromaeo()
+        for value in [1., 2., 3., 4., 5., 6.]:
+            stats.add(value)
+        self.assertAlmostEqual(stats.value(), talos.filter.dromaeo([1., 2., 3., 4., 5., 6.]))
+        for value in [7., 8., 9., 10.]:
+            stats.add(value)
+        self.assertAlmostEqual(stats.value(), talos.filter.dromaeo(range(1, 11)))
+
+    def test_dromaeo_cycles(self):
+        """chunks end with each cycle, as filter.dromaeo chunks each cycle"""
+        cycles = [[1., 2., 3., 4., 5., 6.], [7., 8., 9., 10.]]
+        stats = talos.stats.RunningStats()
+        for cycle in cycles:
+            stats.extend(cycle)
+            stats.end_cycle()
+        chunks = [chunk for cycle in cycles for chunk in talos.filter.dromaeo_chunks(cycle, 5)]
+        self.assertAlmostEqual(stats.dromaeo(), talos.filter.geometric_mean([talos.filter.mean(chunk) for chunk in chunks]))
+        self.assertNotAlmostEqual(stats.dromaeo(), talos.filter.dromaeo(cycles[0] + cycles[1]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+test waiting for the browser process to finish
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from talos.talosProcess import talosProcess
+
+class TestWaitForReady(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.tempdir, 'browser_output.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def run_process(self, output):
+        process = talosProcess([sys.executable, '-c', 'print %r' % output], logfile=self.logfile)
+        process.run()
+        process.wait()
+        return process
+
+    def test_quit(self):
+        """the log is complete and closed as soon as the process has quit, not a second later"""
+        start = time.time()
+        process = self.run_process('__startTimestamp1__endTimestamp')
+        self.assertTrue(process.waitForReady())
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue('__endAfterTerminationTimestamp' in file(self.logfile).read())
+
+    def test_processes_left(self):
+        """stray processes are waited for, for up to the timeout"""
+        left = [['firefox'], ['firefox'], []]
+        process = self.run_process('__startTimestamp1__endTimestamp')
+        self.assertTrue(process.waitForReady(lambda: left.pop(0), interval=0.01))
+        self.assertEqual(left, [])
+        self.assertFalse(process.waitForReady(lambda: ['firefox'], timeout=0.1, interval=0.01))
+
+    def test_quit_timeout(self):
+        """a browser that doesn't quit after ending the test is killed after 4 seconds"""
+        process = talosProcess([sys.executable, '-c', 'import time; print "__startTimestamp1__endTimestamp"; import sys; sys.stdout.flush(); time.sleep(30)'],
+                               logfile=self.logfile)
+        start = time.time()
+        process.run()
+        process.wait()
+        self.assertTrue(process.waitForReady())
+        self.assertTrue(3.5 < time.time() - start < 5)
+        self.assertTrue('__endAfterTerminationTimestamp' in file(self.logfile).read())
+
+    def test_no_end(self):
+        """the log is closed when the process quits without ending the test"""
+        process = self.run_process('__FAIL')
+        self.assertTrue(process.waitForReady())
+        self.assertEqual(file(self.logfile).read(), '__FAIL\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+test running parallel-safe tests on workers
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from mozprocess import pid as mozpid
+from talos import workers
+from talos.ffprocess import FFProcess
+from talos.utils import talosError
+
+def run_test(browser_config, test_config):
+    """stand-in for running a test: returns its name, the session it ran in and whether it was isolated"""
+    time.sleep(test_config.get('sleep', 0))
+    while test_config.get('after') and not os.path.exists(test_config['after']):
+        time.sleep(0.01) # another test is under way
+    if test_config.get('hang'):
+        # a browser, in a process group of its own, that doesn't quit
+        browser = subprocess.Popen(['sleep', '60'], preexec_fn=lambda: os.setpgid(0, 0))
+        file(test_config['hang'], 'w').write(str(browser.pid))
+        time.sleep(60)
+    if test_config.get('fail'):
+        raise talosError("failed " + test_config['name'])
+    return test_config['name'], os.getsid(0), browser_config['isolated']
+
+def running(pid):
+    """whether a process is running, rather than gone or a zombie"""
+    try:
+        return file('/proc/%d/stat' % pid).read().rsplit(')', 1)[-1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+class TestWorkers(unittest.TestCase):
+
+    browser_config = {'preferences': {}, 'env': {}}
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.stop_timeout = workers.Worker.stop_timeout
+        workers.Worker.stop_timeout = 0.5
+
+    def tearDown(self):
+        workers.Worker.stop_timeout = self.stop_timeout
+        shutil.rmtree(self.tempdir)
+
+    def test_partition(self):
+        """tests marked parallel-safe run on workers, unless they have counters"""
+        tests = [{'name': 'ts'},
+                 {'name': 'tsvg', 'parallel_safe': True, 'linux_counters': []},
+                 {'name': 'tp5n', 'parallel_safe': False},
+                 {'name': 'kraken', 'parallel_safe': True, 'linux_counters': ['Private Bytes']},
+                 {'name': 'dromaeo', 'parallel_safe': True}]
+        self.assertEqual(workers.partition(tests), ([0, 2, 3], [1, 4]))
+
+    def test_cpu_sets(self):
+        self.assertEqual(workers.cpu_sets(2, 8), [[0, 1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual(workers.cpu_sets(3, 8), [[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(workers.cpu_sets(3, 2), [[0], [1], [0]])
+
+    def test_run(self):
+        """results come in the order of the tests, from workers in sessions of their own"""
+        tests = [{'name': 'a', 'sleep': 0.5}, {'name': 'b'}, {'name': 'c'}, {'name': 'd'}]
+        results = list(workers.run(tests, [0, 1, 3], self.browser_config, 2, run_test=run_test))
+        self.assertEqual([(index, name) for index, (name, session, isolated) in results],
+                         [(0, 'a'), (1, 'b'), (3, 'd')])
+        sessions = set([session for index, (name, session, isolated) in results])
+        self.assertEqual(len(sessions), 2)
+        self.assertFalse(os.getsid(0) in sessions)
+        self.assertTrue(all([isolated for index, (name, session, isolated) in results]))
+
+    def test_failure(self):
+        """the first test to fail is raised once the results of those before it are in"""
+        tests = [{'name': 'a', 'sleep': 0.5}, {'name': 'b', 'fail': True}, {'name': 'c'}, {'name': 'd', 'fail': True}]
+        results = []
+        try:
+            for index, test_results in workers.run(tests, range(4), self.browser_config, 2, run_test=run_test):
+                results.append(index)
+        except talosError, e:
+            self.assertEqual(str(e), "failed b")
+        else:
+            self.fail("no failure raised")
+        self.assertEqual(results, [0])
+
+    def test_terminate(self):
+        """a worker still running a test when the rest are abandoned is terminated with its whole session"""
+        pidfile = os.path.join(self.tempdir, 'browser.pid')
+        tests = [{'name': 'a', 'after': pidfile, 'fail': True}, {'name': 'b', 'hang': pidfile}]
+        self.assertRaises(talosError, list, workers.run(tests, range(2), self.browser_config, 2, run_test=run_test))
+        pid = int(file(pidfile).read())
+        deadline = time.time() + 5
+        while running(pid):
+            self.assertTrue(time.time() < deadline, "browser %d left running" % pid)
+            time.sleep(0.05)
+
+    def test_isolate(self):
+        """an isolated process only sees the processes of its session"""
+        ffprocess = FFProcess()
+        ffprocess.isolate()
+        own = subprocess.Popen(['sleep', '30'])
+        other = subprocess.Popen(['sleep', '30'], preexec_fn=os.setsid)
+        try:
+            try:
+                found = own.pid in mozpid.get_pids('sleep')
+            except Exception:
+                found = False
+            if not found:
+                self.skipTest("the output of ps can't be parsed here")
+            pids = ffprocess.get_pids('sleep')
+            self.assertTrue(own.pid in pids)
+            self.assertFalse(other.pid in pids)
+        finally:
+            for process in own, other:
+                process.kill()
+                process.wait()
+
+if __name__ == '__main__':
+    unittest.main()